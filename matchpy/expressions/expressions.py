@@ -49,6 +49,7 @@ f(a)
 """
 from abc import ABCMeta
 import keyword
+import zlib
 from enum import Enum, EnumMeta
 # pylint: disable=unused-import
 from typing import (Callable, Iterator, List, NamedTuple, Optional, Set, Tuple, TupleMeta, Type, Union)
@@ -69,6 +70,23 @@ ExpressionsWithPos = Iterator[Tuple['Expression', Tuple[int, ...]]]
 
 MultisetOfStr = Multiset
 MultisetOfVariables = Multiset
+Signature = Tuple[int, int, int]
+
+_NATIVE_SIGNATURE = (0, 1, 1)
+
+
+def _name_bit(name) -> int:
+    # crc32 is used instead of hash() to get the same bits in every process, as cached signatures get pickled
+    return 1 << (zlib.crc32(str(name).encode('utf-8')) & 63)
+
+
+def _operation_name_bits(operation: type) -> int:
+    # An operation also matches patterns with any of its base operations as head, so all their names are included
+    mask = 0
+    for cls in operation.__mro__:
+        if issubclass(cls, Operation) and cls.name is not None:
+            mask |= _name_bit(cls.name)
+    return mask
 
 
 class Expression:
@@ -128,6 +146,23 @@ class Expression:
         """
         pass
 
+    @cached_property
+    def signature(self) -> Signature:
+        """A signature used to quickly rule out that a pattern can match a subject.
+
+        The signature is a tuple of a 64 bit mask with one bit set per symbol and operation name occurring in the
+        expression (including the names of the base operations of an operation), the number of subexpressions and
+        the depth of the expression. For expressions containing wildcards, the mask only contains the names that are
+        part of every match, and the size and depth are lower bounds. Hence, a pattern can only match a subject if
+        every bit of the pattern's mask is also set in the subject's mask and the subject's size and depth are at
+        least as large as those of the pattern (see :func:`~matchpy.expressions.functions.signature_may_match`).
+        """
+        return self._signature()
+
+    @staticmethod
+    def _signature() -> Signature:
+        return 0, 1, 1
+
     @cached_property
     def is_constant(self) -> bool:
         """True, iff the expression does not contain any wildcards."""
@@ -553,6 +588,18 @@ class Operation(Expression, metaclass=_OperationMeta):
     def _is_constant(self) -> bool:
         return all(x.is_constant for x in self.operands)
 
+    def _signature(self) -> Signature:
+        mask = size = depth = 0
+        for operand in self.operands:
+            operand_mask, operand_size, operand_depth = getattr(operand, 'signature', _NATIVE_SIGNATURE)
+            mask |= operand_mask
+            size += operand_size
+            depth = max(depth, operand_depth)
+        if self.one_identity and not self.is_constant:
+            # The operation might match a single operand without the operation itself
+            return mask, size, depth
+        return mask | _operation_name_bits(type(self)), size + 1, depth + 1
+
     def _is_syntactic(self) -> bool:
         if self.associative or self.commutative:
             return False
@@ -666,6 +713,9 @@ class Symbol(Atom):
     def collect_symbols(self, symbols):
         symbols.add(self.name)
 
+    def _signature(self) -> Signature:
+        return _name_bit(self.name), 1, 1
+
     def with_renamed_vars(self, renaming) -> 'Symbol':
         return type(self)(self.name, variable_name=renaming.get(self.variable_name, self.variable_name))
 
@@ -734,6 +784,10 @@ class Wildcard(Atom):
     def _is_syntactic(self) -> bool:
         return self.fixed_size
 
+    def _signature(self) -> Signature:
+        size = self.min_count if self.optional is None else 0
+        return 0, size, min(size, 1)
+
     def with_renamed_vars(self, renaming) -> 'Wildcard':
         return type(self)(
             self.min_count, self.fixed_size, variable_name=renaming.get(self.variable_name, self.variable_name)
@@ -962,6 +1016,11 @@ class Pattern:
         """True, iff the pattern is :term:`syntactic`."""
         return self.expression.is_syntactic
 
+    @property
+    def signature(self):
+        """The :attr:`~Expression.signature` of the pattern's expression."""
+        return self.expression.signature
+
     @property
     def local_constraints(self):
         """The subset of the patterns contrainst which are local.
@@ -1,4 +1,4 @@
-from typing import Dict
+from typing import Callable, Dict, NamedTuple, Optional, Tuple
 
 from .expressions import (
     Expression, Operation, Wildcard, AssociativeOperation, CommutativeOperation, SymbolWildcard, Pattern, OneIdentityOperation
@@ -7,7 +7,7 @@ from .expressions import (
 __all__ = [
     'is_constant', 'is_syntactic', 'get_head', 'match_head', 'preorder_iter', 'preorder_iter_with_position',
     'is_anonymous', 'contains_variables_from_set', 'register_operation_factory', 'create_operation_expression',
-    'rename_variables', 'op_iter', 'op_len', 'register_operation_iterator', 'get_variables'
+    'rename_variables', 'op_iter', 'op_len', 'register_operation_iterator', 'get_variables', 'signature_may_match'
 ]
 
 
@@ -61,6 +61,28 @@ def match_head(subject, pattern):
     return issubclass(subject_head, pattern_head)
 
 
+def signature_may_match(subject, pattern):
+    """Checks if the subject's :attr:`~.Expression.signature` is compatible with the pattern's.
+
+    If this is False, the pattern cannot match the subject. Native Python objects have no signature, so they are
+    always considered compatible:
+
+    >>> signature_may_match(f(a, b), f(a, x_))
+    True
+    >>> signature_may_match(f(a, b), f(c, x_))
+    False
+    >>> signature_may_match(f(a, b), f(x_, f(y_)))
+    False
+    """
+    if isinstance(pattern, Pattern):
+        pattern = pattern.expression
+    if not isinstance(subject, Expression) or not isinstance(pattern, Expression):
+        return True
+    subject_mask, subject_size, subject_depth = subject.signature
+    pattern_mask, pattern_size, pattern_depth = pattern.signature
+    return not pattern_mask & ~subject_mask and subject_size >= pattern_size and subject_depth >= pattern_depth
+
+
 def preorder_iter(expression):
     """Iterate over the expression in preorder."""
     yield expression
@@ -157,19 +179,57 @@ _operation_iterators = {
 }
 
 
+_TypeDispatch = NamedTuple('_TypeDispatch', [
+    ('heads', Tuple[type, ...]),
+    ('iterator', Callable),
+    ('length', Callable),
+    ('factory', Optional[Callable]),
+])  # yapf: disable
+
+_type_dispatch_cache = {}  # type: Dict[type, _TypeDispatch]
+
+
+def _get_type_dispatch(op_type: type) -> _TypeDispatch:
+    """Return the cached dispatch information for the given type.
+
+    The dispatch information consists of the type's bases (its MRO without :class:`object`) as well as the registered
+    operation iterator, length function and factory. It is computed once per type and reset whenever a new
+    iterator or factory is registered.
+    """
+    try:
+        return _type_dispatch_cache[op_type]
+    except KeyError:
+        pass
+    heads = tuple(base for base in op_type.__mro__ if base is not object)
+    iterator, length = iter, len
+    for parent in op_type.__mro__:
+        if parent in _operation_iterators:
+            iterator, length = _operation_iterators[parent]
+            break
+    factory = None
+    for parent in op_type.__mro__:
+        if parent in _operation_factories:
+            factory = _operation_factories[parent]
+            break
+    dispatch = _type_dispatch_cache[op_type] = _TypeDispatch(heads, iterator, length, factory)
+    return dispatch
+
+
 def register_operation_factory(operation, factory):
     _operation_factories[operation] = factory
+    _type_dispatch_cache.clear()
 
 
 def register_operation_iterator(operation, iterator=iter, length=len):
     _operation_iterators[operation] = (iterator, length)
+    _type_dispatch_cache.clear()
 
 
 def create_operation_expression(old_operation, new_operands, variable_name=True):
     operation = type(old_operation)
-    for parent in operation.__mro__:
-        if parent in _operation_factories:
-            return _operation_factories[parent](old_operation, new_operands, variable_name)
+    factory = _get_type_dispatch(operation).factory
+    if factory is not None:
+        return factory(old_operation, new_operands, variable_name)
     if variable_name is True:
         variable_name = getattr(old_operation, 'variable_name', None)
     if variable_name is False:
@@ -178,18 +238,8 @@ def create_operation_expression(old_operation, new_operands, variable_name=True)
 
 
 def op_iter(operation):
-    op_type = type(operation)
-    for parent in op_type.__mro__:
-        if parent in _operation_iterators:
-            iterator, _ = _operation_iterators[parent]
-            return iterator(operation)
-    return iter(operation)
+    return _get_type_dispatch(type(operation)).iterator(operation)
 
 
 def op_len(operation):
-    op_type = type(operation)
-    for parent in op_type.__mro__:
-        if parent in _operation_iterators:
-            _, length = _operation_iterators[parent]
-            return length(operation)
-    return len(operation)
+    return _get_type_dispatch(type(operation)).length(operation)
@@ -19,7 +19,9 @@ from .expressions.expressions import (
     Expression, Operation, Pattern, Wildcard, SymbolWildcard, AssociativeOperation, CommutativeOperation
 )
 from .expressions.substitution import Substitution
-from .expressions.functions import preorder_iter_with_position, create_operation_expression, op_iter, op_len
+from .expressions.functions import (
+    preorder_iter, preorder_iter_with_position, create_operation_expression, op_iter, op_len, rename_variables
+)
 from .matching.one_to_one import match
 
 __all__ = ['substitute', 'replace', 'replace_all', 'replace_many', 'is_match', 'ReplacementRule', 'replace_all_post_order']
@@ -316,6 +318,10 @@ def is_match(subject: Expression, pattern: Expression) -> bool:
     """
     Check whether the given *subject* matches given *pattern*.
 
+    Variables that occur only once in the pattern and are not used by any constraint do not need a value to decide
+    whether the pattern matches. Such wildcards are treated as anonymous wildcards, so that their values are not
+    recorded.
+
     Args:
         subject:
             The subject.
@@ -325,4 +331,23 @@ def is_match(subject: Expression, pattern: Expression) -> bool:
     Returns:
         True iff the subject matches the pattern.
     """
-    return any(True for _ in match(subject, pattern))
+    return any(True for _ in match(subject, _make_unneeded_variables_anonymous(pattern)))
+
+
+def _make_unneeded_variables_anonymous(pattern: Pattern) -> Pattern:
+    if pattern.global_constraints:
+        return pattern
+    counts = Multiset()
+    needed = set()
+    for expression in preorder_iter(pattern.expression):
+        variable_name = getattr(expression, 'variable_name', None)
+        if variable_name is not None:
+            counts.add(variable_name)
+            if isinstance(expression, SymbolWildcard) or getattr(expression, 'optional', None) is not None:
+                needed.add(variable_name)
+    for constraint in pattern.local_constraints:
+        needed.update(constraint.variables)
+    renaming = {name: None for name, count in counts.items() if count == 1 and name not in needed}
+    if not renaming:
+        return pattern
+    return Pattern(rename_variables(pattern.expression, renaming), *pattern.constraints)
@@ -5,11 +5,13 @@ from . import many_to_one
 from . import bipartite
 from . import one_to_one
 from . import syntactic
+from . import parallel
 
 # pylint: disable=wildcard-import
 from .many_to_one import *
 from .bipartite import *
 from .one_to_one import *
 from .syntactic import *
+from .parallel import *
 
-__all__ = many_to_one.__all__ + bipartite.__all__ + one_to_one.__all__ + syntactic.__all__
+__all__ = many_to_one.__all__ + bipartite.__all__ + one_to_one.__all__ + syntactic.__all__ + parallel.__all__
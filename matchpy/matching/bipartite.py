@@ -5,17 +5,20 @@ The `BipartiteGraph` class is used to represent a bipartite graph as a dictionar
 `BipartiteGraph.find_matching()` can be used to find a maximum matching in such a graph.
 
 The function `enum_maximum_matchings_iter` can be used to enumerate all maximum matchings of a `BipartiteGraph`.
+The function `enum_block_matchings_iter` enumerates matchings where the nodes stand for multiple identical copies.
 """
 
-from typing import (Dict, Generic, Hashable, Iterator, List, Set, Tuple, TypeVar, Union, cast, MutableMapping)
+from typing import (
+    Any, Callable, Dict, FrozenSet, Generic, Hashable, Iterable, Iterator, List, Mapping, MutableMapping, Optional,
+    Set, Tuple, TypeVar, Union
+)
 
 try:
     from graphviz import Digraph, Graph
 except ImportError:
     Digraph = Graph = None
-from hopcroftkarp import HopcroftKarp
 
-__all__ = ['BipartiteGraph', 'enum_maximum_matchings_iter']
+__all__ = ['BipartiteGraph', 'BipartiteGraphView', 'enum_maximum_matchings_iter', 'enum_block_matchings_iter']
 
 T = TypeVar('T')
 TLeft = TypeVar('TLeft', bound=Hashable)
@@ -31,90 +34,133 @@ LEFT = 0
 RIGHT = 1
 
 
-class BipartiteGraph(Generic[TLeft, TRight, TEdgeValue], MutableMapping[Tuple[TLeft, TRight], TEdgeValue]):
-    """A bipartite graph representation.
+def _hopcroft_karp(adjacency: List[List[int]], right_count: int, match_left: Optional[List[int]]=None) -> List[int]:
+    """Find a maximum matching in a bipartite graph given as adjacency lists using the Hopcroft-Karp algorithm.
 
-    This class is a specialized dictionary, where each edge is represented by a 2-tuple that is used as a key in the
-    dictionary. The value can either be `True` or any value that you want to associate with the edge.
+    The nodes of both parts are represented by consecutive integers starting at 0:
 
-    For example, the edge from 1 to 2 with a label 42 would be set like this:
+    >>> _hopcroft_karp([[0, 1], [0]], 2)
+    [1, 0]
 
-    >>> graph = BipartiteGraph()
-    >>> graph[1, 2] = 42
+    Args:
+        adjacency:
+            For every node of the left part, the list of adjacent nodes in the right part.
+        right_count:
+            The number of nodes in the right part.
+        match_left:
+            An optional initial matching that is extended to a maximum matching. It has the same format as the result.
+
+    Returns:
+        For every node of the left part, the index of the matched node of the right part or -1 if it is unmatched.
     """
+    left_count = len(adjacency)
+    match_left = [-1] * left_count if match_left is None else list(match_left)
+    match_right = [-1] * right_count
+    for left, right in enumerate(match_left):
+        if right != -1:
+            match_right[right] = left
+    while True:
+        # Breadth first search from the unmatched left nodes to find the length of the shortest augmenting paths
+        dist = [-1] * left_count
+        queue = [left for left in range(left_count) if match_left[left] == -1]
+        for left in queue:
+            dist[left] = 0
+        limit = -1
+        index = 0
+        while index < len(queue):
+            left = queue[index]
+            index += 1
+            if limit != -1 and dist[left] >= limit:
+                break
+            for right in adjacency[left]:
+                other = match_right[right]
+                if other == -1:
+                    if limit == -1:
+                        limit = dist[left]
+                elif dist[other] == -1:
+                    dist[other] = dist[left] + 1
+                    queue.append(other)
+        if limit == -1:
+            return match_left
+        # Depth first search along the layers to find a maximal set of disjoint shortest augmenting paths
+        pointers = [0] * left_count
+        for root in range(left_count):
+            if match_left[root] != -1 or dist[root] != 0:
+                continue
+            stack = [root]
+            path = []
+            while stack:
+                left = stack[-1]
+                edges = adjacency[left]
+                while pointers[left] < len(edges):
+                    right = edges[pointers[left]]
+                    pointers[left] += 1
+                    other = match_right[right]
+                    if other == -1:
+                        if dist[left] == limit:
+                            path.append(right)
+                            for path_left, path_right in zip(stack, path):
+                                match_left[path_left] = path_right
+                                match_right[path_right] = path_left
+                            stack = []
+                            break
+                    elif dist[other] == dist[left] + 1:
+                        path.append(right)
+                        stack.append(other)
+                        break
+                else:
+                    # Dead end, so the node is removed from the layered graph for this phase
+                    dist[left] = -1
+                    stack.pop()
+                    if path:
+                        path.pop()
 
-    __slots__ = ('_edges', '_matching', '_dfs_paths', '_dfs_parent', '_left', '_right', '_graph')
 
-    def __init__(self, *args, **kwargs):
-        self._edges = dict(*args, **kwargs)
-        self._left = set(l for (l, _) in self._edges.keys())
-        self._right = set(r for (_, r) in self._edges.keys())
-        self._graph = {}
-        for l, r in self._edges:
-            self._graph.setdefault((LEFT, l), set()).add((RIGHT, r))
-            self._graph.setdefault((RIGHT, r), set()).add((LEFT, l))
-
-        self._matching = {}
-        self._dfs_paths = []
-        self._dfs_parent = {}
+class _BipartiteGraphBase(Generic[TLeft, TRight, TEdgeValue], Mapping[Tuple[TLeft, TRight], TEdgeValue]):
+    """Common methods of bipartite graphs and their views."""
 
-    def __setitem__(self, key: Edge, value: TEdgeValue) -> None:
-        if not isinstance(key, tuple) or len(key) != 2:
-            raise TypeError("The edge must be a 2-tuple")
-        self._edges.__setitem__(key, value)
-        self._left.add(key[0])
-        self._right.add(key[1])
-        self._graph.setdefault((LEFT, key[0]), set()).add((RIGHT, key[1]))
-        self._graph.setdefault((RIGHT, key[1]), set()).add((LEFT, key[0]))
+    __slots__ = ()
 
-    def __getitem__(self, key: Edge) -> TEdgeValue:
-        if not isinstance(key, tuple) or len(key) != 2:
-            raise TypeError("The edge must be a 2-tuple")
-        return self._edges.__getitem__(key)
+    def _items(self) -> Iterator[Tuple[TLeft, TRight, TEdgeValue]]:
+        """Iterate over the edges as ``(left, right, value)`` with the edges of every left node yielded together."""
+        raise NotImplementedError()
 
-    def __delitem__(self, key: Edge) -> None:
-        if not isinstance(key, tuple) or len(key) != 2:
-            raise TypeError("The edge must be a 2-tuple")
-        self._edges.__delitem__(key)
-        if all(l != key[0] for (l, _) in self._edges):
-            self._left.remove(key[0])
-        if all(r != key[1] for (_, r) in self._edges):
-            self._right.remove(key[1])
-        self._graph[(LEFT, key[0])].remove((RIGHT, key[1]))
-        self._graph[(RIGHT, key[1])].remove((LEFT, key[0]))
+    def _get_arrays(self) -> Tuple[List[TLeft], List[TRight], List[List[int]], List[List[TEdgeValue]]]:
+        """Returns the graph as integer indexed adjacency lists.
+
+        The nodes are indexed by consecutive integers in the order of their first edge. For every left node, the list
+        of the indices of its adjacent right nodes and the list of the respective edge values are returned.
+        """
+        left_nodes = []  # type: List[TLeft]
+        right_indices = {}  # type: Dict[TRight, int]
+        adjacency = []  # type: List[List[int]]
+        values = []  # type: List[List[TEdgeValue]]
+        for left, right, value in self._items():
+            if not left_nodes or left_nodes[-1] != left:
+                left_nodes.append(left)
+                adjacency.append([])
+                values.append([])
+            if right not in right_indices:
+                right_indices[right] = len(right_indices)
+            adjacency[-1].append(right_indices[right])
+            values[-1].append(value)
+        return left_nodes, list(right_indices), adjacency, values
+
+    def __iter__(self):
+        return ((left, right) for left, right, _ in self._items())
 
     def edges_with_labels(self):
         """Returns a view on the edges with labels."""
-        return self._edges.items()
+        return self.items()
 
     def edges(self):
-        return self._edges.keys()
-
-    def clear(self):
-        self._edges.clear()
-        self._left.clear()
-        self._right.clear()
-        self._graph.clear()
-
-    def __copy__(self):
-        new_graph = type(self)()
-        new_graph._edges = self._edges.copy()
-        new_graph._left = self._left.copy()
-        new_graph._right = self._right.copy()
-        new_graph._graph = self._graph.copy()
-        return new_graph
-
-    def __iter__(self):
-        return self._edges.__iter__()
-
-    def __len__(self):
-        return self._edges.__len__()
+        return self.keys()
 
     def __eq__(self, other):
         if isinstance(other, dict):
-            return self._edges == other
-        elif isinstance(self, type(other)):
-            return self._edges == other._edges
+            return dict(self.items()) == other
+        elif isinstance(other, _BipartiteGraphBase):
+            return dict(self.items()) == dict(other.items())
         else:
             return NotImplemented
 
@@ -126,7 +172,7 @@ class BipartiteGraph(Generic[TLeft, TRight, TEdgeValue], MutableMapping[Tuple[TL
         nodes_left = {}  # type: Dict[TLeft, str]
         nodes_right = {}  # type: Dict[TRight, str]
         node_id = 0
-        for (left, right), value in self._edges.items():
+        for left, right, value in self._items():
             if left not in nodes_left:
                 name = 'node{:d}'.format(node_id)
                 nodes_left[left] = name
@@ -141,52 +187,235 @@ class BipartiteGraph(Generic[TLeft, TRight, TEdgeValue], MutableMapping[Tuple[TL
             graph.edge(nodes_left[left], nodes_right[right], edge_label)
         return graph
 
-    def find_matching(self) -> Dict[TLeft, TRight]:
+    def find_matching(self, initial: Optional[Dict[TLeft, TRight]]=None) -> Dict[TLeft, TRight]:
         """Finds a matching in the bipartite graph.
 
-        This is done using the Hopcroft-Karp algorithm with an implementation from the
-        `hopcroftkarp` package.
+        This is done using the Hopcroft-Karp algorithm on integer indexed adjacency lists. For a
+        :class:`BipartiteGraph`, these are cached until the graph is changed.
+
+        Args:
+            initial:
+                An optional matching (e.g. of a previous version of the graph) to start from. Its edges that are not
+                part of the graph are ignored.
 
         Returns:
             A dictionary where each edge of the matching is represented by a key-value pair
             with the key being from the left part of the graph and the value from te right part.
         """
-        # The directed graph is represented as a dictionary of edges
-        # The key is the tail of all edges which are represented by the value
-        # The value is a set of heads for the all edges originating from the tail (key)
-        # In addition, the graph stores which part of the bipartite graph a node originated from
-        # to avoid problems when a value exists in both halfs.
-        # Only one direction of the undirected edge is needed for the HopcroftKarp class
-        directed_graph = {}  # type: Dict[Tuple[int, TLeft], Set[Tuple[int, TRight]]]
-
-        for (left, right) in self._edges:
-            tail = (LEFT, left)
-            head = (RIGHT, right)
-            if tail not in directed_graph:
-                directed_graph[tail] = {head}
-            else:
-                directed_graph[tail].add(head)
+        left_nodes, right_nodes, adjacency, _ = self._get_arrays()
+        match_left = None
+        if initial:
+            left_indices = {node: index for index, node in enumerate(left_nodes)}
+            right_indices = {node: index for index, node in enumerate(right_nodes)}
+            match_left = [-1] * len(left_nodes)
+            used = set()
+            for left, right in initial.items():
+                if (left, right) in self and right not in used:
+                    match_left[left_indices[left]] = right_indices[right]
+                    used.add(right)
+        match_left = _hopcroft_karp(adjacency, len(right_nodes), match_left)
+        return dict((left_nodes[left], right_nodes[right]) for left, right in enumerate(match_left) if right != -1)
+
+    def without_nodes(self, edge: Edge) -> 'BipartiteGraphView[TLeft, TRight, TEdgeValue]':
+        """Returns a view on this bipartite graph with the given edge and its adjacent nodes removed."""
+        return BipartiteGraphView(self).without_nodes(edge)
+
+    def without_edge(self, edge: Edge) -> 'BipartiteGraphView[TLeft, TRight, TEdgeValue]':
+        """Returns a view on this bipartite graph with the given edge removed."""
+        return BipartiteGraphView(self).without_edge(edge)
+
+    def limited_to(self, left: Iterable[TLeft],
+                   right: Iterable[TRight]) -> 'BipartiteGraphView[TLeft, TRight, TEdgeValue]':
+        """Returns a view on the induced subgraph where only the nodes from the given sets are included."""
+        return BipartiteGraphView(self).limited_to(left, right)
 
-        matching = HopcroftKarp(directed_graph).maximum_matching()
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, dict(self.items()))
 
-        # Filter out the partitions (LEFT and RIGHT) and only return the matching edges
-        # that go from LEFT to RIGHT
-        return dict((tail[1], head[1]) for tail, head in matching.items() if tail[0] == LEFT)
 
-    def without_nodes(self, edge: Edge) -> 'BipartiteGraph[TLeft, TRight, TEdgeValue]':
-        """Returns a copy of this bipartite graph with the given edge and its adjacent nodes removed."""
-        return BipartiteGraph(((n1, n2), v) for (n1, n2), v in self._edges.items() if n1 != edge[0] and n2 != edge[1])
+class BipartiteGraph(_BipartiteGraphBase[TLeft, TRight, TEdgeValue], MutableMapping[Tuple[TLeft, TRight], TEdgeValue]):
+    """A bipartite graph representation.
 
-    def without_edge(self, edge: Edge) -> 'BipartiteGraph[TLeft, TRight, TEdgeValue]':
-        """Returns a copy of this bipartite graph with the given edge removed."""
-        return BipartiteGraph((e2, v) for e2, v in self._edges.items() if edge != e2)
+    This class is a specialized dictionary, where each edge is represented by a 2-tuple that is used as a key in the
+    dictionary. The value can either be `True` or any value that you want to associate with the edge.
 
-    def limited_to(self, left: Set[TLeft], right: Set[TRight]) -> 'BipartiteGraph[TLeft, TRight, TEdgeValue]':
-        """Returns the induced subgraph where only the nodes from the given sets are included."""
-        return BipartiteGraph(((n1, n2), v) for (n1, n2), v in self._edges.items() if n1 in left and n2 in right)
+    For example, the edge from 1 to 2 with a label 42 would be set like this:
 
-    def __repr__(self):
-        return '{}({})'.format(self.__class__.__name__, self._edges)
+    >>> graph = BipartiteGraph()
+    >>> graph[1, 2] = 42
+
+    Internally, the nodes are numbered by consecutive integers and the edges are stored in an adjacency array of the
+    left nodes, which maps the indices of the adjacent right nodes to the edge values. The methods
+    :meth:`without_nodes`, :meth:`without_edge` and :meth:`limited_to` return a :class:`BipartiteGraphView` on the
+    subgraph instead of copying it:
+
+    >>> graph[1, 3] = 43
+    >>> graph.without_edge((1, 2))
+    BipartiteGraphView({(1, 3): 43})
+    """
+
+    __slots__ = ('_left_ids', '_right_ids', '_left_nodes', '_right_nodes', '_adjacency', '_degrees', '_size', '_arrays')
+
+    def __init__(self, *args, **kwargs):
+        self._left_ids = {}  # type: Dict[TLeft, int]
+        self._right_ids = {}  # type: Dict[TRight, int]
+        self._left_nodes = []  # type: List[TLeft]
+        self._right_nodes = []  # type: List[TRight]
+        self._adjacency = []  # type: List[Dict[int, TEdgeValue]]
+        self._degrees = []  # type: List[int]
+        self._size = 0
+        self._arrays = None
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def __setitem__(self, key: Edge, value: TEdgeValue) -> None:
+        if not isinstance(key, tuple) or len(key) != 2:
+            raise TypeError("The edge must be a 2-tuple")
+        left, right = key
+        left_id = self._left_ids.get(left, None)
+        if left_id is None:
+            left_id = self._left_ids[left] = len(self._left_nodes)
+            self._left_nodes.append(left)
+            self._adjacency.append({})
+        right_id = self._right_ids.get(right, None)
+        if right_id is None:
+            right_id = self._right_ids[right] = len(self._right_nodes)
+            self._right_nodes.append(right)
+            self._degrees.append(0)
+        edges = self._adjacency[left_id]
+        if right_id not in edges:
+            self._degrees[right_id] += 1
+            self._size += 1
+        edges[right_id] = value
+        self._arrays = None
+
+    def __getitem__(self, key: Edge) -> TEdgeValue:
+        if not isinstance(key, tuple) or len(key) != 2:
+            raise TypeError("The edge must be a 2-tuple")
+        try:
+            return self._adjacency[self._left_ids[key[0]]][self._right_ids[key[1]]]
+        except KeyError:
+            raise KeyError(key) from None
+
+    def __delitem__(self, key: Edge) -> None:
+        if not isinstance(key, tuple) or len(key) != 2:
+            raise TypeError("The edge must be a 2-tuple")
+        try:
+            right_id = self._right_ids[key[1]]
+            del self._adjacency[self._left_ids[key[0]]][right_id]
+        except KeyError:
+            raise KeyError(key) from None
+        self._degrees[right_id] -= 1
+        self._size -= 1
+        self._arrays = None
+
+    def _items(self):
+        right_nodes = self._right_nodes
+        for left, edges in zip(self._left_nodes, self._adjacency):
+            for right_id, value in edges.items():
+                yield left, right_nodes[right_id], value
+
+    def _get_arrays(self):
+        if self._arrays is None:
+            self._arrays = super(BipartiteGraph, self)._get_arrays()
+        return self._arrays
+
+    def clear(self):
+        self.__init__()
+
+    def __copy__(self):
+        new_graph = type(self)()
+        new_graph._left_ids = self._left_ids.copy()
+        new_graph._right_ids = self._right_ids.copy()
+        new_graph._left_nodes = self._left_nodes.copy()
+        new_graph._right_nodes = self._right_nodes.copy()
+        new_graph._adjacency = [edges.copy() for edges in self._adjacency]
+        new_graph._degrees = self._degrees.copy()
+        new_graph._size = self._size
+        new_graph._arrays = self._arrays
+        return new_graph
+
+    def __len__(self):
+        return self._size
+
+
+class BipartiteGraphView(_BipartiteGraphBase[TLeft, TRight, TEdgeValue]):
+    """A read-only view on a subgraph of a :class:`BipartiteGraph`.
+
+    The view does not copy the graph, so changes to the graph are reflected in the view. Views can be restricted
+    further in the same way as the graph itself:
+
+    >>> graph = BipartiteGraph({(0, 0): True, (0, 1): True, (1, 1): True})
+    >>> view = graph.limited_to({0, 1}, {1})
+    >>> view
+    BipartiteGraphView({(0, 1): True, (1, 1): True})
+    >>> view.without_nodes((0, 0))
+    BipartiteGraphView({(1, 1): True})
+    >>> del graph[1, 1]
+    >>> view
+    BipartiteGraphView({(0, 1): True})
+    """
+
+    __slots__ = ('_graph', '_left', '_right', '_removed_left', '_removed_right', '_removed_edges')
+
+    def __init__(self, graph: BipartiteGraph[TLeft, TRight, TEdgeValue]) -> None:
+        self._graph = graph
+        self._left = None  # type: Optional[FrozenSet[TLeft]]
+        self._right = None  # type: Optional[FrozenSet[TRight]]
+        self._removed_left = frozenset()  # type: FrozenSet[TLeft]
+        self._removed_right = frozenset()  # type: FrozenSet[TRight]
+        self._removed_edges = frozenset()  # type: FrozenSet[Edge]
+
+    def _copy_with(self, **changes) -> 'BipartiteGraphView[TLeft, TRight, TEdgeValue]':
+        view = BipartiteGraphView(self._graph)
+        for attribute in self.__slots__[1:]:
+            setattr(view, attribute, changes.get(attribute, getattr(self, attribute)))
+        return view
+
+    def _contains(self, left: TLeft, right: TRight) -> bool:
+        return (self._left is None or left in self._left) and left not in self._removed_left and \
+            (self._right is None or right in self._right) and right not in self._removed_right and \
+            (left, right) not in self._removed_edges
+
+    def __getitem__(self, key: Edge) -> TEdgeValue:
+        value = self._graph[key]
+        if not self._contains(*key):
+            raise KeyError(key)
+        return value
+
+    def _items(self):
+        graph = self._graph
+        if self._left is None:
+            left_ids = range(len(graph._left_nodes))
+        else:
+            left_ids = sorted(graph._left_ids[left] for left in self._left if left in graph._left_ids)
+        right_nodes = graph._right_nodes
+        for left_id in left_ids:
+            left = graph._left_nodes[left_id]
+            if left in self._removed_left:
+                continue
+            for right_id, value in graph._adjacency[left_id].items():
+                right = right_nodes[right_id]
+                if (self._right is None or right in self._right) and right not in self._removed_right and \
+                        (left, right) not in self._removed_edges:
+                    yield left, right, value
+
+    def __len__(self):
+        return sum(1 for _ in self._items())
+
+    def without_nodes(self, edge: Edge) -> 'BipartiteGraphView[TLeft, TRight, TEdgeValue]':
+        return self._copy_with(
+            _removed_left=self._removed_left | {edge[0]}, _removed_right=self._removed_right | {edge[1]}
+        )
+
+    def without_edge(self, edge: Edge) -> 'BipartiteGraphView[TLeft, TRight, TEdgeValue]':
+        return self._copy_with(_removed_edges=self._removed_edges | {edge})
+
+    def limited_to(self, left: Iterable[TLeft],
+                   right: Iterable[TRight]) -> 'BipartiteGraphView[TLeft, TRight, TEdgeValue]':
+        left = frozenset(left) if self._left is None else self._left.intersection(left)
+        right = frozenset(right) if self._right is None else self._right.intersection(right)
+        return self._copy_with(_left=left, _right=right)
 
 
 class _DirectedMatchGraph(Dict[Node, NodeSet], Generic[TLeft, TRight]):
@@ -230,158 +459,435 @@ class _DirectedMatchGraph(Dict[Node, NodeSet], Generic[TLeft, TRight]):
         return graph
 
     def find_cycle(self) -> NodeList:
-        visited = cast(NodeSet, set())
-        for n in self:
-            cycle = self._find_cycle(n, cast(NodeList, []), visited)
-            if cycle:
-                return cycle
-        return cast(NodeList, [])
-
-    def _find_cycle(self, node: Node, path: NodeList, visited: NodeSet) -> NodeList:
-        if node in visited:
-            try:
-                index = path.index(node)
-                return path[index:]
-            except ValueError:
-                return cast(NodeList, [])
-
-        visited.add(node)
-
-        if node not in self:
-            return cast(NodeList, [])
-
-        for other in self[node]:
-            cycle = self._find_cycle(other, path + [node], visited)
-            if cycle:
-                return cycle
-
-        return cast(NodeList, [])
-
-
-def enum_maximum_matchings_iter(graph: BipartiteGraph[TLeft, TRight, TEdgeValue]) -> Iterator[Dict[TLeft, TRight]]:
-    matching = graph.find_matching()
-    if matching:
-        yield matching
-        graph = graph.__copy__()
-        yield from _enum_maximum_matchings_iter(graph, matching, _DirectedMatchGraph(graph, matching))
-
-
-def _enum_maximum_matchings_iter(graph: BipartiteGraph[TLeft, TRight, TEdgeValue], matching: Dict[TLeft, TRight],
-                                 directed_match_graph: _DirectedMatchGraph[TLeft, TRight]) \
-        -> Iterator[Dict[TLeft, TRight]]:
-    # Algorithm described in "Algorithms for Enumerating All Perfect, Maximum and Maximal Matchings in Bipartite Graphs"
-    # By Takeaki Uno in "Algorithms and Computation: 8th International Symposium, ISAAC '97 Singapore,
-    # December 17-19, 1997 Proceedings"
-    # See http://dx.doi.org/10.1007/3-540-63890-3_11
+        return _find_cycle(self, lambda node: self.get(node, ()))
 
-    # Step 1
-    if len(graph) == 0:
-        return
 
-    # Step 2
-    # Find a circle in the directed matching graph
-    # Note that this circle alternates between nodes from the left and the right part of the graph
-    raw_cycle = directed_match_graph.find_cycle()
+def _find_cycle(nodes: Iterable[T], successors: Callable[[T], Iterable[T]]) -> List[T]:
+    """Find a cycle in a directed graph using an iterative depth first search.
 
-    if raw_cycle:
-        # Make sure the circle "starts"" in the the left part
-        # If not, start the circle from the second node, which is in the left part
-        if raw_cycle[0][0] != LEFT:
-            cycle = tuple([raw_cycle[-1][1]] + list(x[1] for x in raw_cycle[:-1]))
-        else:
-            cycle = tuple(x[1] for x in raw_cycle)
+    Every node and edge is visited at most once, so this takes linear time in the size of the graph:
 
-        # Step 3 - TODO: Properly find right edge? (to get complexity bound)
-        edge = cast(Edge, cycle[:2])
+    >>> _find_cycle([0, 1, 2, 3], lambda node: {0: [1], 1: [2, 3], 3: [1]}.get(node, []))
+    [1, 3]
 
-        # Step 4
-        # already done because we are not really finding the optimal edge
+    Args:
+        nodes:
+            The nodes to start the search from.
+        successors:
+            A function that returns the heads of all the edges with the given node as tail.
 
-        # Step 5
-        # Construct new matching M' by flipping edges along the cycle, i.e. change the direction of all the
-        # edges in the circle
-        new_match = matching.copy()
-        for i in range(0, len(cycle), 2):
-            new_match[cycle[i]] = cycle[i - 1]  # type: ignore
+    Returns:
+        The nodes of a cycle in the order of its edges or an empty list if the graph is acyclic.
+    """
+    on_path = {}  # type: Dict[T, bool]
+    for start in nodes:
+        if start in on_path:
+            continue
+        on_path[start] = True
+        path = [start]
+        stack = [iter(successors(start))]
+        while stack:
+            for node in stack[-1]:
+                node_on_path = on_path.get(node, None)
+                if node_on_path is None:
+                    on_path[node] = True
+                    path.append(node)
+                    stack.append(iter(successors(node)))
+                    break
+                if node_on_path:
+                    return path[path.index(node):]
+            else:
+                on_path[path.pop()] = False
+                stack.pop()
+    return []
 
-        yield new_match
 
-        # Construct G+(e) and G-(e)
-        old_value = graph[edge]
-        del graph[edge]
+def enum_maximum_matchings_iter(graph: BipartiteGraph[TLeft, TRight, TEdgeValue]) -> Iterator[Dict[TLeft, TRight]]:
+    """Enumerate all maximum matchings of the given bipartite graph.
 
-        # Step 7
-        # Recurse with the new matching M' but without the edge e
-        directed_match_graph_minus = _DirectedMatchGraph(graph, new_match)
+    >>> graph = BipartiteGraph({(0, 0): True, (0, 1): True, (1, 1): True})
+    >>> sorted(sorted(matching.items()) for matching in enum_maximum_matchings_iter(graph))
+    [[(0, 0), (1, 1)]]
+    >>> del graph[1, 1]
+    >>> sorted(sorted(matching.items()) for matching in enum_maximum_matchings_iter(graph))
+    [[(0, 0)], [(0, 1)]]
 
-        yield from _enum_maximum_matchings_iter(graph, new_match, directed_match_graph_minus)
+    The enumeration takes linear time in the size of the graph per matching. Changing the graph during the enumeration
+    does not affect it.
 
-        graph[edge] = old_value
+    Args:
+        graph:
+            The bipartite graph.
 
-        # Step 6
-        # Recurse with the old matching M but without the edge e
+    Yields:
+        Every maximum matching once as a dictionary from the left nodes to the matched right nodes.
+    """
+    left_nodes, right_nodes, adjacency, _ = graph._get_arrays()
+    match_left = _hopcroft_karp(adjacency, len(right_nodes))
+    if all(right == -1 for right in match_left):
+        return
+    yield dict((left_nodes[left], right_nodes[right]) for left, right in enumerate(match_left) if right != -1)
+    for match_left in _enum_maximum_matchings_iter(adjacency, len(right_nodes), match_left):
+        yield dict((left_nodes[left], right_nodes[right]) for left, right in enumerate(match_left) if right != -1)
 
-        graph_plus = graph
 
-        edges = []
-        for left, right in list(graph_plus.edges()):
-            if left == edge[0] or right == edge[1]:
-                edges.append((left, right, graph_plus[left, right]))
-                del graph_plus[left, right]
+_ENUMERATE, _FLIP, _REMOVE_EDGE, _RESTORE_EDGE, _REMOVE_NODES, _RESTORE_NODES = range(6)
 
-        directed_match_graph_plus = _DirectedMatchGraph(graph_plus, matching)
 
-        yield from _enum_maximum_matchings_iter(graph_plus, matching, directed_match_graph_plus)
+def _enum_maximum_matchings_iter(adjacency: List[List[int]], right_count: int,
+                                 match_left: List[int]) -> Iterator[List[int]]:
+    # Algorithm described in "Algorithms for Enumerating All Perfect, Maximum and Maximal Matchings in Bipartite Graphs"
+    # By Takeaki Uno in "Algorithms and Computation: 8th International Symposium, ISAAC '97 Singapore,
+    # December 17-19, 1997 Proceedings"
+    # See http://dx.doi.org/10.1007/3-540-63890-3_11
+    #
+    # The graph and matching have the same format as for _hopcroft_karp(). All matchings except for the initial one
+    # are yielded as the same list that is changed in place between the iterations.
+    # Instead of copying the graph for the subproblems G+(e) and G-(e), nodes and edges are marked as removed and
+    # restored afterwards. Similarly, the matching is changed in place and changed back after the subproblem.
+    # The directed match graph D(G, M) is not built explicitly, but its edges are derived from the current graph and
+    # matching: Every matched left node has an edge to its right node, and every right node has edges to all the
+    # adjacent left nodes not matched to it. Hence, changes to the graph and matching are reflected immediately.
+    # The recursion is replaced by a stack of actions, so that every step (including finding the cycle) takes linear
+    # time in the size of the graph and every step yields a new matching except for the leaves of the binary recursion
+    # tree. So there is an amortized cost of O(|E| + |V|) per matching.
+    left_count = len(adjacency)
+    neighbours = [[] for _ in range(right_count)]  # type: List[List[int]]
+    for left, rights in enumerate(adjacency):
+        for right in rights:
+            neighbours[right].append(left)
+    match_left = list(match_left)
+    # Left nodes are represented by their index and right nodes by their index offset by the number of left nodes
+    removed_nodes = [False] * (left_count + right_count)
+    removed_edges = set()  # type: Set[Tuple[int, int]]
+
+    def successors(node):
+        if node < left_count:
+            right = match_left[node]
+            if right != -1:
+                yield left_count + right
+        else:
+            right = node - left_count
+            for left in neighbours[right]:
+                if not removed_nodes[left] and match_left[left] != right and (left, right) not in removed_edges:
+                    yield left
+
+    actions = [(_ENUMERATE, None)]  # type: List[Tuple[int, Any]]
+    while actions:
+        action, argument = actions.pop()
+        if action == _FLIP:
+            for left, right in argument:
+                match_left[left] = right
+        elif action == _REMOVE_EDGE:
+            removed_edges.add(argument)
+        elif action == _RESTORE_EDGE:
+            removed_edges.remove(argument)
+        elif action == _REMOVE_NODES:
+            removed_nodes[argument[0]] = removed_nodes[left_count + argument[1]] = True
+        elif action == _RESTORE_NODES:
+            removed_nodes[argument[0]] = removed_nodes[left_count + argument[1]] = False
+        else:
+            # Step 2
+            # Find a cycle in the directed match graph
+            # Note that this cycle alternates between nodes from the left and the right part of the graph
+            cycle = _find_cycle((n for n, removed in enumerate(removed_nodes) if not removed), successors)
 
-        for left, right, value in edges:
-            graph_plus[left, right] = value
+            if cycle:
+                # Make sure the cycle "starts" in the the left part
+                if cycle[0] >= left_count:
+                    cycle = cycle[1:] + cycle[:1]
+
+                # Step 3
+                # Any matched edge of the cycle works, because every step takes linear time anyway
+                edge = (cycle[0], cycle[1] - left_count)
+
+                # Step 5
+                # Construct new matching M' by flipping edges along the cycle, i.e. change the direction of all the
+                # edges in the cycle
+                old_match = [(cycle[i], cycle[i + 1] - left_count) for i in range(0, len(cycle), 2)]
+                for i in range(0, len(cycle), 2):
+                    match_left[cycle[i]] = cycle[i - 1] - left_count
+
+                yield match_left
+
+                # Step 7: Recurse with the new matching M' but without the edge e
+                # Step 6: Recurse with the old matching M but without the nodes of the edge e
+                actions.extend(
+                    reversed([
+                        (_REMOVE_EDGE, edge), (_ENUMERATE, None), (_RESTORE_EDGE, edge), (_FLIP, old_match),
+                        (_REMOVE_NODES, edge), (_ENUMERATE, None), (_RESTORE_NODES, edge)
+                    ])
+                )
 
-    else:
-        # Step 8
-        # Find feasible path of length 2 in D(graph, matching)
-        # This path has the form left1 -> right -> left2
-        # left1 must be in the left part of the graph and in matching
-        # right must be in the right part of the graph
-        # left2 is also in the left part of the graph and but must not be in matching
-        left1 = None  # type: TLeft
-        left2 = None  # type: TLeft
-        right = None  # type: TRight
-
-        for part1, node1 in directed_match_graph:
-            if part1 == LEFT and node1 in matching:
-                left1 = cast(TLeft, node1)
-                right = matching[left1]
-                if (RIGHT, right) in directed_match_graph:
-                    for _, node2 in directed_match_graph[(RIGHT, right)]:
-                        if node2 not in matching:
-                            left2 = cast(TLeft, node2)
+            else:
+                # Step 8
+                # Find feasible path of length 2 in D(graph, matching) starting or ending in an unmatched node
+                # This path has either the form left1 -> right -> left2 with left1 in matching and left2 not in
+                # matching or the form right2 -> left1 -> right with right in matching and right2 not in matching.
+                # In both cases, the new edge e is (left2, right) or (left1, right2) respectively
+                matched_right = [False] * right_count
+                for right in match_left:
+                    if right != -1:
+                        matched_right[right] = True
+                edge = new_match = old_match = None
+                for left1, right in enumerate(match_left):
+                    if right == -1 or removed_nodes[left1]:
+                        continue
+                    for left2 in neighbours[right]:
+                        if match_left[left2] == -1 and not removed_nodes[left2] \
+                                and (left2, right) not in removed_edges:
+                            edge = (left2, right)
+                            new_match = [(left1, -1), (left2, right)]
+                            old_match = [(left1, right), (left2, -1)]
                             break
-                    if left2 is not None:
+                    if edge is not None:
                         break
+                else:
+                    for right2, matched in enumerate(matched_right):
+                        if matched or removed_nodes[left_count + right2]:
+                            continue
+                        for left1 in neighbours[right2]:
+                            if match_left[left1] != -1 and not removed_nodes[left1] \
+                                    and (left1, right2) not in removed_edges:
+                                edge = (left1, right2)
+                                new_match = [(left1, right2)]
+                                old_match = [(left1, match_left[left1])]
+                                break
+                        if edge is not None:
+                            break
 
-        if left2 is None:
+                if edge is None:
+                    continue
+
+                # Construct M' by exchanging the direction of the path
+                for left, right in new_match:
+                    match_left[left] = right
+
+                yield match_left
+
+                # Step 9: Recurse with the new matching M' but without the nodes of the edge e
+                # Step 10: Recurse with the old matching M but without the edge e
+                actions.extend(
+                    reversed([
+                        (_REMOVE_NODES, edge), (_ENUMERATE, None), (_RESTORE_NODES, edge), (_FLIP, old_match),
+                        (_REMOVE_EDGE, edge), (_ENUMERATE, None), (_RESTORE_EDGE, edge)
+                    ])
+                )
+
+
+def enum_block_matchings_iter(
+        graph: BipartiteGraph[TLeft, TRight, TEdgeValue],
+        left_counts: Dict[TLeft, int],
+        right_counts: Dict[TRight, int],
+        interchangeable: Set[TRight]=frozenset(),
+        step: Any=None
+) -> Iterator[Tuple[Dict[Edge, int], Dict[TLeft, int]]]:
+    """Enumerate the matchings of a bipartite graph whose nodes stand for blocks of identical copies.
+
+    Every node of the graph stands for as many identical copies as given by its count and there is an edge between
+    every copy of two adjacent nodes. Only the matchings which match all the copies of the right nodes are enumerated.
+    Matchings which only differ by exchanging identical copies are considered equal and only yielded once, so a matching
+    is described by the number of copies matched along every edge:
+
+    >>> graph = BipartiteGraph({('x', 0): True, ('x', 1): True, ('y', 1): True})
+    >>> for counts, _ in enum_block_matchings_iter(graph, {'x': 3, 'y': 1}, {0: 1, 1: 2}):
+    ...     print(sorted(counts.items()))
+    [(('x', 0), 1), (('x', 1), 2)]
+    [(('x', 0), 1), (('x', 1), 1), (('y', 1), 1)]
+
+    The copies of the *interchangeable* right nodes are all considered equal, even the copies of different nodes. Hence,
+    for them, only the number of matched copies of every left node is distinguished. These are yielded separately:
+
+    >>> for counts, interchangeable_counts in enum_block_matchings_iter(graph, {'x': 3, 'y': 1}, {0: 1, 1: 2}, {0, 1}):
+    ...     print(counts, sorted(interchangeable_counts.items()))
+    {} [('x', 3)]
+    {} [('x', 2), ('y', 1)]
+
+    The matchings are constructed node by node starting with the right nodes with the fewest adjacent left nodes. Every
+    partial matching is checked for whether it can be completed, so no time is wasted on dead ends.
+
+    Args:
+        graph:
+            The bipartite graph. Edges with a node not contained in the counts are ignored.
+        left_counts:
+            The number of copies for every left node.
+        right_counts:
+            The number of copies for every right node.
+        interchangeable:
+            A set of right nodes whose copies are interchangeable with each other.
+        step:
+            If not None, this object is yielded in between the matchings whenever a partial matching is tried, so that
+            the caller can limit the time spent on the search.
+
+    Yields:
+        For every matching, a tuple of a dictionary with the number of copies matched along every edge to a right node
+        that is not interchangeable and a dictionary with the number of copies of every left node matched to any of the
+        interchangeable right nodes. Edges and nodes with zero matched copies are omitted.
+    """
+    demand = dict((right, count) for right, count in right_counts.items() if count > 0)
+    supply = dict((left, count) for left, count in left_counts.items() if count > 0)
+    adjacency = dict((right, []) for right in demand)  # type: Dict[TRight, List[TLeft]]
+    left_nodes, right_nodes, left_adjacency, _ = graph.limited_to(supply, demand)._get_arrays()
+    for left, rights in zip(left_nodes, left_adjacency):
+        for right in rights:
+            adjacency[right_nodes[right]].append(left)
+    if not all(adjacency.values()):
+        return
+    rights = sorted((right for right in demand if right not in interchangeable), key=lambda r: len(adjacency[r]))
+    group = [right for right in demand if right in interchangeable]
+    group_demand = dict((right, demand[right]) for right in group)
+    counts = {}  # type: Dict[Edge, int]
+    fixed = set()  # type: Set[Edge]
+
+    def is_feasible():
+        edges = {}  # type: Dict[TLeft, List[TRight]]
+        for right, lefts in adjacency.items():
+            if demand[right] > 0:
+                for left in lefts:
+                    if (left, right) not in fixed:
+                        edges.setdefault(left, []).append(right)
+        supplied, = _transport(edges, [supply], demand)
+        return supplied == sum(demand.values())
+
+    def enum_right(index):
+        if index == len(rights):
+            yield from enum_group()
             return
+        right = rights[index]
+        yield from enum_edge_count(index, right, [left for left in adjacency[right] if supply[left] > 0], 0)
 
-        # Construct M'
-        # Exchange the direction of the path left1 -> right -> left2
-        # to left1 <- right <- left2 in the new matching
-        new_match = matching.copy()
-        del new_match[left1]
-        new_match[left2] = right
-
-        yield new_match
-
-        edge = (left2, right)
-
-        # Construct G+(e) and G-(e)
-        graph_plus = graph.without_nodes(edge)
-        graph_minus = graph.without_edge(edge)
-
-        dgm_plus = _DirectedMatchGraph(graph_plus, new_match)
-        dgm_minus = _DirectedMatchGraph(graph_minus, matching)
-
-        # Step 9
-        yield from _enum_maximum_matchings_iter(graph_plus, new_match, dgm_plus)
+    def enum_edge_count(index, right, lefts, position):
+        if demand[right] == 0:
+            yield from enum_right(index + 1)
+            return
+        if position == len(lefts):
+            return
+        left = lefts[position]
+        edge = (left, right)
+        maximum = min(supply[left], demand[right])
+        minimum = maximum if position == len(lefts) - 1 else 0
+        fixed.add(edge)
+        for count in range(maximum, minimum - 1, -1):
+            if step is not None:
+                yield step
+            supply[left] -= count
+            demand[right] -= count
+            if is_feasible():
+                if count > 0:
+                    counts[edge] = count
+                yield from enum_edge_count(index, right, lefts, position + 1)
+                counts.pop(edge, None)
+            supply[left] += count
+            demand[right] += count
+        fixed.remove(edge)
+
+    if not group:
+
+        def enum_group():
+            yield dict(counts), {}
+    else:
 
-        # Step 10
-        yield from _enum_maximum_matchings_iter(graph_minus, matching, dgm_minus)
+        def enum_group():
+            edges = {}  # type: Dict[TLeft, List[TRight]]
+            for right in group:
+                for left in adjacency[right]:
+                    if supply[left] > 0:
+                        edges.setdefault(left, []).append(right)
+            total = sum(group_demand.values())
+            yield from enum_group_count(edges, list(edges), {}, total)
+
+    def enum_group_count(edges, lefts, exact, remaining):
+        if remaining == 0:
+            yield dict(counts), dict(exact)
+            return
+        if not lefts:
+            return
+        left, lefts = lefts[0], lefts[1:]
+        maximum = min(supply[left], remaining)
+        minimum = maximum if not lefts else 0
+        free = dict((other, supply[other]) for other in lefts)
+        total = sum(group_demand.values())
+        for count in range(maximum, minimum - 1, -1):
+            if step is not None:
+                yield step
+            if count > 0:
+                exact[left] = count
+            exactly_supplied, freely_supplied = _transport(edges, [exact, free], group_demand)
+            if exactly_supplied == sum(exact.values()) and exactly_supplied + freely_supplied == total:
+                yield from enum_group_count(edges, lefts, exact, remaining - count)
+            exact.pop(left, None)
+
+    if is_feasible():
+        yield from enum_right(0)
+
+
+def _transport(edges: Dict[TLeft, List[TRight]], supplies: List[Dict[TLeft, int]],
+               demand: Dict[TRight, int]) -> List[int]:
+    """Find a maximum flow from the left nodes with a supply to the right nodes with a demand.
+
+    The supplies are added in stages and the flow is augmented after every stage. The flow that has been supplied by
+    the earlier stages is never reduced by the later ones, it can only be rerouted:
+
+    >>> _transport({'x': [0, 1], 'y': [1]}, [{'x': 1}, {'y': 1}], {0: 1, 1: 1})
+    [1, 1]
+
+    Args:
+        edges:
+            For every left node, the adjacent right nodes. The capacity of the edges is unlimited.
+        supplies:
+            For every stage, the supply of left nodes added in that stage. The stages must have disjoint nodes.
+        demand:
+            The demand of the right nodes.
+
+    Returns:
+        For every stage, the total amount of flow supplied by its left nodes.
+    """
+    remaining_demand = dict(demand)
+    assigned = {}  # type: Dict[TRight, Dict[TLeft, int]]
+    supplied = []
+    for stage in supplies:
+        remaining_supply = dict(stage)
+        total = 0
+        while True:
+            # Breadth first search for an augmenting path in the residual graph
+            parents = dict(((LEFT, left), None) for left, amount in remaining_supply.items() if amount > 0)
+            queue = list(parents)
+            end = None
+            for node in queue:
+                part, value = node
+                if part == LEFT:
+                    for right in edges.get(value, ()):
+                        if (RIGHT, right) not in parents:
+                            parents[(RIGHT, right)] = node
+                            if remaining_demand.get(right, 0) > 0:
+                                end = (RIGHT, right)
+                                break
+                            queue.append((RIGHT, right))
+                    if end is not None:
+                        break
+                else:
+                    for left, amount in assigned.get(value, {}).items():
+                        if amount > 0 and (LEFT, left) not in parents:
+                            parents[(LEFT, left)] = node
+                            queue.append((LEFT, left))
+            if end is None:
+                break
+            path = [end]
+            while parents[path[-1]] is not None:
+                path.append(parents[path[-1]])
+            path.reverse()
+            amount = min(remaining_supply[path[0][1]], remaining_demand[end[1]])
+            for (part, value), (_, other) in zip(path, path[1:]):
+                if part == RIGHT:
+                    amount = min(amount, assigned[value][other])
+            remaining_supply[path[0][1]] -= amount
+            remaining_demand[end[1]] -= amount
+            for (part, value), (_, other) in zip(path, path[1:]):
+                if part == LEFT:
+                    flows = assigned.setdefault(other, {})
+                    flows[value] = flows.get(value, 0) + amount
+                else:
+                    assigned[value][other] -= amount
+            total += amount
+        supplied.append(total)
+    return supplied
@@ -4,7 +4,7 @@ from ..expressions.expressions import Wildcard, AssociativeOperation, SymbolWild
 from ..expressions.constraints import CustomConstraint
 from ..expressions.functions import op_iter, get_variables
 from .syntactic import OPERATION_END, is_operation
-from .many_to_one import _EPS
+from .many_to_one import _EPS, _bit_indices
 from ..utils import get_short_lambda_source
 
 COLLAPSE_IF_RE = re.compile(
@@ -25,7 +25,7 @@ class CodeGenerator:
         self._code = ''
         self._subjects = ['subjects']
         self._substs = 0
-        self._patterns = set(range(len(matcher.patterns)))
+        self._patterns = (1 << len(matcher.patterns)) - 1
         self._associative = 0
         self._associative_stack = [None]
         self._global_code = []
@@ -90,6 +90,7 @@ class CommutativeMatcher{0}(CommutativeMatcher):
 \tassociative = {3}
 \tmax_optional_count = {4}
 \tanonymous_patterns = {5}
+\tsubpattern_index = None
 
 \tdef __init__(self):
 \t\tself.add_subject(None)
@@ -145,7 +146,7 @@ class CommutativeMatcher{0}(CommutativeMatcher):
                 self.add_line('if len({}) == 0:'.format(self._subjects[-1]))
                 self.indent()
                 self.add_line('pass')
-                for pattern_index in self._patterns:
+                for pattern_index in _bit_indices(self._patterns):
                     constraints = self._matcher.patterns[pattern_index][0].global_constraints
                     for constraint in constraints:
                         self.enter_global_constraint(constraint)
@@ -439,14 +440,14 @@ class CommutativeMatcher{0}(CommutativeMatcher):
     def generate_constraints(self, constraints, transitions):
         if len(constraints) == 0:
             for transition in transitions:
-                removed = self._patterns - transition.patterns
-                self._patterns.intersection_update(transition.patterns)
+                removed = self._patterns & ~transition.patterns
+                self._patterns &= transition.patterns
                 self.generate_state_code(transition.target)
-                self._patterns.update(removed)
+                self._patterns |= removed
         else:
             constraint_index, *remaining = constraints
             constraint, patterns = self._matcher.constraints[constraint_index]
-            remaining_patterns = self._patterns - patterns
+            remaining_patterns = self._patterns & ~patterns
             remaining_transitions = [t for t in transitions if t.patterns & remaining_patterns]
             checked_patterns = self._patterns & patterns
             checked_transitions = [t for t in transitions if t.patterns & checked_patterns]
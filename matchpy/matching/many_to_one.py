@@ -31,19 +31,30 @@ some label matched with {x ↦ a, y ↦ b}
 Also contains the :class:`ManyToOneReplacer` which can replace a set :class:`ReplacementRule` at one using a
 :class:`ManyToOneMatcher` for finding the matches.
 """
+import asyncio
 import math
+import hashlib
+import heapq
 import html
 import itertools
-from collections import deque
+import json
+import pickle
+import re
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
 from operator import itemgetter
-from typing import Container, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Set, Tuple, Type, Union
+from typing import (
+    Any, BinaryIO, Container, Dict, Hashable, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Set, Tuple,
+    Type, Union
+)
 
 try:
     from graphviz import Digraph, Graph
 except ImportError:
     Digraph = None
     Graph = None
-from multiset import Multiset
+from multiset import FrozenMultiset, Multiset
 
 from ..expressions.expressions import (
     Expression, Operation, Symbol, SymbolWildcard, Wildcard, Pattern, AssociativeOperation, CommutativeOperation, OneIdentityOperation
@@ -51,15 +62,17 @@ from ..expressions.expressions import (
 from ..expressions.substitution import Substitution
 from ..expressions.functions import (
     is_anonymous, contains_variables_from_set, create_operation_expression, preorder_iter_with_position,
-    rename_variables, op_iter, preorder_iter, op_len
+    rename_variables, op_iter, preorder_iter, op_len, _get_type_dispatch
+)
+from ..utils import (
+    VariableWithCount, commutative_sequence_variable_partition_count, commutative_sequence_variable_partition_iter
 )
-from ..utils import (VariableWithCount, commutative_sequence_variable_partition_iter)
 from .. import functions
-from .bipartite import BipartiteGraph, enum_maximum_matchings_iter, LEFT
+from .bipartite import BipartiteGraph, BipartiteGraphView, enum_block_matchings_iter
 from .syntactic import OPERATION_END, is_operation
 from ._common import check_one_identity
 
-__all__ = ['ManyToOneMatcher', 'ManyToOneReplacer']
+__all__ = ['ManyToOneMatcher', 'ManyToOneReplacer', 'MatchBudgetExceeded', 'MatchProfile']
 
 LabelType = Union[Expression, Type[Operation]]
 HeadType = Optional[Union[Expression, Type[Operation], Type[Symbol]]]
@@ -67,6 +80,7 @@ MultisetOfInt = Multiset
 MultisetOfExpression = Multiset
 
 _EPS = object()
+_STEP = object()
 
 _State = NamedTuple('_State', [
     ('number', int),
@@ -78,7 +92,7 @@ _Transition = NamedTuple('_Transition', [
     ('label', LabelType),
     ('target', _State),
     ('variable_name', Optional[str]),
-    ('patterns', Set[int]),
+    ('patterns', int),
     ('check_constraints', Optional[Set[int]]),
     ('subst', Substitution),
 ])  # yapf: disable
@@ -86,18 +100,93 @@ _Transition = NamedTuple('_Transition', [
 
 _VISITED = set()
 
+_FORMAT_MAGIC = 'matchpy.ManyToOneMatcher'
+# Has to be increased whenever the pickled layout of the matchers changes, e.g. the slots of the matcher classes,
+# _State, _Transition or BipartiteGraph, so that files saved with an older layout are rebuilt instead of loaded
+_FORMAT_VERSION = 7
+_ADDRESS_PATTERN = re.compile(r'\bat 0x[0-9a-fA-F]+')
+
+
+class MatchBudgetExceeded(Exception):
+    """Raised when a match exceeds its step budget or deadline.
+
+    Attributes:
+        result:
+            The partial result of the operation that was interrupted, if there is one. For
+            :meth:`ManyToOneReplacer.replace` this is the expression after all the replacements done so far.
+    """
+
+    def __init__(self, message: str, result=None) -> None:
+        super().__init__(message)
+        self.result = result
+
+
+class _Budget:
+    """Step budget and deadline that can be shared by multiple match iterators."""
+    __slots__ = ('steps', 'max_steps', 'deadline')
+
+    def __init__(self, max_steps: Optional[int]=None, timeout: Optional[float]=None) -> None:
+        self.steps = 0
+        self.max_steps = max_steps
+        self.deadline = time.monotonic() + timeout if timeout is not None else None
+
+    @staticmethod
+    def create(max_steps: Optional[int], timeout: Optional[float]) -> Optional['_Budget']:
+        if max_steps is None and timeout is None:
+            return None
+        return _Budget(max_steps, timeout)
+
+    def step(self) -> None:
+        self.steps += 1
+        if self.max_steps is not None and self.steps > self.max_steps:
+            raise MatchBudgetExceeded('The match exceeded the budget of {} steps.'.format(self.max_steps))
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise MatchBudgetExceeded('The match exceeded its deadline.')
+
+
+def _bit_indices(mask: int) -> Iterator[int]:
+    """Yield the indices of the set bits of the given bitmask in ascending order."""
+    while mask:
+        lowest = mask & -mask
+        yield lowest.bit_length() - 1
+        mask ^= lowest
+
+
 class _MatchIter:
-    def __init__(self, matcher, subject, intial_associative=None):
+    def __init__(
+            self, matcher, subject, intial_associative=None, prioritized=False, budget=None, step_interval=None,
+            partial=False, existence=False, counting=False
+    ):
         self.matcher = matcher
         self.subjects = deque([subject]) if subject is not None else deque()
-        self.patterns = set(range(len(matcher.patterns)))
+        if isinstance(subject, Expression):
+            self.patterns = matcher._get_candidate_patterns(subject)
+        else:
+            self.patterns = (1 << len(matcher.patterns)) - 1
         self.substitution = Substitution()
-        self.constraints = set(range(len(matcher.constraints)))
+        self.constraints = (1 << len(matcher.constraints)) - 1
         self.associative = [intial_associative]
+        self.allowed = -1
+        self.commutative_cache = None
+        self.step_interval = step_interval
+        self.step_count = 0
+        self.budget = budget
+        self.stepping = budget is not None or step_interval is not None
+        self.partial = partial
+        self.budget_exceeded = False
+        self.needed_variables = matcher._get_needed_variables() if existence or counting else None
+        self.counting = counting
+        self.weight = 1
+        self.ranks, self.order = matcher._get_pattern_ranks() if prioritized else (None, None)
 
     def __iter__(self):
-        for _ in self._match(self.matcher.root):
-            yield from self._internal_iter()
+        try:
+            for _ in self._match(self.matcher.root):
+                yield from self._internal_iter()
+        except MatchBudgetExceeded:
+            if not self.partial:
+                raise
+            self.budget_exceeded = True
 
     def grouped(self):
         """
@@ -116,39 +205,104 @@ class _MatchIter:
         Returns:
             True, if any match is found.
         """
-        try:
-            next(self)
-        except StopIteration:
-            return False
-        return True
+        patterns = self.matcher.patterns
+        for _ in self._match(self.matcher.root):
+            for pattern_index in _bit_indices(self.patterns):
+                if not patterns[pattern_index][0].global_constraints or self._final_match(pattern_index) is not None:
+                    return True
+        return False
 
-    def _internal_iter(self):
-        for pattern_index in self.patterns:
-            renaming = self.matcher.pattern_vars[pattern_index]
-            new_substitution = self.substitution.rename({renamed: original for original, renamed in renaming.items()})
-            pattern, label, _ = self.matcher.patterns[pattern_index]
-            valid = True
-            for constraint in pattern.global_constraints:
-                if not constraint(new_substitution):
-                    valid = False
+    def count(self):
+        """
+        Returns:
+            The number of matches.
+        """
+        patterns = self.matcher.patterns
+        total = 0
+        for _ in self._match(self.matcher.root):
+            for pattern_index in _bit_indices(self.patterns):
+                if not patterns[pattern_index][0].global_constraints or self._final_match(pattern_index) is not None:
+                    total += self.weight
+        return total
+
+    def first(self):
+        """
+        Returns:
+            The match of the pattern with the highest priority as a tuple of label and substitution, or None if there
+            is no match.
+        """
+        ranks = self.ranks
+        best = None
+        for _ in self._match(self.matcher.root):
+            for pattern_index in sorted(_bit_indices(self.patterns & self.allowed), key=ranks.__getitem__):
+                result = self._final_match(pattern_index)
+                if result is not None:
+                    best = result
+                    self.allowed = 0
+                    for better_index in self.order[:ranks[pattern_index]]:
+                        self.allowed |= 1 << better_index
                     break
-            if valid:
-                yield label, new_substitution
+            if not self.allowed:
+                break
+        return best
+
+    def _iter_with_steps(self):
+        for state in self._match(self.matcher.root):
+            if state is _STEP:
+                yield _STEP
+            else:
+                yield from self._internal_iter()
+
+    def _step(self):
+        if self.budget is not None:
+            self.budget.step()
+        if self.step_interval is not None:
+            self.step_count += 1
+            if self.step_count >= self.step_interval:
+                self.step_count = 0
+                yield _STEP
+
+    def _internal_iter(self):
+        for pattern_index in _bit_indices(self.patterns):
+            result = self._final_match(pattern_index)
+            if result is not None:
+                yield result
+
+    def _final_match(self, pattern_index: int) -> Optional[Tuple[Any, Substitution]]:
+        renaming = self.matcher.pattern_vars[pattern_index]
+        new_substitution = self.substitution.rename({renamed: original for original, renamed in renaming.items()})
+        pattern, label, _ = self.matcher.patterns[pattern_index]
+        for constraint in pattern.global_constraints:
+            if not constraint(new_substitution):
+                return None
+        return label, new_substitution
 
     def _match(self, state: _State) -> Iterator[_State]:
         _VISITED.add(state.number)
+        if self.stepping:
+            yield from self._step()
         if len(self.subjects) == 0:
             if state.number in self.matcher.finals or OPERATION_END in state.transitions:
                 yield state
-            heads = [None]
+            heads = (None, )
         else:
-            heads = list(self._get_heads(self.subjects[0]))
+            heads = self._get_heads(self.subjects[0])
+        if self.ranks is not None:
+            transitions = [t for head in heads for t in state.transitions.get(head, [])]
+            transitions.sort(key=self._get_transition_rank)
+            for transition in transitions:
+                yield from self._match_transition(transition)
+            return
         for head in heads:
             for transition in state.transitions.get(head, []):
                 yield from self._match_transition(transition)
 
+    def _get_transition_rank(self, transition: _Transition) -> int:
+        ranks = self.ranks
+        return min((ranks[i] for i in _bit_indices(self.patterns & transition.patterns)), default=len(ranks))
+
     def _match_transition(self, transition: _Transition) -> Iterator[_State]:
-        if self.patterns.isdisjoint(transition.patterns):
+        if not self.patterns & transition.patterns & self.allowed:
             return
         label = transition.label
         if label is _EPS:
@@ -176,11 +330,12 @@ class _MatchIter:
         yield from self._check_transition(transition, subject)
 
     def _check_transition(self, transition, subject, restore_subject=True):
-        if self.patterns.isdisjoint(transition.patterns):
+        patterns = transition.patterns & self.allowed
+        if not self.patterns & patterns:
             return
-        restore_constraints = set()
-        restore_patterns = self.patterns - transition.patterns
-        self.patterns &= transition.patterns
+        restore_constraints = 0
+        restore_patterns = self.patterns & ~patterns
+        self.patterns &= patterns
         old_values = {}
         try:
             if transition.subst is not None:
@@ -196,13 +351,17 @@ class _MatchIter:
                             self.substitution[k] = v
                     return
 
-            if transition.variable_name is not None:
+            if transition.variable_name is not None and (
+                    self.needed_variables is None or transition.variable_name in self.needed_variables
+            ):
                 try:
                     old_values[transition.variable_name] = self.substitution.get(transition.variable_name, None)
                     self.substitution.try_add_variable(transition.variable_name, subject)
                 except ValueError:
                     return
-                self._check_constraints(transition.check_constraints, restore_constraints, restore_patterns)
+                restore_constraints, restore_patterns = self._check_constraints(
+                    transition.check_constraints, restore_constraints, restore_patterns
+                )
                 if not self.patterns:
                     return
 
@@ -219,33 +378,33 @@ class _MatchIter:
                 else:
                     self.substitution[k] = v
 
-    def _check_constraints(self, variable: str, restore_constraints, restore_patterns) -> bool:
+    def _check_constraints(self, variable: str, restore_constraints: int, restore_patterns: int) -> Tuple[int, int]:
         if isinstance(variable, str):
             check_constraints = self.matcher.constraint_vars.get(variable, [])
         else:
             check_constraints = variable
-        variables = set(self.substitution.keys())
+        variables = self.substitution.keys()
         for constraint_index in check_constraints:
-            if constraint_index not in self.constraints:
+            constraint_bit = 1 << constraint_index
+            if not self.constraints & constraint_bit:
                 continue
             constraint, patterns = self.matcher.constraints[constraint_index]
-            if constraint.variables <= variables and not self.patterns.isdisjoint(patterns):
-                self.constraints.remove(constraint_index)
-                restore_constraints.add(constraint_index)
+            if self.patterns & patterns and variables >= constraint.variables:
+                self.constraints ^= constraint_bit
+                restore_constraints |= constraint_bit
                 if not constraint(self.substitution):
                     restore_patterns |= self.patterns & patterns
-                    self.patterns -= patterns
+                    self.patterns &= ~patterns
                     if not self.patterns:
                         break
+        return restore_constraints, restore_patterns
 
     @staticmethod
-    def _get_heads(expression: Expression) -> Iterator[HeadType]:
-        for base in type(expression).__mro__:
-            if base is not object:
-                yield base
-        if not isinstance(expression, Operation):
-            yield expression
-        yield None
+    def _get_heads(expression: Expression) -> Tuple[HeadType, ...]:
+        heads = _get_type_dispatch(type(expression)).heads
+        if isinstance(expression, Operation):
+            return heads + (None, )
+        return heads + (expression, None)
 
     def _match_sequence_variable(self, wildcard: Wildcard, transition: _Transition) -> Iterator[_State]:
         min_count = wildcard.min_count
@@ -279,17 +438,29 @@ class _MatchIter:
         matcher.add_subject(None)
         for operand in op_iter(subject):
             matcher.add_subject(operand)
-        for matched_pattern, new_substitution in matcher.match(subject, substitution):
-            restore_constraints = set()
-            diff = set(new_substitution.keys()) - set(substitution.keys())
+        for commutative_match in self._get_commutative_matches(state, subject):
+            if commutative_match is _STEP:
+                yield from self._step()
+                continue
+            if self.needed_variables is not None:
+                matched_pattern, new_substitution, weight = commutative_match
+                if self.counting:
+                    self.weight *= weight
+            else:
+                matched_pattern, new_substitution = commutative_match
+            restore_constraints = 0
+            diff = new_substitution.keys() - substitution.keys()
             self.substitution = new_substitution
             transition_set = state.transitions[matched_pattern]
-            t_iter = iter(t.patterns for t in transition_set)
-            potential_patterns = next(t_iter).union(*t_iter)
-            restore_patterns = self.patterns - potential_patterns
+            potential_patterns = 0
+            for transition in transition_set:
+                potential_patterns |= transition.patterns
+            restore_patterns = self.patterns & ~potential_patterns
             self.patterns &= potential_patterns
             for variable in diff:
-                self._check_constraints(variable, restore_constraints, restore_patterns)
+                restore_constraints, restore_patterns = self._check_constraints(
+                    variable, restore_constraints, restore_patterns
+                )
                 if not self.patterns:
                     break
             if self.patterns:
@@ -298,9 +469,34 @@ class _MatchIter:
                     yield from self._check_transition(next_transition, subject, False)
             self.constraints |= restore_constraints
             self.patterns |= restore_patterns
+            if self.counting:
+                self.weight //= weight
         self.substitution = substitution
         self.subjects.appendleft(subject)
 
+    def _get_commutative_matches(self, state: _State, subject: Expression) -> Iterable[Tuple[int, Substitution]]:
+        if self.needed_variables is not None:
+            return state.matcher.match(
+                subject, self.substitution, self.stepping, self.needed_variables, not self.counting
+            )
+        if self.commutative_cache is None:
+            return state.matcher.match(subject, self.substitution, self.stepping)
+        try:
+            key = (state.number, self.stepping, subject, _substitution_key(self.substitution))
+            return self.commutative_cache[key]
+        except TypeError:
+            return state.matcher.match(subject, self.substitution, self.stepping)
+        except KeyError:
+            return self._cache_commutative_matches(key, state.matcher.match(subject, self.substitution, self.stepping))
+
+    def _cache_commutative_matches(self, key, matches: Iterator) -> Iterator:
+        # The matches (including the steps) are only cached once they have all been enumerated
+        cached = []
+        for commutative_match in matches:
+            cached.append(commutative_match)
+            yield commutative_match
+        self.commutative_cache[key] = cached
+
     def _match_regular_operation(self, transition: _Transition) -> Iterator[_State]:
         subject = self.subjects.popleft()
         after_subjects = self.subjects
@@ -308,6 +504,9 @@ class _MatchIter:
         new_associative = transition.label if issubclass(transition.label, AssociativeOperation) else None
         self.associative.append(new_associative)
         for new_state in self._check_transition(transition, subject, False):
+            if new_state is _STEP:
+                yield _STEP
+                continue
             self.subjects = after_subjects
             self.associative.pop()
             for end_transition in new_state.transitions[OPERATION_END]:
@@ -319,8 +518,343 @@ class _MatchIter:
         self.associative.pop()
 
 
+def _substitution_key(substitution: Substitution) -> frozenset:
+    return frozenset(
+        (name, FrozenMultiset(value) if isinstance(value, Multiset) else value)
+        for name, value in substitution.items()
+    )
+
+
+class _ProfilingMatchIter(_MatchIter):
+    """Match iterator that records statistics in the :class:`MatchProfile` of the matcher."""
+
+    def __init__(self, matcher, subject, *args, **kwargs):
+        super().__init__(matcher, subject, *args, **kwargs)
+        self.profile = matcher.profile
+        self.profile.subjects += 1
+        self.stepping = True
+        self.visits = 0
+        self.clock = time.perf_counter()
+        self.clock_patterns = self.patterns
+
+    def _record_time(self):
+        now = time.perf_counter()
+        elapsed = now - self.clock
+        pattern_time = self.profile.time
+        for pattern_index in _bit_indices(self.clock_patterns):
+            pattern_time[pattern_index] += elapsed
+        self.clock = now
+        self.clock_patterns = self.patterns
+
+    def _internal_iter(self):
+        for result in super()._internal_iter():
+            self._record_time()
+            yield result
+            self.clock = time.perf_counter()
+
+    def _final_match(self, pattern_index: int) -> Optional[Tuple[Any, Substitution]]:
+        start = time.perf_counter()
+        result = super()._final_match(pattern_index)
+        self.profile.constraint_time[pattern_index] += time.perf_counter() - start
+        self.profile.constraint_calls[pattern_index] += len(self.matcher.patterns[pattern_index][0].global_constraints)
+        if result is not None:
+            self.profile.matches[pattern_index] += 1
+        return result
+
+    def _match(self, state: _State) -> Iterator[_State]:
+        self._record_time()
+        self.visits += 1
+        visits = self.visits
+        candidates = self.patterns
+        steps = self.profile.steps
+        for pattern_index in _bit_indices(candidates):
+            steps[pattern_index] += 1
+        dead_end = True
+        for result in super()._match(state):
+            if result is state:
+                dead_end = False
+            yield result
+        if dead_end and self.visits == visits:
+            backtracks = self.profile.backtracks
+            for pattern_index in _bit_indices(candidates):
+                backtracks[pattern_index] += 1
+
+    def _check_constraints(self, variable: str, restore_constraints: int, restore_patterns: int) -> Tuple[int, int]:
+        start = time.perf_counter()
+        new_restore_constraints, new_restore_patterns = super()._check_constraints(
+            variable, restore_constraints, restore_patterns
+        )
+        elapsed = time.perf_counter() - start
+        for constraint_index in _bit_indices(new_restore_constraints & ~restore_constraints):
+            for pattern_index in _bit_indices(self.matcher.constraints[constraint_index][1]):
+                self.profile.constraint_calls[pattern_index] += 1
+                self.profile.constraint_time[pattern_index] += elapsed
+        return new_restore_constraints, new_restore_patterns
+
+    def _get_commutative_matches(self, state: _State, subject: Expression) -> Iterable[Tuple[int, Substitution]]:
+        profile = self.profile
+        patterns = 0
+        for transitions in state.transitions.values():
+            for transition in transitions:
+                patterns |= transition.patterns
+        patterns &= self.patterns
+        self._record_time()
+        self.clock_patterns = patterns
+        profile.commutative_calls[state.number] += 1
+        profile.commutative_patterns[state.number] |= patterns
+        iterator = iter(super()._get_commutative_matches(state, subject))
+        while True:
+            start = time.perf_counter()
+            try:
+                commutative_match = next(iterator)
+            except StopIteration:
+                profile.commutative_time[state.number] += time.perf_counter() - start
+                return
+            profile.commutative_time[state.number] += time.perf_counter() - start
+            if commutative_match is _STEP:
+                profile.commutative_enumerations[state.number] += 1
+                for pattern_index in _bit_indices(patterns):
+                    profile.enumerations[pattern_index] += 1
+            else:
+                profile.commutative_matches[state.number] += 1
+            yield commutative_match
+
+
+class MatchProfile:
+    """Statistics about the matching with a :class:`ManyToOneMatcher` (see :meth:`ManyToOneMatcher.profiling`).
+
+    The per pattern statistics are counters indexed by the pattern index:
+
+    - ``time``: The time in seconds spent while the pattern was still a candidate for a match. The same time is
+      attributed to all candidate patterns, so the times of the patterns do not add up to the total time.
+    - ``steps``: The number of automaton states visited while the pattern was a candidate.
+    - ``backtracks``: The number of dead ends (visited states from which the matching could not continue) while the
+      pattern was a candidate.
+    - ``enumerations``: The number of bipartite matchings and sequence variable partitions enumerated while the
+      pattern was a candidate.
+    - ``constraint_calls`` and ``constraint_time``: The number of calls of the pattern's constraints and the time spent
+      in them.
+    - ``matches``: The number of matches of the pattern.
+
+    The statistics of the commutative matchers are counters indexed by the state number of the matcher:
+    ``commutative_calls``, ``commutative_enumerations``, ``commutative_matches`` and ``commutative_time``. The patterns
+    which were candidates when a commutative matcher was used are recorded as a bitmask in ``commutative_patterns``.
+    """
+
+    PATTERN_FIELDS = ('time', 'steps', 'backtracks', 'enumerations', 'constraint_calls', 'constraint_time', 'matches')
+    COMMUTATIVE_FIELDS = ('calls', 'enumerations', 'matches', 'time')
+
+    def __init__(self, matcher: 'ManyToOneMatcher') -> None:
+        self.matcher = matcher
+        self.reset()
+
+    def reset(self) -> None:
+        """Reset all the statistics."""
+        self.subjects = 0
+        for field in self.PATTERN_FIELDS:
+            setattr(self, field, Counter())
+        for field in self.COMMUTATIVE_FIELDS:
+            setattr(self, 'commutative_' + field, Counter())
+        self.commutative_patterns = Counter()
+
+    def as_dict(self, sort_by: str='time') -> Dict[str, Any]:
+        """Return the statistics as a dictionary.
+
+        Args:
+            sort_by:
+                The statistic by which the patterns and commutative matchers are sorted in descending order.
+
+        Returns:
+            A dictionary with the number of matched ``subjects``, a list of ``patterns`` and a list of
+            ``commutative_matchers``. Every item of these lists is a dictionary containing the statistics.
+
+        Raises:
+            ValueError:
+                If *sort_by* is not the name of a statistic.
+        """
+        if sort_by not in self.PATTERN_FIELDS and sort_by not in self.COMMUTATIVE_FIELDS:
+            raise ValueError('Unknown statistic {!r}.'.format(sort_by))
+        patterns = []
+        for index, (pattern, label, _) in enumerate(self.matcher.patterns):
+            if pattern is None:
+                continue
+            row = {'index': index, 'label': str(label)}
+            for field in self.PATTERN_FIELDS:
+                row[field] = getattr(self, field)[index]
+            patterns.append(row)
+        commutative_matchers = []
+        for state_number, calls in self.commutative_calls.items():
+            row = {'state': state_number, 'patterns': list(_bit_indices(self.commutative_patterns[state_number]))}
+            for field in self.COMMUTATIVE_FIELDS:
+                row[field] = getattr(self, 'commutative_' + field)[state_number]
+            commutative_matchers.append(row)
+        if sort_by in self.PATTERN_FIELDS:
+            patterns.sort(key=itemgetter(sort_by), reverse=True)
+        if sort_by in self.COMMUTATIVE_FIELDS:
+            commutative_matchers.sort(key=itemgetter(sort_by), reverse=True)
+        return {'subjects': self.subjects, 'patterns': patterns, 'commutative_matchers': commutative_matchers}
+
+    def to_json(self, sort_by: str='time', **kwargs) -> str:
+        """Return the statistics (see :meth:`as_dict`) as JSON.
+
+        Additional keyword arguments are passed to :func:`json.dumps`.
+        """
+        return json.dumps(self.as_dict(sort_by), **kwargs)
+
+    def report(self, sort_by: str='time', limit: Optional[int]=None) -> str:
+        """Return the statistics formatted as text tables.
+
+        Args:
+            sort_by:
+                The statistic by which the patterns and commutative matchers are sorted in descending order.
+            limit:
+                The maximum number of patterns and commutative matchers to include.
+
+        Returns:
+            The report as a string.
+        """
+        data = self.as_dict(sort_by)
+        pattern_rows = [
+            [row['label'], '{:.3f}'.format(row['time'] * 1000), row['steps'], row['backtracks'], row['enumerations'],
+             row['constraint_calls'], '{:.3f}'.format(row['constraint_time'] * 1000), row['matches']]
+            for row in data['patterns'][:limit]
+        ]  # yapf: disable
+        commutative_rows = [
+            [row['state'], ', '.join(map(str, row['patterns'])), row['calls'], row['enumerations'], row['matches'],
+             '{:.3f}'.format(row['time'] * 1000)]
+            for row in data['commutative_matchers'][:limit]
+        ]  # yapf: disable
+        lines = ['Matched subjects: {}'.format(data['subjects']), '']
+        lines.extend(self._format_table(
+            ['Pattern', 'Time [ms]', 'Steps', 'Backtracks', 'Enumerations', 'Constraint calls', 'Constraint time [ms]',
+             'Matches'], pattern_rows
+        ))  # yapf: disable
+        if commutative_rows:
+            lines.append('')
+            lines.extend(self._format_table(
+                ['Commutative state', 'Patterns', 'Calls', 'Enumerations', 'Matches', 'Time [ms]'], commutative_rows
+            ))  # yapf: disable
+        return '\n'.join(lines)
+
+    @staticmethod
+    def _format_table(header: List[str], rows: List[List[Any]]) -> List[str]:
+        rows = [header] + [[str(cell) for cell in row] for row in rows]
+        widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+        lines = []
+        for row in rows:
+            cells = [row[0].ljust(widths[0])] + [cell.rjust(width) for cell, width in zip(row[1:], widths[1:])]
+            lines.append('  '.join(cells).rstrip())
+        return lines
+
+    def __str__(self):
+        return self.report()
+
+
+class _MatcherPickler(pickle.Pickler):
+    """Pickler that stores the objects given by name only as a reference to that name."""
+
+    def __init__(self, file: BinaryIO, names: Dict[str, Any]) -> None:
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self._names = names
+        self._ids = {id(obj): name for name, obj in names.items()}
+
+    def persistent_id(self, obj):
+        if obj is _EPS:
+            return ('eps', )
+        if isinstance(obj, MatchProfile):
+            return ('profile', )
+        name = self._ids.get(id(obj), None)
+        if name is not None:
+            return ('name', name)
+        return None
+
+
+class _MatcherUnpickler(pickle.Unpickler):
+    """Unpickler that resolves the references stored by the :class:`_MatcherPickler`."""
+
+    def __init__(self, file: BinaryIO, names: Dict[str, Any]) -> None:
+        super().__init__(file)
+        self._names = names
+
+    def persistent_load(self, pid):
+        if pid[0] == 'eps':
+            return _EPS
+        if pid[0] == 'profile':
+            return None
+        try:
+            return self._names[pid[1]]
+        except KeyError:
+            raise ValueError('The object named {!r} is needed to load the matcher.'.format(pid[1])) from None
+
+
+def _fingerprint(patterns: Iterable[Union[Pattern, Tuple[Pattern, Any]]], names: Dict[str, Any]) -> str:
+    """Compute a fingerprint for the given patterns (optionally with labels) that is stable between processes.
+
+    Labels and constraint callbacks that are given in *names* are represented by their name, tuples (like
+    :class:`.ReplacementRule` labels) by their items, and everything else by its :func:`repr`.
+
+    Raises:
+        ValueError:
+            If the :func:`repr` of an object depends on its memory address, i.e. it has no stable representation and
+            is not given in *names*.
+    """
+    object_names = {id(obj): name for name, obj in names.items()}
+    digest = hashlib.sha256('{}:{}'.format(_FORMAT_MAGIC, _FORMAT_VERSION).encode('utf-8'))
+    seen = set()
+    for entry in patterns:
+        pattern, label = (entry, entry) if isinstance(entry, Pattern) else entry
+        if label is None:
+            label = pattern
+        parts = [repr(pattern.expression)]
+        for constraint in pattern.constraints:
+            callback = getattr(constraint, 'constraint', constraint)
+            if id(callback) in object_names:
+                parts.append(object_names[id(callback)])
+            else:
+                parts.append(_stable_repr(constraint, object_names))
+        parts.append(_stable_repr(label, object_names))
+        key = '\x1f'.join(parts)
+        if key not in seen:
+            seen.add(key)
+            digest.update(key.encode('utf-8'))
+            digest.update(b'\x1e')
+    return digest.hexdigest()
+
+
+def _stable_repr(obj: Any, object_names: Dict[int, str]) -> str:
+    if id(obj) in object_names:
+        return object_names[id(obj)]
+    if isinstance(obj, tuple):
+        return '{}({})'.format(type(obj).__name__, ', '.join(_stable_repr(item, object_names) for item in obj))
+    representation = repr(obj)
+    if _ADDRESS_PATTERN.search(representation):
+        raise ValueError(
+            'The object {} has no representation that is stable between processes, it needs to be given in the '
+            'names.'.format(representation)
+        )
+    return representation
+
+
+def _lookup_key(pattern_or_label: Any) -> Hashable:
+    """Return the key of a pattern or label in the :attr:`ManyToOneMatcher.pattern_lookup`.
+
+    Patterns are not hashable, so their expression is used instead. Everything that is not hashable (like labels or
+    expressions containing a dict) shares the key None.
+    """
+    key = pattern_or_label.expression if isinstance(pattern_or_label, Pattern) else pattern_or_label
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
 class ManyToOneMatcher:
-    __slots__ = ('patterns', 'states', 'root', 'pattern_vars', 'constraints', 'constraint_vars', 'finals', 'rename')
+    __slots__ = (
+        'patterns', 'states', 'root', 'pattern_vars', 'constraints', 'constraint_vars', 'finals', 'rename',
+        'priorities', 'pattern_ranks', 'needed_variables', 'profile', 'signatures', 'pattern_lookup', 'free_indices',
+        'serials', 'next_serial'
+    )
 
     _state_id = 0
 
@@ -330,18 +864,27 @@ class ManyToOneMatcher:
             *patterns: The patterns which the matcher should match.
         """
         self.patterns = []
-        self.states = []
+        self.states = {}
         self.root = self._create_state()
         self.pattern_vars = []
         self.constraints = []
         self.constraint_vars = {}
-        self.finals = set()
+        self.finals = {}
         self.rename = rename
+        self.priorities = []
+        self.pattern_ranks = None
+        self.needed_variables = None
+        self.profile = None
+        self.signatures = None
+        self.pattern_lookup = {}  # type: Dict[Hashable, Set[int]]
+        self.free_indices = []  # type: List[int]
+        self.serials = []  # type: List[int]
+        self.next_serial = 0
 
         for pattern in patterns:
             self.add(pattern)
 
-    def add(self, pattern: Pattern, label=None) -> None:
+    def add(self, pattern: Pattern, label=None, priority: int=0) -> None:
         """Add a new pattern to the matcher.
 
         The optional label defaults to the pattern itself and is yielded during matching. The same pattern can be
@@ -356,17 +899,24 @@ class ManyToOneMatcher:
                 The pattern to add.
             label:
                 An optional label for the pattern. Defaults to the pattern itself.
+            priority:
+                The priority of the pattern used by :meth:`match_first`. Patterns with a higher priority are preferred.
+                Between patterns with the same priority, the one added first is preferred.
         """
         if label is None:
             label = pattern
-        for i, (p, l, _) in enumerate(self.patterns):
+        for i in self._lookup(pattern):
+            p, l, _ = self.patterns[i]
             if pattern == p and label == l:
+                if self.priorities[i] != priority:
+                    self.priorities[i] = priority
+                    self.pattern_ranks = None
                 return i
         # TODO: Avoid renaming in the pattern, use variable indices instead
         renaming = self._collect_variable_renaming(pattern.expression) if self.rename else {}
-        self._internal_add(pattern, label, renaming)
+        self._internal_add(pattern, label, renaming, priority)
 
-    def _internal_add(self, pattern: Pattern, label, renaming) -> int:
+    def _internal_add(self, pattern: Pattern, label, renaming, priority: int=0) -> int:
         """Add a new pattern to the matcher.
 
         Equivalent patterns are not added again. However, patterns that are structurally equivalent,
@@ -378,11 +928,26 @@ class ManyToOneMatcher:
         Returns:
             The internal id for the pattern. This is mainly used by the :class:`CommutativeMatcher`.
         """
-        pattern_index = len(self.patterns)
+        if self.free_indices:
+            pattern_index = heapq.heappop(self.free_indices)
+        else:
+            pattern_index = len(self.patterns)
+            self.patterns.append(None)
+            self.pattern_vars.append(None)
+            self.priorities.append(None)
+            self.serials.append(None)
         renamed_constraints = [c.with_renamed_vars(renaming) for c in pattern.local_constraints]
         constraint_indices = [self._add_constraint(c, pattern_index) for c in renamed_constraints]
-        self.patterns.append((pattern, label, constraint_indices))
-        self.pattern_vars.append(renaming)
+        self.patterns[pattern_index] = (pattern, label, constraint_indices)
+        self.pattern_vars[pattern_index] = renaming
+        self.priorities[pattern_index] = priority
+        self.serials[pattern_index] = self.next_serial
+        self.next_serial += 1
+        for key in {_lookup_key(pattern), _lookup_key(label)}:
+            self.pattern_lookup.setdefault(key, set()).add(pattern_index)
+        self.pattern_ranks = None
+        self.needed_variables = None
+        self.signatures = None
         pattern = rename_variables(pattern.expression, renaming)
         state = self.root
         patterns_stack = [deque([pattern])]
@@ -414,45 +979,668 @@ class ManyToOneMatcher:
                 patterns_stack.pop()
                 if len(patterns_stack) > 0:
                     state = self._create_simple_transition(state, OPERATION_END, pattern_index)
-        self.finals.add(state.number)
+        self.finals[state.number] = self.finals.get(state.number, 0) | 1 << pattern_index
 
 
     def _add_constraint(self, constraint, pattern):
         index = None
         for i, (c, patterns) in enumerate(self.constraints):
             if c == constraint:
-                patterns.add(pattern)
+                self.constraints[i] = (c, patterns | 1 << pattern)
                 index = i
                 break
         else:
             index = len(self.constraints)
-            self.constraints.append((constraint, set([pattern])))
+            self.constraints.append((constraint, 1 << pattern))
         for var in constraint.variables:
             self.constraint_vars.setdefault(var, set()).add(index)
         return index
 
-    def match(self, subject: Expression) -> Iterator[Tuple[Expression, Substitution]]:
+    def remove(self, pattern_or_label) -> int:
+        """Remove a pattern from the matcher.
+
+        All patterns that are equal to the given pattern or that have been added with the given label are removed.
+        Only the part of the automaton that is used by the removed patterns is updated and states that are not needed
+        anymore are discarded:
+
+        >>> matcher = ManyToOneMatcher(Pattern(f(a, x_)), Pattern(f(b, x_)))
+        >>> matcher.remove(Pattern(f(b, x_)))
+        1
+        >>> [str(p) for p, _ in matcher.match(f(b, c))]
+        []
+
+        The removed patterns keep their slot in :attr:`patterns` (as ``(None, None, [])``), so that the indices of the
+        remaining patterns do not change. Patterns added later reuse the free slots, so replacing patterns does not
+        make the matcher grow.
+
+        Args:
+            pattern_or_label:
+                The pattern or label to remove.
+
+        Returns:
+            The number of removed patterns.
+
+        Raises:
+            ValueError:
+                If neither a pattern nor a label matches the given argument.
+        """
+        removed = 0
+        for index in self._lookup(pattern_or_label):
+            pattern, label, _ = self.patterns[index]
+            if pattern == pattern_or_label or label == pattern_or_label:
+                self._remove_index(index)
+                removed += 1
+        if not removed:
+            raise ValueError('{!r} is not in the matcher.'.format(pattern_or_label))
+        return removed
+
+    def _lookup(self, pattern_or_label) -> List[int]:
+        """Return the indices of the patterns that might be equal to the given pattern or have it as label."""
+        return sorted(self.pattern_lookup.get(_lookup_key(pattern_or_label), ()))
+
+    def _remove_index(self, index: int) -> None:
+        bit = 1 << index
+        pattern, label, constraint_indices = self.patterns[index]
+        for key in {_lookup_key(pattern), _lookup_key(label)}:
+            indices = self.pattern_lookup[key]
+            indices.discard(index)
+            if not indices:
+                del self.pattern_lookup[key]
+        for constraint_index in constraint_indices:
+            constraint, patterns = self.constraints[constraint_index]
+            self.constraints[constraint_index] = (constraint, patterns & ~bit)
+        # Keep the slot so that the bitmasks of the other patterns stay valid, it is reused by the next added pattern
+        self.patterns[index] = (None, None, [])
+        self.pattern_vars[index] = {}
+        heapq.heappush(self.free_indices, index)
+        self.needed_variables = None
+        self.signatures = None
+        visited = set()
+        stack = [self.root]
+        while stack:
+            state = stack.pop()
+            if self.finals.get(state.number, 0) & bit:
+                self.finals[state.number] &= ~bit
+                if not self.finals[state.number]:
+                    del self.finals[state.number]
+            for head, transitions in list(state.transitions.items()):
+                remaining = []
+                for transition in transitions:
+                    if transition.patterns & bit:
+                        if transition.target.number not in visited:
+                            visited.add(transition.target.number)
+                            stack.append(transition.target)
+                        transition = transition._replace(patterns=transition.patterns & ~bit)
+                        if not transition.patterns:
+                            continue
+                    remaining.append(transition)
+                if remaining:
+                    transitions[:] = remaining
+                else:
+                    del state.transitions[head]
+                    if state.matcher is not None:
+                        state.matcher.remove_pattern(head)
+        for number in visited:
+            if not self.states[number].transitions and number not in self.finals:
+                del self.states[number]
+
+    def match(self, subject: Expression, max_steps: Optional[int]=None, timeout: Optional[float]=None,
+              partial: bool=False) -> Iterator[Tuple[Expression, Substitution]]:
         """Match the subject against all the matcher's patterns.
 
+        The matching can be limited to a number of steps and/or a time. A step is either a visited state of the
+        automaton, or a tried partial matching, an enumerated matching, a tried union of substitutions or an enumerated
+        partition of a commutative operation. When the limit is exceeded, either a :class:`MatchBudgetExceeded` is
+        raised or, with *partial* set, the iteration stops and the ``budget_exceeded`` attribute of the returned
+        iterator is set:
+
+        >>> f_c = Operation.new('f_c', Arity.variadic, commutative=True)
+        >>> matcher = ManyToOneMatcher(Pattern(f_c(x_, ___)))
+        >>> matches = matcher.match(f_c(a, b, c), max_steps=3, partial=True)
+        >>> len(list(matches)) < 3, matches.budget_exceeded
+        (True, True)
+
+        Args:
+            subject:
+                The subject to match.
+            max_steps:
+                The optional maximum number of steps.
+            timeout:
+                The optional maximum time in seconds, starting when the iterator is created.
+            partial:
+                If True, the iteration stops instead of raising an exception when the limit is exceeded.
+
+        Yields:
+            For every match, a tuple of the matching pattern and the match substitution.
+
+        Raises:
+            MatchBudgetExceeded:
+                If the step budget or time limit is exceeded and *partial* is not set.
+        """
+        return self._create_match_iter(subject, budget=_Budget.create(max_steps, timeout), partial=partial)
+
+    def match_batch(self, subjects: Iterable[Expression]) -> Iterator[Tuple[int, Any, Substitution]]:
+        """Match a batch of subjects against all the matcher's patterns.
+
+        Identical subjects are only matched once and the matches of commutative subterms are shared between all the
+        subjects of the batch:
+
+        >>> matcher = ManyToOneMatcher(Pattern(f(a, x_)), Pattern(f(y_, b)))
+        >>> for index, pattern, substitution in matcher.match_batch([f(a, c), f(c, c), f(a, c)]):
+        ...     print(index, pattern, substitution)
+        0 f(a, x_) {x ↦ c}
+        2 f(a, x_) {x ↦ c}
+
+        Args:
+            subjects: The subjects to match.
+
+        Yields:
+            For every match, a tuple of the index of the subject, the matching pattern and the match substitution.
+            The matches are yielded in the order of the subjects.
+        """
+        results = {}
+        commutative_cache = {}
+        for subject_index, subject in enumerate(subjects):
+            try:
+                matches = results[subject]
+            except KeyError:
+                match_iter = self._create_match_iter(subject)
+                match_iter.commutative_cache = commutative_cache
+                matches = results[subject] = list(match_iter)
+            for label, substitution in matches:
+                yield subject_index, label, Substitution(substitution)
+
+    def match_stream(self, subjects: Iterable[Expression],
+                     max_cached_subjects: int=1000) -> Iterator[Tuple[int, Any, Substitution]]:
+        """Lazily match a stream of subjects against all the matcher's patterns.
+
+        The subjects are only consumed when the matches for the previous subjects have been consumed. The commutative
+        matchers cache the patterns matching the operands of the subjects. To keep the memory usage bounded, these
+        caches are cleared between subjects once they contain more than *max_cached_subjects* operands:
+
+        >>> matcher = ManyToOneMatcher(Pattern(f(a, x_)))
+        >>> subjects = (f(a, Symbol(str(i))) for i in itertools.count())
+        >>> for index, pattern, substitution in itertools.islice(matcher.match_stream(subjects), 2):
+        ...     print(index, pattern, substitution)
+        0 f(a, x_) {x ↦ 0}
+        1 f(a, x_) {x ↦ 1}
+
+        Other match iterators of the same matcher should not be suspended while the stream is consumed, as they might
+        still need the cleared cache entries.
+
+        Args:
+            subjects:
+                An iterable of the subjects to match.
+            max_cached_subjects:
+                The maximum number of operands cached by each commutative matcher between subjects.
+
+        Yields:
+            For every match, a tuple of the index of the subject, the matching pattern and the match substitution.
+        """
+        commutative_matchers = list(self._get_commutative_matchers())
+        for subject_index, subject in enumerate(subjects):
+            for label, substitution in self._create_match_iter(subject):
+                yield subject_index, label, substitution
+            for commutative_matcher in commutative_matchers:
+                if len(commutative_matcher.subjects) > max_cached_subjects:
+                    commutative_matcher.clear_subjects()
+
+    def match_anywhere(self, subject: Expression) -> Iterator[Tuple[Tuple[int, ...], Any, Substitution]]:
+        """Match all the subexpressions of the subject against all the matcher's patterns.
+
+        The position is a tuple of indices like for :func:`~matchpy.matching.one_to_one.match_anywhere`:
+
+        >>> matcher = ManyToOneMatcher(Pattern(f(a, x_)), Pattern(f(y_, b)))
+        >>> for position, pattern, substitution in matcher.match_anywhere(f(f(a, b), f(c, f(a, b)))):
+        ...     print(position, pattern, substitution)
+        (0,) f(a, x_) {x ↦ b}
+        (0,) f(y_, b) {y ↦ a}
+        (1, 1) f(a, x_) {x ↦ b}
+        (1, 1) f(y_, b) {y ↦ a}
+
+        Subexpressions whose heads cannot start any pattern are skipped without matching. Subexpressions that occur
+        multiple times are only matched once and the matches of commutative subterms are shared between all
+        positions.
+
+        Args:
+            subject:
+                The subject whose subexpressions are matched.
+
+        Yields:
+            For every match, a tuple of the position of the subexpression, the matching pattern and the match
+            substitution. The matches are yielded in preorder of the positions.
+        """
+        root_heads = self.root.transitions.keys()
+        results = {}
+        commutative_cache = {}
+        for subexpression, position in preorder_iter_with_position(subject):
+            if root_heads.isdisjoint(_MatchIter._get_heads(subexpression)):
+                continue
+            try:
+                matches = results[subexpression]
+            except KeyError:
+                match_iter = self._create_match_iter(subexpression)
+                match_iter.commutative_cache = commutative_cache
+                matches = results[subexpression] = list(match_iter)
+            for label, substitution in matches:
+                yield position, label, Substitution(substitution)
+
+    def _get_commutative_matchers(self) -> Iterator['CommutativeMatcher']:
+        for state in self.states.values():
+            if state.matcher is not None:
+                yield state.matcher
+                yield from state.matcher.automaton._get_commutative_matchers()
+
+    async def amatch(self, subject: Expression, step_interval: int=1000, executor=None):
+        """Match the subject against all the matcher's patterns without blocking the event loop.
+
+        The matching gives control back to the event loop after every *step_interval* steps (see :meth:`match` for
+        what counts as a step):
+
+        >>> matcher = ManyToOneMatcher(Pattern(f(a, x_)), Pattern(f(y_, b)))
+        >>> async def print_matches(subject):
+        ...     async for pattern, substitution in matcher.amatch(subject, step_interval=2):
+        ...         print(pattern, substitution)
+        >>> asyncio.get_event_loop().run_until_complete(print_matches(f(a, c)))
+        f(a, x_) {x ↦ c}
+
+        Alternatively, the whole matching can be offloaded to an executor from :mod:`concurrent.futures`. Note that
+        for a process pool, the matcher and subject need to be picklable and the labels are copies.
+
         Args:
-            subject: The subject to match.
+            subject:
+                The subject to match.
+            step_interval:
+                The number of steps after which control is given back to the event loop.
+            executor:
+                An optional executor to run the matching in (see :meth:`asyncio.AbstractEventLoop.run_in_executor`).
 
         Yields:
             For every match, a tuple of the matching pattern and the match substitution.
         """
-        return _MatchIter(self, subject)
+        if executor is not None:
+            matches = await asyncio.get_event_loop().run_in_executor(executor, _match_all, self, subject)
+            for match in matches:
+                yield match
+            return
+        match_iter = self._create_match_iter(subject, step_interval=step_interval)
+        for match in match_iter._iter_with_steps():
+            if match is _STEP:
+                await asyncio.sleep(0)
+            else:
+                yield match
+
+    def match_first(self, subject: Expression, max_steps: Optional[int]=None,
+                    timeout: Optional[float]=None) -> Optional[Tuple[Any, Substitution]]:
+        """Find the match of the subject with the pattern that has the highest priority.
+
+        The branches of the automaton which can lead to patterns with a higher priority are explored first and once a
+        match is found, only branches which can still lead to a better match are explored further:
+
+        >>> matcher = ManyToOneMatcher()
+        >>> matcher.add(Pattern(f(x_, y_)), 'general')
+        >>> matcher.add(Pattern(f(a, y_)), 'special', priority=1)
+        >>> matcher.match_first(f(a, b))
+        ('special', {'y': Symbol('b')})
+        >>> matcher.match_first(f(b, b))
+        ('general', {'x': Symbol('b'), 'y': Symbol('b')})
+
+        Patterns with the same priority are preferred in the order they were added.
+
+        Args:
+            subject:
+                The subject to match.
+            max_steps:
+                The optional maximum number of steps (see :meth:`match`).
+            timeout:
+                The optional maximum time in seconds.
+
+        Returns:
+            A tuple of the label of the pattern and the match substitution, or None if there is no match.
+
+        Raises:
+            MatchBudgetExceeded:
+                If the step budget or time limit is exceeded.
+        """
+        return self._create_match_iter(subject, prioritized=True, budget=_Budget.create(max_steps, timeout)).first()
 
-    def is_match(self, subject: Expression) -> bool:
+    def _get_candidate_patterns(self, subject: Expression) -> int:
+        """Return the bitmask of the patterns whose :attr:`~.Expression.signature` is compatible with the subject's.
+
+        The patterns are grouped by their signature, so only one comparison is needed for each distinct signature.
+        """
+        mask, size, depth = subject.signature
+        candidates = 0
+        for pattern_mask, pattern_size, pattern_depth, patterns in self._get_signatures():
+            if not pattern_mask & ~mask and pattern_size <= size and pattern_depth <= depth:
+                candidates |= patterns
+        return candidates
+
+    def _get_signatures(self) -> List[Tuple[int, int, int, int]]:
+        if self.signatures is None:
+            groups = {}
+            for index, (pattern, _, _) in enumerate(self.patterns):
+                if pattern is not None:
+                    signature = getattr(pattern.expression, 'signature', (0, 0, 0))
+                    groups[signature] = groups.get(signature, 0) | (1 << index)
+            self.signatures = [signature + (patterns, ) for signature, patterns in groups.items()]
+        return self.signatures
+
+    def _get_pattern_ranks(self) -> Tuple[List[int], List[int]]:
+        """Return the rank of every pattern index and the pattern indices ordered by rank."""
+        if self.pattern_ranks is None:
+            priorities = self.priorities
+            serials = self.serials
+            order = sorted(range(len(priorities)), key=lambda i: (-priorities[i], serials[i]))
+            ranks = [0] * len(order)
+            for rank, index in enumerate(order):
+                ranks[index] = rank
+            self.pattern_ranks = (ranks, order)
+        return self.pattern_ranks
+
+    def is_match(self, subject: Expression, max_steps: Optional[int]=None, timeout: Optional[float]=None) -> bool:
         """Check if the subject matches any of the matcher's patterns.
 
         Args:
-            subject: The subject to match.
+            subject:
+                The subject to match.
+            max_steps:
+                The optional maximum number of steps (see :meth:`match`).
+            timeout:
+                The optional maximum time in seconds.
+
+        Only the values of the variables that are needed to check the constraints and repeated variables are
+        recorded and the matching stops at the first match found.
 
         Return:
             True, if the subject is matched by any of the matcher's patterns.
             False, otherwise.
+
+        Raises:
+            MatchBudgetExceeded:
+                If the step budget or time limit is exceeded before a match is found.
+        """
+        return self._create_match_iter(subject, budget=_Budget.create(max_steps, timeout), existence=True).any()
+
+    def count_matches(self, subject: Expression, max_steps: Optional[int]=None, timeout: Optional[float]=None) -> int:
+        """Count the matches of the subject for all the matcher's patterns.
+
+        The result is the same as ``len(list(matcher.match(subject)))``, but the matches are not all enumerated.
+        Only the values of variables that are needed to check constraints and repeated variables are recorded, and the
+        ways to distribute the operands of a commutative operation among sequence variables whose values are not
+        needed are counted instead of enumerated:
+
+        >>> f_c = Operation.new('f_c', Arity.variadic, commutative=True)
+        >>> matcher = ManyToOneMatcher(Pattern(f_c(Wildcard.plus('x'), Wildcard.star('y'))))
+        >>> matcher.count_matches(f_c(*(Symbol('s{}'.format(i)) for i in range(30))))
+        1073741823
+
+        Args:
+            subject:
+                The subject to match.
+            max_steps:
+                The optional maximum number of steps (see :meth:`match`).
+            timeout:
+                The optional maximum time in seconds.
+
+        Returns:
+            The number of matches.
+
+        Raises:
+            MatchBudgetExceeded:
+                If the step budget or time limit is exceeded.
+        """
+        return self._create_match_iter(subject, budget=_Budget.create(max_steps, timeout), counting=True).count()
+
+    @contextmanager
+    def profiling(self) -> Iterator[MatchProfile]:
+        """Return a context manager that collects statistics about the matching while it is active.
+
+        All matching with the matcher (including by a :class:`ManyToOneReplacer` using it) is recorded in the
+        :class:`MatchProfile` returned by the context manager:
+
+        >>> matcher = ManyToOneMatcher(Pattern(f(a, x_)), Pattern(f(y_, b)))
+        >>> with matcher.profiling() as profile:
+        ...     matches = list(matcher.match(f(a, b))) + list(matcher.match(f(b, a)))
+        >>> for row in profile.as_dict(sort_by='matches')['patterns']:
+        ...     print(row['label'], row['matches'], row['backtracks'])
+        f(a, x_) 1 0
+        f(y_, b) 1 1
+
+        The statistics can be exported with :meth:`MatchProfile.report` as text and with :meth:`MatchProfile.to_json`
+        as JSON. When the matcher is not profiled, there is no overhead.
+        """
+        profile = self.profile = MatchProfile(self)
+        try:
+            yield profile
+        finally:
+            self.profile = None
+
+    def _create_match_iter(self, subject: Expression, **kwargs) -> _MatchIter:
+        if self.profile is None:
+            return _MatchIter(self, subject, **kwargs)
+        return _ProfilingMatchIter(self, subject, **kwargs)
+
+    def _get_needed_variables(self) -> Set[str]:
+        """Return the (renamed) variables whose values are needed to decide whether a pattern matches.
+
+        Those are the variables occurring multiple times in a pattern, the variables of constraints, and all the
+        variables of patterns with global constraints.
+        """
+        if self.needed_variables is None:
+            needed_variables = set()
+            for (pattern, _, _), renaming in zip(self.patterns, self.pattern_vars):
+                if pattern is None:
+                    continue
+                counts = Multiset(
+                    e.variable_name for e in preorder_iter(pattern.expression) if getattr(e, 'variable_name', None)
+                )
+                if pattern.global_constraints:
+                    variables = counts.distinct_elements()
+                else:
+                    variables = set(v for v, c in counts.items() if c > 1)
+                    for constraint in pattern.local_constraints:
+                        variables.update(constraint.variables)
+                needed_variables.update(renaming.get(v, v) for v in variables)
+            self.needed_variables = needed_variables
+        return self.needed_variables
+
+    def minimize(self) -> Tuple[Tuple[int, int], Tuple[int, int]]:
+        """Merge equivalent states of the automaton.
+
+        Patterns are added to the automaton one after another which results in a tree shaped automaton where equivalent
+        suffixes are duplicated across branches. This merges all states that have the same outgoing transitions (going
+        to equivalent states) into one. The pattern and constraint sets of the merged transitions are combined.
+        The automata of the nested commutative matchers are minimized as well.
+
+        Patterns can still be added to the matcher after the minimization, but the automaton might need to be minimized
+        again afterwards.
+
+        >>> matcher = ManyToOneMatcher(Pattern(f(a, x_)), Pattern(f(b, x_)))
+        >>> matcher.minimize()
+        ((8, 7), (5, 5))
+
+        Returns:
+            The number of states and transitions in the automaton (including the automata of commutative matchers) as
+            a pair of tuples ``((states, transitions), (states, transitions))``, the first before and the second after
+            the minimization.
+        """
+        before = self._count_states_and_transitions()
+        representatives = {}
+        registry = {}
+        for state in reversed(list(self.states.values())):
+            for transitions in state.transitions.values():
+                transitions[:] = [t._replace(target=representatives[t.target.number]) for t in transitions]
+            representatives[state.number] = state
+            if state.matcher is not None:
+                state.matcher.automaton.minimize()
+                continue
+            if state is self.root:
+                continue
+            key = (
+                state.number in self.finals,
+                frozenset(
+                    ((type(head), head), tuple((type(t.label), t.label, t.variable_name, t.target.number) for t in ts))
+                    for head, ts in state.transitions.items()
+                )
+            )
+            for candidate in registry.setdefault(key, []):
+                if self._merge_state(candidate, state):
+                    representatives[state.number] = candidate
+                    if state.number in self.finals:
+                        self.finals[candidate.number] |= self.finals.pop(state.number)
+                    del self.states[state.number]
+                    break
+            else:
+                registry[key].append(state)
+        return before, self._count_states_and_transitions()
+
+    @staticmethod
+    def _merge_state(target: _State, state: _State) -> bool:
+        for head, transitions in state.transitions.items():
+            for transition, other in zip(transitions, target.transitions[head]):
+                if transition.subst != other.subst:
+                    return False
+        for head, transitions in state.transitions.items():
+            target_transitions = target.transitions[head]
+            for i, (transition, other) in enumerate(zip(transitions, target_transitions)):
+                check_constraints = other.check_constraints
+                if check_constraints is not None or transition.check_constraints is not None:
+                    check_constraints = (check_constraints or set()) | (transition.check_constraints or set())
+                target_transitions[i] = other._replace(
+                    patterns=other.patterns | transition.patterns, check_constraints=check_constraints
+                )
+        return True
+
+    def _count_states_and_transitions(self) -> Tuple[int, int]:
+        state_count = 0
+        transition_count = 0
+        for state in self.states.values():
+            state_count += 1
+            transition_count += sum(len(t) for t in state.transitions.values())
+            if state.matcher is not None:
+                sub_states, sub_transitions = state.matcher.automaton._count_states_and_transitions()
+                state_count += sub_states
+                transition_count += sub_transitions
+        return state_count, transition_count
+
+    def fingerprint(self, names: Dict[str, Any]=None) -> str:
+        """Return a fingerprint of the matcher's patterns and labels.
+
+        The fingerprint only depends on the patterns and labels, so it can be compared against
+        :meth:`patterns_fingerprint` to check whether a saved matcher is still up to date.
+
+        Args:
+            names:
+                The named objects as passed to :meth:`save`.
+
+        Returns:
+            The fingerprint as a hexadecimal string.
+
+        Raises:
+            ValueError:
+                If a label or constraint has no representation that is stable between processes (e.g. because its
+                :func:`repr` contains its memory address) and is not given in *names*.
+        """
+        return _fingerprint(((p, l) for p, l, _ in self.patterns if p is not None), names or {})
+
+    @staticmethod
+    def patterns_fingerprint(*patterns: Union[Pattern, Tuple[Pattern, Any]], names: Dict[str, Any]=None) -> str:
+        """Return the fingerprint a matcher with the given patterns would have.
+
+        Args:
+            *patterns:
+                The patterns, either as a :class:`.Pattern` or as a tuple of a pattern and its label.
+            names:
+                The named objects as passed to :meth:`save`.
+
+        Returns:
+            The fingerprint as a hexadecimal string.
+
+        Raises:
+            ValueError:
+                If a label or constraint has no stable representation and is not given in *names* (see
+                :meth:`fingerprint`).
+        """
+        return _fingerprint(patterns, names or {})
+
+    def save(self, file: BinaryIO, names: Dict[str, Any]=None) -> None:
+        """Save the compiled matcher to the given binary file.
+
+        Objects that cannot be pickled (like lambdas used as constraints or labels or operations created with
+        :meth:`.Operation.new`) have to be given by name. Only their names are saved and the objects have to be given
+        again when loading the matcher.
+
+        Args:
+            file:
+                A file object opened in binary mode.
+            names:
+                A dictionary of named objects which are only saved by reference to their name.
+
+        Raises:
+            ValueError:
+                If a label or constraint has no stable representation for the fingerprint and is not given in
+                *names* (see :meth:`fingerprint`).
+        """
+        names = names or {}
+        pickle.dump((_FORMAT_MAGIC, _FORMAT_VERSION, self.fingerprint(names)), file, pickle.HIGHEST_PROTOCOL)
+        _MatcherPickler(file, names).dump(self)
+
+    @classmethod
+    def load(cls, file: BinaryIO, names: Dict[str, Any]=None, fingerprint: str=None) -> 'ManyToOneMatcher':
+        """Load a matcher that was saved with :meth:`save`.
+
+        If the expected *fingerprint* is given (see :meth:`patterns_fingerprint`), a saved matcher with different
+        patterns is rejected. The same goes for matchers saved in an incompatible format. In both cases, the matcher
+        needs to be rebuilt:
+
+        >>> import io
+        >>> file = io.BytesIO()
+        >>> ManyToOneMatcher(Pattern(f(a, x_))).save(file, names={'f': f})
+        >>> _ = file.seek(0)
+        >>> try:
+        ...     fingerprint = ManyToOneMatcher.patterns_fingerprint(Pattern(f(b)))
+        ...     matcher = ManyToOneMatcher.load(file, names={'f': f}, fingerprint=fingerprint)
+        ... except ValueError:
+        ...     matcher = ManyToOneMatcher(Pattern(f(b)))
+
+        Args:
+            file:
+                A file object opened in binary mode.
+            names:
+                A dictionary of named objects which was used when saving the matcher.
+            fingerprint:
+                The expected fingerprint of the matcher.
+
+        Returns:
+            The loaded matcher.
+
+        Raises:
+            ValueError:
+                If the file does not contain a matcher in a compatible format, the fingerprint does not match, or a
+                named object is missing.
         """
-        return _MatchIter(self, subject).any()
+        try:
+            magic, version, saved_fingerprint = pickle.load(file)
+        except (pickle.UnpicklingError, EOFError, TypeError, ValueError):
+            raise ValueError('The file does not contain a saved matcher.') from None
+        if magic != _FORMAT_MAGIC or version != _FORMAT_VERSION:
+            raise ValueError('The matcher was saved in an incompatible format.')
+        if fingerprint is not None and fingerprint != saved_fingerprint:
+            raise ValueError('The saved matcher does not have the expected fingerprint.')
+        matcher = _MatcherUnpickler(file, names or {}).load()
+        if not isinstance(matcher, cls):
+            raise ValueError('The file does not contain a saved {}.'.format(cls.__name__))
+        ManyToOneMatcher._state_id = max(ManyToOneMatcher._state_id, matcher._max_state_number() + 1)
+        return matcher
+
+    def _max_state_number(self) -> int:
+        max_number = -1
+        for state in self.states.values():
+            max_number = max(max_number, state.number)
+            if state.matcher is not None:
+                max_number = max(max_number, state.matcher.automaton._max_state_number())
+        return max_number
 
     def _create_expression_transition(
             self, state: _State, expression: Expression, variable_name: Optional[str], index: int, subst=None
@@ -461,16 +1649,16 @@ class ManyToOneMatcher:
         transitions = state.transitions.setdefault(head, [])
         commutative = isinstance(expression, CommutativeOperation)
         matcher = None
-        for transition in transitions:
+        for i, transition in enumerate(transitions):
             if transition.variable_name == variable_name and transition.label == label and transition.subst == subst:
-                transition.patterns.add(index)
+                transition = transitions[i] = transition._replace(patterns=transition.patterns | 1 << index)
                 if variable_name is not None:
                     constraints = set(
                         self.constraint_vars[variable_name] if variable_name in self.constraint_vars else []
                     )
                     for c in list(constraints):
                         patterns = self.constraints[c][1]
-                        if patterns.isdisjoint(transition.patterns):
+                        if not patterns & transition.patterns:
                             constraints.discard(c)
                     transition.check_constraints.update(constraints)
                 state = transition.target
@@ -483,21 +1671,21 @@ class ManyToOneMatcher:
                 constraints = set(self.constraint_vars[variable_name] if variable_name in self.constraint_vars else [])
                 for c in list(constraints):
                     patterns = self.constraints[c][1]
-                    if index not in patterns:
+                    if not patterns & 1 << index:
                         constraints.discard(c)
             else:
                 constraints = None
-            transition = _Transition(label, state, variable_name, {index}, constraints, subst)
+            transition = _Transition(label, state, variable_name, 1 << index, constraints, subst)
             transitions.append(transition)
         return state
 
     def _create_simple_transition(self, state: _State, label: LabelType, index: int, variable_name=None) -> _State:
         if label in state.transitions:
             transition = state.transitions[label][0]
-            transition.patterns.add(index)
+            state.transitions[label][0] = transition._replace(patterns=transition.patterns | 1 << index)
             return transition.target
         new_state = self._create_state()
-        transition = _Transition(label, new_state, variable_name, {index}, None, None)
+        transition = _Transition(label, new_state, variable_name, 1 << index, None, None)
         state.transitions[label] = [transition]
         return new_state
 
@@ -524,7 +1712,7 @@ class ManyToOneMatcher:
 
     def _create_state(self, matcher: 'CommutativeMatcher'=None) -> _State:
         state = _State(ManyToOneMatcher._state_id, dict(), matcher)
-        self.states.append(state)
+        self.states[state.number] = state
         ManyToOneMatcher._state_id += 1
         return state
 
@@ -635,7 +1823,7 @@ class ManyToOneMatcher:
 
     @classmethod
     def _format_pattern_set(cls, patterns):  # pragma: no cover
-        return '{{{}}}'.format(', '.join(map(cls._colored_pattern, patterns)))
+        return '{{{}}}'.format(', '.join(map(cls._colored_pattern, _bit_indices(patterns))))
 
     @classmethod
     def _format_constraint_set(cls, constraints):  # pragma: no cover
@@ -649,7 +1837,7 @@ class ManyToOneMatcher:
             patterns = [
                 '{}: {} with {}'.format(
                     self._colored_pattern(i), html.escape(str(p.expression)), self._format_constraint_set(c)
-                ) for i, (p, l, c) in enumerate(self.patterns)
+                ) for i, (p, l, c) in enumerate(self.patterns) if p is not None
             ]
             graph.node('patterns', '<<b>Patterns:</b><br/>\n{}>'.format('<br/>\n'.join(patterns)), {'shape': 'box'})
 
@@ -667,11 +1855,13 @@ class ManyToOneMatcher:
 
     def _make_graph_nodes(self, graph: Digraph, finals: Optional[List[str]]) -> None:  # pragma: no cover
         state_patterns = {}
-        for state in self.states:
-            state_patterns.setdefault(state.number, set())
+        for state in self.states.values():
+            state_patterns.setdefault(state.number, 0)
             for transition in itertools.chain.from_iterable(state.transitions.values()):
-                state_patterns.setdefault(transition.target.number, set()).update(transition.patterns)
-        for state in self.states:
+                state_patterns[transition.target.number] = (
+                    state_patterns.get(transition.target.number, 0) | transition.patterns
+                )
+        for state in self.states.values():
             name = 'n{!s}'.format(state.number)
             if state.matcher:
                 has_states = len(state.matcher.automaton.states) > 1
@@ -709,7 +1899,7 @@ class ManyToOneMatcher:
                         '{}: {}'.format(
                             self._colored_pattern(i),
                             ', '.join('{} -&gt; {}'.format(self._colored_variable(o), n) for n, o in r.items())
-                        ) for i, r in enumerate(self.pattern_vars) if i in sp
+                        ) for i, r in enumerate(self.pattern_vars) if sp & 1 << i
                     ]
                     graph.node(
                         name + '-out', '<<b>Pattern Variables:</b><br/>\n{}>'.format('<br/>\n'.join(variables)),
@@ -718,7 +1908,7 @@ class ManyToOneMatcher:
                     graph.edge(name, name + '-out')
 
     def _make_graph_edges(self, graph: Digraph) -> None:  # pragma: no cover
-        for state in self.states:
+        for state in self.states.values():
             for _, transitions in state.transitions.items():
                 for transition in transitions:
                     t_label = '<'
@@ -741,6 +1931,10 @@ class ManyToOneMatcher:
                     graph.edge(start, end, t_label)
 
 
+def _match_all(matcher: ManyToOneMatcher, subject: Expression) -> List[Tuple[Any, Substitution]]:
+    return list(matcher.match(subject))
+
+
 class ManyToOneReplacer:
     """Class that contains a set of replacement rules and can apply them efficiently to an expression."""
 
@@ -763,16 +1957,48 @@ class ManyToOneReplacer:
         for rule in rules:
             self.add(rule)
 
-    def add(self, rule: 'functions.ReplacementRule') -> None:
+    def add(self, rule: 'functions.ReplacementRule', priority: int=0) -> None:
         """Add a new rule to the replacer.
 
+        If multiple rules match, the one with the highest priority is applied. Between rules with the same priority,
+        the one added first is applied. If all the rules have the same priority, whichever matching rule is found
+        first is applied, since then the search can stop at the first match.
+
         Args:
             rule:
                 The rule to add.
+            priority:
+                The priority of the rule.
         """
-        self.matcher.add(rule.pattern, rule.replacement)
+        self.matcher.add(rule.pattern, rule.replacement, priority)
 
-    def replace(self, expression: Expression, max_count: int=math.inf) -> Union[Expression, Sequence[Expression]]:
+    def remove(self, pattern_or_replacement) -> int:
+        """Remove the replacement rules with the given pattern or replacement callback.
+
+        See :meth:`ManyToOneMatcher.remove` for details.
+        """
+        return self.matcher.remove(pattern_or_replacement)
+
+    def save(self, file: BinaryIO, names: Dict[str, Any]=None) -> None:
+        """Save the replacer to the given binary file.
+
+        See :meth:`ManyToOneMatcher.save` for details. The replacement callbacks usually have to be given by name.
+        """
+        self.matcher.save(file, names)
+
+    @classmethod
+    def load(cls, file: BinaryIO, names: Dict[str, Any]=None, fingerprint: str=None) -> 'ManyToOneReplacer':
+        """Load a replacer that was saved with :meth:`save`.
+
+        See :meth:`ManyToOneMatcher.load` for details. The fingerprint for a set of rules can be computed by passing
+        the rules to :meth:`ManyToOneMatcher.patterns_fingerprint`.
+        """
+        replacer = cls()
+        replacer.matcher = ManyToOneMatcher.load(file, names, fingerprint)
+        return replacer
+
+    def replace(self, expression: Expression, max_count: int=math.inf, max_steps: Optional[int]=None,
+                timeout: Optional[float]=None) -> Union[Expression, Sequence[Expression]]:
         """Replace all occurrences of the patterns according to the replacement rules.
 
         Args:
@@ -782,28 +2008,44 @@ class ManyToOneReplacer:
                 If given, at most *max_count* applications of the rules are performed. Otherwise, the rules
                 are applied until there is no more match. If the set of replacement rules is not confluent,
                 the replacement might not terminate without a *max_count* set.
+            max_steps:
+                The optional maximum number of matching steps for all the matches together
+                (see :meth:`ManyToOneMatcher.match`).
+            timeout:
+                The optional maximum time in seconds.
 
         Returns:
             The resulting expression after the application of the replacement rules. This can also be a sequence of
             expressions, if the root expression is replaced with a sequence of expressions by a rule.
+
+        Raises:
+            MatchBudgetExceeded:
+                If the step budget or time limit is exceeded. Its ``result`` is the expression after the replacements
+                performed so far.
         """
+        budget = _Budget.create(max_steps, timeout)
+        prioritized = self._has_priorities()
         replaced = True
         replace_count = 0
         while replaced and replace_count < max_count:
             replaced = False
             for subexpr, pos in preorder_iter_with_position(expression):
                 try:
-                    replacement, subst = next(iter(self.matcher.match(subexpr)))
+                    match = self._first_match(subexpr, budget, prioritized)
+                except MatchBudgetExceeded as error:
+                    error.result = expression
+                    raise
+                if match is not None:
+                    replacement, subst = match
                     result = replacement(**subst)
                     expression = functions.replace(expression, pos, result)
                     replaced = True
                     break
-                except StopIteration:
-                    pass
             replace_count += 1
         return expression
 
-    def replace_post_order(self, expression: Expression) -> Union[Expression, Sequence[Expression]]:
+    def replace_post_order(self, expression: Expression, max_steps: Optional[int]=None,
+                           timeout: Optional[float]=None) -> Union[Expression, Sequence[Expression]]:
         """Replace all occurrences of the patterns according to the replacement rules.
 
         Replaces innermost expressions first.
@@ -811,42 +2053,55 @@ class ManyToOneReplacer:
         Args:
             expression:
                 The expression to which the replacement rules are applied.
-            max_count:
-                If given, at most *max_count* applications of the rules are performed. Otherwise, the rules
-                are applied until there is no more match. If the set of replacement rules is not confluent,
-                the replacement might not terminate without a *max_count* set.
+            max_steps:
+                The optional maximum number of matching steps for all the matches together
+                (see :meth:`ManyToOneMatcher.match`).
+            timeout:
+                The optional maximum time in seconds.
 
         Returns:
             The resulting expression after the application of the replacement rules. This can also be a sequence of
             expressions, if the root expression is replaced with a sequence of expressions by a rule.
+
+        Raises:
+            MatchBudgetExceeded:
+                If the step budget or time limit is exceeded.
         """
-        return self._replace_post_order(expression)[0]
+        return self._replace_post_order(expression, _Budget.create(max_steps, timeout), self._has_priorities())[0]
 
-    def _replace_post_order(self, expression):
+    def _replace_post_order(self, expression, budget=None, prioritized=True):
         any_replaced = False
         while True:
             if isinstance(expression, Operation):
-                new_operands = [self._replace_post_order(o) for o in op_iter(expression)]
+                new_operands = [self._replace_post_order(o, budget, prioritized) for o in op_iter(expression)]
                 if any(r for _, r in new_operands):
                     new_operands = [o for o, _ in new_operands]
                     expression = create_operation_expression(expression, new_operands)
                     any_replaced = True
-            try:
-                replacement, subst = next(iter(self.matcher.match(expression)))
-                expression = replacement(**subst)
-                any_replaced = True
-            except StopIteration:
+            match = self._first_match(expression, budget, prioritized)
+            if match is None:
                 break
+            replacement, subst = match
+            expression = replacement(**subst)
+            any_replaced = True
         return expression, any_replaced
 
+    def _has_priorities(self) -> bool:
+        """Return True if the rules do not all have the same priority."""
+        matcher = self.matcher
+        priorities = set(p for (pattern, _, _), p in zip(matcher.patterns, matcher.priorities) if pattern is not None)
+        return len(priorities) > 1
 
-Subgraph = BipartiteGraph[Tuple[int, int], Tuple[int, int], Substitution]
-Matching = Dict[Tuple[int, int], Tuple[int, int]]
+    def _first_match(self, expression, budget, prioritized):
+        if prioritized:
+            return self.matcher._create_match_iter(expression, prioritized=True, budget=budget).first()
+        return next(iter(self.matcher._create_match_iter(expression, budget=budget)), None)
 
 
 class CommutativeMatcher(object):
     __slots__ = (
-        'patterns', 'subjects', 'subjects_by_id', 'automaton', 'bipartite', 'associative', 'max_optional_count', 'anonymous_patterns'
+        'patterns', 'subjects', 'subjects_by_id', 'automaton', 'bipartite', 'associative', 'max_optional_count',
+        'anonymous_patterns', 'subpattern_index', 'pattern_keys', 'free_ids', 'subpattern_uses'
     )
 
     def __init__(self, associative: Optional[type]) -> None:
@@ -858,6 +2113,10 @@ class CommutativeMatcher(object):
         self.associative = associative
         self.max_optional_count = 0
         self.anonymous_patterns = set()
+        self.subpattern_index = None
+        self.pattern_keys = {}  # type: Dict[int, tuple]
+        self.free_ids = []  # type: List[int]
+        self.subpattern_uses = Counter()  # type: Dict[int, int]
 
     def add_pattern(self, operands: Iterable[Expression], constraints) -> int:
         pattern_set, pattern_vars = self._extract_sequence_wildcards(operands, constraints)
@@ -865,65 +2124,155 @@ class CommutativeMatcher(object):
         sorted_subpatterns = tuple(sorted(pattern_set))
         pattern_key = sorted_subpatterns + sorted_vars
         if pattern_key not in self.patterns:
-            inserted_id = len(self.patterns)
+            inserted_id = heapq.heappop(self.free_ids) if self.free_ids else len(self.pattern_keys)
             self.patterns[pattern_key] = (inserted_id, pattern_set, sorted_vars)
+            self.pattern_keys[inserted_id] = pattern_key
+            self.subpattern_uses.update(pattern_set.distinct_elements())
+            self.subpattern_index = None
         else:
             inserted_id = self.patterns[pattern_key][0]
         return inserted_id
 
+    def remove_pattern(self, pattern_id: int) -> None:
+        if pattern_id not in self.pattern_keys:
+            raise KeyError('There is no commutative pattern with the id {}.'.format(pattern_id))
+        _, pattern_set, _ = self.patterns.pop(self.pattern_keys.pop(pattern_id))
+        heapq.heappush(self.free_ids, pattern_id)
+        self.subpattern_index = None
+        for index in pattern_set.distinct_elements():
+            self.subpattern_uses[index] -= 1
+            if not self.subpattern_uses[index]:
+                del self.subpattern_uses[index]
+                self.automaton._remove_index(index)
+                self.anonymous_patterns.discard(index)
+
     def get_match_iter(self, subject):
         match_iter = _MatchIter(self.automaton, subject, self.associative)
         for _ in match_iter._match(self.automaton.root):
-            for pattern_index in match_iter.patterns:
+            for pattern_index in _bit_indices(match_iter.patterns):
                 substitution = Substitution(match_iter.substitution)
                 yield pattern_index, substitution
 
 
+    def clear_subjects(self) -> None:
+        """Clear the cached subjects and their edges in the bipartite graph."""
+        self.subjects = {}
+        self.subjects_by_id = {}
+        self.bipartite = BipartiteGraph()
+
     def add_subject(self, subject: Expression) -> None:
         if subject not in self.subjects:
             subject_id, pattern_set = self.subjects[subject] = (len(self.subjects), set())
             self.subjects_by_id[subject_id] = subject
             for pattern_index, substitution in self.get_match_iter(subject):
-                self.bipartite.setdefault((subject_id, pattern_index), []).append(Substitution(substitution))
+                self.bipartite.setdefault((subject_id, pattern_index), []).append(substitution)
                 pattern_set.add(pattern_index)
         else:
             subject_id, _ = self.subjects[subject]
         return subject_id
 
-    def match(self, subjects: Sequence[Expression], substitution: Substitution) -> Iterator[Tuple[int, Substitution]]:
-        subject_ids = Multiset()
-        pattern_ids = Multiset()
+    def match(self, subjects: Sequence[Expression], substitution: Substitution, steps: bool=False,
+              needed_variables: Optional[Set[str]]=None, existence: bool=False) -> Iterator[Tuple[int, Substitution]]:
+        """Match the subjects against all the commutative patterns.
+
+        If *needed_variables* is given, the partitions of the subjects among sequence variables that are not needed
+        are counted instead of enumerated, and a tuple of the pattern index, the substitution and the number of
+        matches it stands for is yielded instead. If *existence* is True as well, the count is only correct in being
+        positive, because the sequence variables that are not needed are merged into a single anonymous one and
+        only the partitions among the needed variables are enumerated.
+        """
+        weighted = needed_variables is not None
+        subject_counts = {}  # type: Dict[int, int]
+        pattern_counts = {}  # type: Dict[int, int]
         if self.max_optional_count > 0:
             subject_id, subject_pattern_ids = self.subjects[None]
-            subject_ids.add(subject_id)
-            for _ in range(self.max_optional_count):
-                pattern_ids.update(subject_pattern_ids)
+            subject_counts[subject_id] = 1
+            for subpattern_id in subject_pattern_ids:
+                pattern_counts[subpattern_id] = self.max_optional_count
         for subject in op_iter(subjects):
             subject_id, subject_pattern_ids = self.subjects[subject]
-            subject_ids.add(subject_id)
-            pattern_ids.update(subject_pattern_ids)
-        for pattern_index, pattern_set, pattern_vars in self.patterns.values():
+            subject_counts[subject_id] = subject_counts.get(subject_id, 0) + 1
+            for subpattern_id in subject_pattern_ids:
+                pattern_counts[subpattern_id] = pattern_counts.get(subpattern_id, 0) + 1
+        subjects_by_id = self.subjects_by_id
+        for pattern_index, pattern_set, pattern_vars in self._candidate_patterns(pattern_counts):
             if pattern_set:
-                if not pattern_set <= pattern_ids:
-                    continue
-                bipartite_match_iter = self._match_with_bipartite(subject_ids, pattern_set, substitution)
-                for bipartite_substitution, matched_subjects in bipartite_match_iter:
-                    ids = subject_ids - matched_subjects
-                    remaining = Multiset(self.subjects_by_id[id] for id in ids if self.subjects_by_id[id] is not None)
+                bipartite_match_iter = self._match_with_bipartite(subject_counts, pattern_set, substitution, steps)
+                for bipartite_match in bipartite_match_iter:
+                    if bipartite_match is _STEP:
+                        yield _STEP
+                        continue
+                    bipartite_substitution, remaining_counts = bipartite_match
+                    remaining = Multiset(dict(
+                        (subjects_by_id[id], count) for id, count in remaining_counts.items()
+                        if count > 0 and subjects_by_id[id] is not None
+                    ))
                     if pattern_vars:
                         sequence_var_iter = self._match_sequence_variables(
-                            remaining, pattern_vars, bipartite_substitution
+                            remaining, pattern_vars, bipartite_substitution, steps, needed_variables, existence
                         )
                         for result_substitution in sequence_var_iter:
-                            yield pattern_index, result_substitution
+                            if result_substitution is _STEP:
+                                yield _STEP
+                            elif weighted:
+                                yield (pattern_index, *result_substitution)
+                            else:
+                                yield pattern_index, result_substitution
                     elif len(remaining) == 0:
-                        yield pattern_index, bipartite_substitution
+                        if weighted:
+                            yield pattern_index, bipartite_substitution, 1
+                        else:
+                            yield pattern_index, bipartite_substitution
             elif pattern_vars:
-                sequence_var_iter = self._match_sequence_variables(Multiset(op_iter(subjects)), pattern_vars, substitution)
+                sequence_var_iter = self._match_sequence_variables(
+                    Multiset(op_iter(subjects)), pattern_vars, substitution, steps, needed_variables, existence
+                )
                 for variable_substitution in sequence_var_iter:
-                    yield pattern_index, variable_substitution
+                    if variable_substitution is _STEP:
+                        yield _STEP
+                    elif weighted:
+                        yield (pattern_index, *variable_substitution)
+                    else:
+                        yield pattern_index, variable_substitution
             elif op_len(subjects) == 0:
-                yield pattern_index, substitution
+                yield (pattern_index, substitution, 1) if weighted else (pattern_index, substitution)
+
+    def _candidate_patterns(self, pattern_counts: Dict[int, int]) -> List[Tuple[int, MultisetOfInt, tuple]]:
+        """Return the patterns whose operand patterns are all matched by enough subjects.
+
+        The *pattern_counts* map every operand pattern to the number of subjects it matches. Using the inverted index
+        from the operand patterns to the commutative patterns that need them, only the patterns that share an operand
+        pattern with the subjects are looked at. Every pattern counts how many of its distinct operand patterns are
+        matched often enough and becomes a candidate once all of them are.
+        """
+        subpattern_index = self.subpattern_index
+        if subpattern_index is None:
+            subpattern_index = self.subpattern_index = self._build_subpattern_index()
+        entries, index, required_counts, unconditional = subpattern_index
+        candidates = list(unconditional)
+        satisfied_counts = {}  # type: Dict[int, int]
+        for subpattern_id, available in pattern_counts.items():
+            for position, needed in index.get(subpattern_id, ()):
+                if available >= needed:
+                    satisfied = satisfied_counts.get(position, 0) + 1
+                    satisfied_counts[position] = satisfied
+                    if satisfied == required_counts[position]:
+                        candidates.append(position)
+        candidates.sort()
+        return [entries[position] for position in candidates]
+
+    def _build_subpattern_index(self):
+        entries = list(self.patterns.values())
+        index = {}  # type: Dict[int, List[Tuple[int, int]]]
+        required_counts = []
+        unconditional = []
+        for position, (_, pattern_set, _) in enumerate(entries):
+            required_counts.append(len(pattern_set.distinct_elements()))
+            if not pattern_set:
+                unconditional.append(position)
+            for subpattern_id, count in pattern_set.items():
+                index.setdefault(subpattern_id, []).append((position, count))
+        return entries, index, required_counts, unconditional
 
     def _extract_sequence_wildcards(self, operands: Iterable[Expression],
                                     constraints) -> Tuple[MultisetOfInt, Dict[str, Tuple[VariableWithCount, bool]]]:
@@ -937,8 +2286,8 @@ class CommutativeMatcher(object):
                 actual_constraints = [c for c in constraints if contains_variables_from_set(operand, c.variables)]
                 pattern = Pattern(operand, *actual_constraints)
                 index = None
-                for i, (p, _, _) in enumerate(self.automaton.patterns):
-                    if pattern == p:
+                for i in self.automaton._lookup(pattern):
+                    if pattern == self.automaton.patterns[i][0]:
                         index = i
                         break
                 else:
@@ -947,6 +2296,8 @@ class CommutativeMatcher(object):
                     index = self.automaton._internal_add(pattern, None, renaming)
                     if is_anonymous(pattern.expression):
                         self.anonymous_patterns.add(index)
+                    # The cached subjects have not been matched against the new operand pattern
+                    self.clear_subjects()
                 pattern_set.add(index)
             else:
                 varname = getattr(operand, 'variable_name', None)
@@ -978,33 +2329,102 @@ class CommutativeMatcher(object):
 
     def _match_with_bipartite(
             self,
-            subject_ids: MultisetOfInt,
+            subject_counts: Dict[int, int],
             pattern_set: MultisetOfInt,
             substitution: Substitution,
-    ) -> Iterator[Tuple[Substitution, MultisetOfInt]]:
-        bipartite = self._build_bipartite(subject_ids, pattern_set)
-        for matching in enum_maximum_matchings_iter(bipartite):
-            if len(matching) < len(pattern_set):
-                break
-            if not self._is_canonical_matching(matching):
-                continue
-            for substs in itertools.product(*(bipartite[edge] for edge in matching.items())):
+            steps: bool=False
+    ) -> Iterator[Tuple[Substitution, Dict[int, int]]]:
+        """Match the subjects with the given counts against the patterns in the pattern set.
+
+        Yields the match substitution together with the counts of the subjects that were not matched.
+        """
+        anonymous_patterns = self.anonymous_patterns.intersection(pattern_set.distinct_elements())
+        bipartite = self._build_bipartite(subject_counts, pattern_set)
+        matching_iter = enum_block_matchings_iter(
+            bipartite, subject_counts, pattern_set, anonymous_patterns, _STEP if steps else None
+        )
+        for matching in matching_iter:
+            if steps:
+                yield _STEP
+                if matching is _STEP:
+                    continue
+            edge_counts, anonymous_counts = matching
+            remaining_counts = dict(subject_counts)
+            for subject_id, count in anonymous_counts.items():
+                remaining_counts[subject_id] -= count
+            substitution_lists = []
+            for edge, count in edge_counts.items():
+                remaining_counts[edge[0]] -= count
+                substitution_lists.extend([bipartite[edge]] * count)
+            for bipartite_substitution in self._join_substitutions(substitution, substitution_lists, steps):
+                if bipartite_substitution is _STEP:
+                    yield _STEP
+                else:
+                    yield bipartite_substitution, remaining_counts
+
+    @staticmethod
+    def _join_substitutions(substitution: Substitution, substitution_lists: List[List[Substitution]],
+                            steps: bool=False) -> Iterator[Substitution]:
+        """Yield every union of the substitution with one substitution from each of the lists that does not conflict.
+
+        The substitutions are added one list at a time, starting with the shortest lists, and every conflicting
+        partial union is discarded right away together with all its extensions. If *steps* is True, a step is yielded
+        for every union that is tried.
+        """
+        if not substitution_lists:
+            yield Substitution(substitution)
+            return
+        substitution_lists = sorted(substitution_lists, key=len)
+        partial_unions = [substitution]
+        iterators = [iter(substitution_lists[0])]
+        while iterators:
+            for other in iterators[-1]:
+                if steps:
+                    yield _STEP
                 try:
-                    bipartite_substitution = substitution.union(*substs)
+                    union = partial_unions[-1].union(other)
                 except ValueError:
                     continue
-                matched_subjects = Multiset(subexpression for subexpression, _ in matching)
-                yield bipartite_substitution, matched_subjects
+                if len(iterators) == len(substitution_lists):
+                    yield union
+                else:
+                    partial_unions.append(union)
+                    iterators.append(iter(substitution_lists[len(iterators)]))
+                    break
+            else:
+                iterators.pop()
+                partial_unions.pop()
 
     def _match_sequence_variables(
             self,
             subjects: MultisetOfExpression,
             pattern_vars: Sequence[VariableWithCount],
             substitution: Substitution,
+            steps: bool=False,
+            needed_variables: Optional[Set[str]]=None,
+            existence: bool=False
     ) -> Iterator[Substitution]:
+        if existence:
+            # Any way to distribute the rest among the variables that are not needed will do
+            needed_vars = [
+                var for var in pattern_vars if var[0].name is not None and
+                (var[0].name in needed_variables or var[0].name in substitution)
+            ]
+            if len(needed_vars) < len(pattern_vars) - 1:
+                min_count = sum(info.minimum for info, _ in pattern_vars) - sum(info.minimum for info, _ in needed_vars)
+                pattern_vars = needed_vars + [(VariableWithCount(None, 1, min_count, None), False)]
         only_counts = [info for info, _ in pattern_vars]
+        if needed_variables is not None:
+            if all(name is None or (name not in needed_variables and name not in substitution)
+                   for name, _, _, _ in only_counts):
+                count = commutative_sequence_variable_partition_count(subjects, only_counts)
+                if count > 0:
+                    yield substitution, count
+                return
         wrapped_vars = [name for (name, _, _, _), wrap in pattern_vars if wrap and name]
         for variable_substitution in commutative_sequence_variable_partition_iter(subjects, only_counts):
+            if steps:
+                yield _STEP
             for var in wrapped_vars:
                 operands = variable_substitution[var]
                 if isinstance(operands, (tuple, list, Multiset)):
@@ -1016,44 +2436,10 @@ class CommutativeMatcher(object):
                 result_substitution = substitution.union(variable_substitution)
             except ValueError:
                 continue
-            yield result_substitution
-
-    def _build_bipartite(self, subjects: MultisetOfInt, patterns: MultisetOfInt) -> Subgraph:
-        bipartite = BipartiteGraph()
-        n = 0
-        m = 0
-        p_states = {}
-        for subject, s_count in subjects.items():
-            if (LEFT, subject) in self.bipartite._graph:
-                any_patterns = False
-                for _, pattern in self.bipartite._graph[LEFT, subject]:
-                    if pattern in patterns:
-                        any_patterns = True
-                        subst = self.bipartite[subject, pattern]
-                        p_count = patterns[pattern]
-                        if pattern in p_states:
-                            p_start = p_states[pattern]
-                        else:
-                            p_start = p_states[pattern] = m
-                            m += p_count
-                        for i in range(n, n + s_count):
-                            for j in range(p_start, p_start + p_count):
-                                bipartite[(subject, i), (pattern, j)] = subst
-                if any_patterns:
-                    n += s_count
-
-        return bipartite
-
-    def _is_canonical_matching(self, matching: Matching) -> bool:
-        anonymous_patterns = self.anonymous_patterns
-        for (s1, n1), (p1, m1) in matching.items():
-            for (s2, n2), (p2, m2) in matching.items():
-                if p1 in anonymous_patterns and p2 in anonymous_patterns:
-                    if n1 < n2 and m1 > m2:
-                        return False
-                elif s1 == s2 and n1 < n2 and m1 > m2:
-                    return False
-        return True
+            yield (result_substitution, 1) if needed_variables is not None else result_substitution
+
+    def _build_bipartite(self, subjects: Iterable[int], patterns: MultisetOfInt) -> BipartiteGraphView:
+        return self.bipartite.limited_to(subjects, patterns.distinct_elements())
 
     def bipartite_as_graph(self) -> Graph:  # pragma: no cover
         """Returns a :class:`graphviz.Graph` representation of this bipartite graph."""
@@ -1063,7 +2449,7 @@ class CommutativeMatcher(object):
         nodes_left = {}  # type: Dict[TLeft, str]
         nodes_right = {}  # type: Dict[TRight, str]
         node_id = 0
-        for (left, right), value in self.bipartite._edges.items():
+        for (left, right), value in self.bipartite.edges_with_labels():
             if left not in nodes_left:
                 name = 'node{:d}'.format(node_id)
                 nodes_left[left] = name
@@ -1089,19 +2475,17 @@ class CommutativeMatcher(object):
         nodes_left = {}  # type: Dict[TLeft, str]
         nodes_right = {}  # type: Dict[TRight, str]
         node_id = 0
-        for (left, right), value in bipartite._edges.items():
+        for (left, right), value in bipartite.edges_with_labels():
             if left not in nodes_left:
-                subject_id, i = left
                 name = 'node{:d}'.format(node_id)
                 nodes_left[left] = name
-                label = '{}, {}'.format(i, self.subjects_by_id[subject_id])
+                label = '{} × {}'.format(subjects[left], self.subjects_by_id[left])
                 graph.node(name, label=label)
                 node_id += 1
             if right not in nodes_right:
-                pattern, i = right
                 name = 'node{:d}'.format(node_id)
                 nodes_right[right] = name
-                label = '{}, {}'.format(i, self.automaton.patterns[pattern][0])
+                label = '{} × {}'.format(patterns[right], self.automaton.patterns[right][0])
                 graph.node(name, label=label)
                 node_id += 1
             edge_label = value is not True and str(value) or ''
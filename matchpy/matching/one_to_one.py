@@ -9,11 +9,12 @@ from ..expressions.expressions import (
 from ..expressions.constraints import Constraint
 from ..expressions.substitution import Substitution
 from ..expressions.functions import (
-    is_constant, preorder_iter_with_position, match_head, create_operation_expression, op_iter, op_len
+    is_constant, preorder_iter_with_position, match_head, create_operation_expression, op_iter, op_len,
+    signature_may_match
 )
 from ..utils import (
     VariableWithCount, commutative_sequence_variable_partition_iter, fixed_integer_vector_iter, weak_composition_iter,
-    generator_chain, optional_iter
+    generator_chain, optional_iter, OperandCounts
 )
 from ._common import CommutativePatternsParts, check_one_identity
 
@@ -40,6 +41,8 @@ def match(subject: Expression, pattern: Pattern) -> Iterator[Substitution]:
     """
     if not is_constant(subject):
         raise ValueError("The subject for matching must be constant.")
+    if not signature_may_match(subject, pattern):
+        return
     global_constraints = [c for c in pattern.constraints if not c.variables]
     local_constraints = set(c for c in pattern.constraints if c.variables)
     for subst in _match([subject], pattern.expression, Substitution(), local_constraints):
@@ -106,8 +109,8 @@ def _match(subjects: List[Expression], pattern: Expression, subst: Substitution,
         if len(subjects) != 1 or not isinstance(subjects[0], pattern.__class__):
             return
         op_expr = cast(Operation, subjects[0])
-        # if not op_expr.symbols >= pattern.symbols:
-        #     return
+        if not signature_may_match(op_expr, pattern):
+            return
         match_iter = _match_operation(op_expr, pattern, subst, constraints)
 
     else:
@@ -260,10 +263,9 @@ def _match_commutative_operation(
         substitution: Substitution,
         constraints
 ) -> Iterator[Substitution]:
-    subjects = Multiset(op_iter(subject_operands))  # type: Multiset
-    if not pattern.constant <= subjects:
+    subjects = OperandCounts(op_iter(subject_operands)).subtract(pattern.constant)
+    if subjects is None:
         return
-    subjects -= pattern.constant
     rest_expr = pattern.rest + pattern.syntactic
     needed_length = (
         pattern.sequence_variable_min_length + pattern.fixed_variable_length + len(rest_expr) +
@@ -278,16 +280,14 @@ def _match_commutative_operation(
         if name in substitution:
             replacement = substitution[name]
             if issubclass(pattern.operation, AssociativeOperation) and isinstance(replacement, pattern.operation):
-                needed_count = Multiset(op_iter(substitution[name]))  # type: Multiset
+                needed = op_iter(replacement)
             else:
                 if isinstance(replacement, (tuple, list, Multiset)):
                     return
-                needed_count = Multiset({replacement: 1})
-            if count > 1:
-                needed_count *= count
-            if not needed_count <= subjects:
+                needed = (replacement, )
+            subjects = subjects.subtract(needed, count)
+            if subjects is None:
                 return
-            subjects -= needed_count
             del fixed_vars[name]
 
     factories = [_fixed_expr_factory(e, constraints) for e in rest_expr]
@@ -317,7 +317,7 @@ def _match_commutative_operation(
         if pattern.wildcard_fixed is False:
             sequence_vars += (VariableWithCount(None, 1, pattern.wildcard_min_length, None), )
 
-        for sequence_subst in commutative_sequence_variable_partition_iter(Multiset(rem_expr), sequence_vars):
+        for sequence_subst in commutative_sequence_variable_partition_iter(rem_expr.to_multiset(), sequence_vars):
             if issubclass(pattern.operation, AssociativeOperation):
                 for v in fixed_vars.distinct_elements():
                     if v not in sequence_subst:
@@ -351,10 +351,10 @@ def _variables_with_counts(variables, infos):
 def _fixed_expr_factory(expression, constraints):
     def factory(data):
         subjects, substitution = data
-        for expr in subjects.distinct_elements():
+        for index, expr, _ in subjects.items():
             if match_head(expr, expression):
                 for subst in _match([expr], expression, substitution, constraints):
-                    yield subjects - Multiset({expr: 1}), subst
+                    yield subjects.subtract_id(index), subst
 
     return factory
 
@@ -367,31 +367,29 @@ def _fixed_var_iter_factory(variable_name, count, length, symbol_type, constrain
                      if not isinstance(substitution[variable_name], (tuple, list, Multiset)) else substitution[variable_name])
             if optional is not None and value == [optional]:
                 yield subjects, substitution
-            existing = Multiset(value) * count
-            if not existing <= subjects:
+            remaining = subjects.subtract(value, count)
+            if remaining is None:
                 return
-            yield subjects - existing, substitution
+            yield remaining, substitution
         else:
             if optional is not None:
                 new_substitution = Substitution(substitution)
                 new_substitution[variable_name] = optional
                 yield subjects, new_substitution
             if length == 1:
-                for expr, expr_count in subjects.items():
+                for index, expr, expr_count in subjects.items():
                     if expr_count >= count and (symbol_type is None or isinstance(expr, symbol_type)):
                         if variable_name is not None:
                             new_substitution = Substitution(substitution)
                             new_substitution[variable_name] = expr
                             for new_substitution in _check_constraints(new_substitution, constraints):
-                                yield subjects - Multiset({expr: count}), new_substitution
+                                yield subjects.subtract_id(index, count), new_substitution
                         else:
-                            yield subjects - Multiset({expr: count}), substitution
+                            yield subjects.subtract_id(index, count), substitution
             else:
                 assert variable_name is None, "Fixed variables with length != 1 are not supported."
-                exprs_with_counts = list(subjects.items())
-                counts = tuple(c // count for _, c in exprs_with_counts)
+                counts = tuple(c // count for c in subjects.counts)
                 for subset in fixed_integer_vector_iter(counts, length):
-                    sub_counter = Multiset(dict((exprs_with_counts[i][0], c * count) for i, c in enumerate(subset)))
-                    yield subjects - sub_counter, substitution
+                    yield subjects.subtract_vector([c * count for c in subset]), substitution
 
     return factory
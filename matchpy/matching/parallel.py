@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""Contains the :class:`ParallelMatcher` which distributes matching with a compiled matcher over worker processes.
+
+The matcher (or replacer) is serialized once and loaded once in every worker process. The subjects are sent to the
+workers in chunks, and only a bounded number of chunks is in flight at a time, so the subjects can come from a large
+(or even endless) iterator:
+
+>>> matcher = ManyToOneMatcher(Pattern(f(a, x_)), Pattern(f(y_, b)))
+>>> with ParallelMatcher(matcher, processes=2, chunk_size=2, names={'f': f}) as parallel_matcher:
+...     for index, pattern, substitution in parallel_matcher.match([f(a, c), f(c, c), f(a, b)]):
+...         print(index, pattern, substitution)
+0 f(a, x_) {x ↦ c}
+2 f(a, x_) {x ↦ b}
+2 f(y_, b) {y ↦ a}
+
+Since the subjects and the results are sent between processes, objects that cannot be pickled (like operations created
+with :meth:`.Operation.new` or lambda constraints) have to be given by name, just like for
+:meth:`.ManyToOneMatcher.save`. The named objects themselves are handed to the worker processes when they are started.
+That only works if the processes are started by forking (the default on Unix). With the ``spawn`` or ``forkserver``
+start methods, the named objects are pickled too, so they must be importable by reference (e.g. module level functions
+and classes).
+"""
+import io
+import itertools
+import math
+import multiprocessing
+import os
+import queue
+from collections import deque
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+from ..expressions.expressions import Expression
+from ..expressions.substitution import Substitution
+from .many_to_one import ManyToOneMatcher, ManyToOneReplacer, _MatcherPickler, _MatcherUnpickler
+
+__all__ = ['ParallelMatcher']
+
+_worker_state = None
+
+
+def _dumps(obj: Any, names: Dict[str, Any]) -> bytes:
+    file = io.BytesIO()
+    _MatcherPickler(file, names).dump(obj)
+    return file.getvalue()
+
+
+def _loads(data: bytes, names: Dict[str, Any]) -> Any:
+    return _MatcherUnpickler(io.BytesIO(data), names).load()
+
+
+def _init_worker(data: bytes, names: Dict[str, Any], is_replacer: bool) -> None:
+    global _worker_state
+    file = io.BytesIO(data)
+    if is_replacer:
+        replacer = ManyToOneReplacer.load(file, names)
+        matcher = replacer.matcher
+    else:
+        replacer = None
+        matcher = ManyToOneMatcher.load(file, names)
+    label_indices = {
+        id(label): index for index, (pattern, label, _) in enumerate(matcher.patterns) if pattern is not None
+    }
+    _worker_state = (matcher, replacer, names, label_indices)
+
+
+def _match_chunk(task: Tuple[int, bytes]) -> bytes:
+    matcher, _, names, label_indices = _worker_state
+    start, data = task
+    results = []
+    for subject_index, subject in enumerate(_loads(data, names), start):
+        for label, substitution in matcher.match(subject):
+            results.append((subject_index, label_indices[id(label)], substitution))
+    return _dumps(results, names)
+
+
+def _replace_chunk(task: Tuple[int, bytes, float]) -> bytes:
+    _, replacer, names, _ = _worker_state
+    start, data, max_count = task
+    results = [
+        (subject_index, replacer.replace(subject, max_count))
+        for subject_index, subject in enumerate(_loads(data, names), start)
+    ]
+    return _dumps(results, names)
+
+
+class ParallelMatcher:
+    """Matches subjects against a compiled matcher in parallel using a pool of worker processes."""
+
+    def __init__(
+            self,
+            matcher: Union[ManyToOneMatcher, ManyToOneReplacer],
+            processes: Optional[int]=None,
+            chunk_size: int=64,
+            names: Dict[str, Any]=None,
+            context=None,
+            max_pending: Optional[int]=None
+    ) -> None:
+        """
+        Args:
+            matcher:
+                The :class:`.ManyToOneMatcher` or :class:`.ManyToOneReplacer` to use. It is serialized once when the
+                pool is created, so changes made to it afterwards are not seen by the workers.
+            processes:
+                The number of worker processes. Defaults to the number of CPUs.
+            chunk_size:
+                The number of subjects that are sent to a worker at once.
+            names:
+                A dictionary of named objects which are only sent by reference to their name
+                (see :meth:`.ManyToOneMatcher.save`). The objects are passed to the worker processes when they are
+                started, so unless the processes are forked, they must be picklable.
+            context:
+                An optional :mod:`multiprocessing` context used to create the pool.
+            max_pending:
+                The maximum number of chunks that have been sent to the workers and whose results have not been
+                yielded yet. Defaults to twice the number of processes.
+
+        Raises:
+            ValueError:
+                If the chunk size or the maximum number of pending chunks is not positive.
+        """
+        if chunk_size < 1:
+            raise ValueError('The chunk size must be positive, got {}.'.format(chunk_size))
+        if max_pending is None:
+            max_pending = 2 * (processes or os.cpu_count() or 1)
+        elif max_pending < 1:
+            raise ValueError('The maximum number of pending chunks must be positive, got {}.'.format(max_pending))
+        self.max_pending = max_pending
+        if isinstance(matcher, ManyToOneReplacer):
+            self.replacer = matcher
+            self.matcher = matcher.matcher
+        else:
+            self.replacer = None
+            self.matcher = matcher
+        self.chunk_size = chunk_size
+        self.names = names or {}
+        file = io.BytesIO()
+        self.matcher.save(file, self.names)
+        context = context or multiprocessing.get_context()
+        self._pool = context.Pool(
+            processes, _init_worker, (file.getvalue(), self.names, self.replacer is not None)
+        )
+
+    def __enter__(self) -> 'ParallelMatcher':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
+
+    def close(self) -> None:
+        """Stop the worker processes after all pending work is done."""
+        self._pool.close()
+        self._pool.join()
+
+    def terminate(self) -> None:
+        """Stop the worker processes immediately."""
+        self._pool.terminate()
+        self._pool.join()
+
+    def match(self, subjects: Iterable[Expression], ordered: bool=True) -> Iterator[Tuple[int, Any, Substitution]]:
+        """Match the subjects against all the matcher's patterns.
+
+        Args:
+            subjects:
+                The subjects to match.
+            ordered:
+                If True, the matches are yielded in the order of the subjects. Otherwise, the matches of a chunk of
+                subjects are yielded as soon as the chunk has been processed.
+
+        Yields:
+            For every match, a tuple of the index of the subject, the matching pattern's label and the match
+            substitution.
+
+        Raises:
+            Exception:
+                Any exception raised in a worker process (e.g. by a constraint) is raised here.
+        """
+        labels = [label for _, label, _ in self.matcher.patterns]
+        tasks = ((start, _dumps(chunk, self.names)) for start, chunk in self._chunks(subjects))
+        for data in self._map(_match_chunk, tasks, ordered):
+            for subject_index, pattern_index, substitution in _loads(data, self.names):
+                yield subject_index, labels[pattern_index], substitution
+
+    def replace(self, subjects: Iterable[Expression], max_count: int=math.inf,
+                ordered: bool=True) -> Iterator[Tuple[int, Union[Expression, Sequence[Expression]]]]:
+        """Apply the replacer's rules to all the subjects (see :meth:`.ManyToOneReplacer.replace`).
+
+        Args:
+            subjects:
+                The subjects to which the rules are applied.
+            max_count:
+                The maximum number of rule applications per subject.
+            ordered:
+                If True, the results are yielded in the order of the subjects. Otherwise, the results of a chunk of
+                subjects are yielded as soon as the chunk has been processed.
+
+        Yields:
+            For every subject, a tuple of the index of the subject and the replacement result.
+
+        Raises:
+            TypeError:
+                If the parallel matcher was not created with a :class:`.ManyToOneReplacer`.
+            Exception:
+                Any exception raised in a worker process (e.g. by a replacement callback) is raised here.
+        """
+        if self.replacer is None:
+            raise TypeError('Replacing requires a ManyToOneReplacer.')
+        tasks = ((start, _dumps(chunk, self.names), max_count) for start, chunk in self._chunks(subjects))
+        for data in self._map(_replace_chunk, tasks, ordered):
+            yield from _loads(data, self.names)
+
+    def _chunks(self, subjects: Iterable[Expression]) -> Iterator[Tuple[int, List[Expression]]]:
+        iterator = iter(subjects)
+        start = 0
+        while True:
+            chunk = list(itertools.islice(iterator, self.chunk_size))
+            if not chunk:
+                return
+            yield start, chunk
+            start += len(chunk)
+
+    def _map(self, function, tasks, ordered: bool) -> Iterator[bytes]:
+        # Pool.imap would consume all the tasks right away, so only a window of them is submitted at a time
+        tasks = iter(tasks)
+        if ordered:
+            pending = deque()
+            for task in itertools.islice(tasks, self.max_pending):
+                pending.append(self._pool.apply_async(function, (task, )))
+            while pending:
+                result = pending.popleft().get()
+                for task in itertools.islice(tasks, 1):
+                    pending.append(self._pool.apply_async(function, (task, )))
+                yield result
+        else:
+            done = queue.Queue()
+            pending = 0
+            for task in itertools.islice(tasks, self.max_pending):
+                self._submit(function, task, done)
+                pending += 1
+            while pending:
+                success, result = done.get()
+                pending -= 1
+                if not success:
+                    raise result
+                for task in itertools.islice(tasks, 1):
+                    self._submit(function, task, done)
+                    pending += 1
+                yield result
+
+    def _submit(self, function, task, done: queue.Queue) -> None:
+        self._pool.apply_async(
+            function, (task, ),
+            callback=lambda result: done.put((True, result)),
+            error_callback=lambda error: done.put((False, error))
+        )
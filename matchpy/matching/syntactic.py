@@ -23,7 +23,7 @@ from ..expressions.expressions import (
     Expression, Operation, Symbol, SymbolWildcard, Wildcard, Pattern, AssociativeOperation, CommutativeOperation
 )
 from ..expressions.substitution import Substitution
-from ..expressions.functions import is_syntactic, op_iter, op_len
+from ..expressions.functions import is_syntactic, op_iter, op_len, _get_type_dispatch
 from ..utils import slot_cached_property
 
 __all__ = ['FlatTerm', 'is_operation', 'is_symbol_wildcard', 'DiscriminationNet', 'SequenceMatcher']
@@ -49,7 +49,10 @@ def is_symbol_wildcard(term: Any) -> bool:
 
 def _get_symbol_wildcard_label(state: '_State', symbol: Symbol) -> Type[Symbol]:
     """Return the transition target for the given symbol type from the the given state or None if it does not exist."""
-    return next((t for t in state.keys() if is_symbol_wildcard(t) and isinstance(symbol, t)), None)
+    for head in _get_type_dispatch(type(symbol)).heads:
+        if head in state and is_symbol_wildcard(head):
+            return head
+    return None
 
 
 TermAtom = Union[Symbol, Wildcard, Type[Operation], Type[Symbol], type(OPERATION_END)]
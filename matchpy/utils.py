@@ -1,24 +1,30 @@
 # -*- coding: utf-8 -*-
 """This module contains various utility functions."""
+import array
+import collections
 import inspect
 import itertools
+import json
 import math
 import ast
 import os
+import threading
 import tokenize
-import copy
 from types import LambdaType
 
 # pylint: disable=unused-import
-from typing import (Callable, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple, TypeVar, cast, Union, Any)
+from typing import (
+    Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, TextIO, Tuple, TypeVar, cast, Union, Any
+)
 # pylint: enable=unused-import
 
 from multiset import Multiset
 
 __all__ = [
     'fixed_integer_vector_iter', 'weak_composition_iter', 'commutative_sequence_variable_partition_iter',
-    'get_short_lambda_source', 'solve_linear_diop', 'generator_chain', 'cached_property', 'slot_cached_property',
-    'extended_euclid', 'base_solution_linear'
+    'commutative_sequence_variable_partition_count', 'get_short_lambda_source', 'solve_linear_diop', 'generator_chain',
+    'cached_property', 'slot_cached_property', 'extended_euclid', 'base_solution_linear', 'LinearDiopSolutionCache',
+    'linear_diop_solution_cache'
 ]
 
 T = TypeVar('T')
@@ -129,26 +135,237 @@ def optional_iter(remaining, count):
         yield remaining - sum(p), p
 
 
-_linear_diop_solution_cache = {}  # type: Dict[Tuple[int, ...], List[Tuple[int, ...]]]
+class OperandCounts:
+    """A multiset of operands stored as a vector of counts indexed by dense operand ids.
 
+    The operands get their ids in the order they first appear. All the count vectors derived from one another share
+    the operands and their ids, so removing operands and checking whether they are contained only touches the count
+    vector:
 
-def _make_variable_generator_factory(value, total, variables: List[VariableWithCount]):
-    var_counts = [v.count for v in variables]
-    cache_key = (total, *var_counts)
+    >>> counts = OperandCounts('abacb')
+    >>> counts.counts
+    [2, 2, 1]
+    >>> rest = counts.subtract('ab')
+    >>> rest.counts, len(rest)
+    ([1, 1, 1], 3)
+    >>> print(rest.subtract('aa'))
+    None
+    >>> rest.to_multiset() == Multiset('abc')
+    True
+    """
+    __slots__ = ('operands', 'ids', 'counts', 'total')
+
+    def __init__(self, operands: Iterable[T]=()) -> None:
+        self.operands = []  # type: List[T]
+        self.ids = {}  # type: Dict[T, int]
+        self.counts = []  # type: List[int]
+        self.total = 0
+        for operand in operands:
+            index = self.ids.get(operand)
+            if index is None:
+                self.ids[operand] = len(self.operands)
+                self.operands.append(operand)
+                self.counts.append(1)
+            else:
+                self.counts[index] += 1
+            self.total += 1
+
+    def _derive(self, counts: List[int], total: int) -> 'OperandCounts':
+        derived = OperandCounts.__new__(OperandCounts)
+        derived.operands = self.operands
+        derived.ids = self.ids
+        derived.counts = counts
+        derived.total = total
+        return derived
+
+    def __len__(self) -> int:
+        return self.total
+
+    def items(self) -> Iterator[Tuple[int, T, int]]:
+        """Yield a tuple of the id, the operand and its count for every contained operand."""
+        operands = self.operands
+        for index, count in enumerate(self.counts):
+            if count > 0:
+                yield index, operands[index], count
+
+    def subtract(self, operands: Iterable[T], count: int=1) -> Optional['OperandCounts']:
+        """Return the count vector with *count* times the given operands removed.
+
+        Returns None if the operands are not all contained often enough.
+        """
+        counts = self.counts[:]
+        ids = self.ids
+        removed = 0
+        for operand in operands:
+            index = ids.get(operand)
+            if index is None or counts[index] < count:
+                return None
+            counts[index] -= count
+            removed += count
+        return self._derive(counts, self.total - removed)
+
+    def subtract_id(self, index: int, count: int=1) -> 'OperandCounts':
+        """Return the count vector with *count* times the operand with the given id removed."""
+        counts = self.counts[:]
+        counts[index] -= count
+        return self._derive(counts, self.total - count)
+
+    def subtract_vector(self, vector: Sequence[int]) -> 'OperandCounts':
+        """Return the count vector with the given vector of counts subtracted componentwise."""
+        return self._derive([c - v for c, v in zip(self.counts, vector)], self.total - sum(vector))
+
+    def to_multiset(self) -> Multiset:
+        """Return the contained operands as a :class:`Multiset`."""
+        return Multiset(dict((operand, count) for _, operand, count in self.items()))
+
+
+DiopCacheInfo = NamedTuple(
+    'DiopCacheInfo', [('hits', int), ('misses', int), ('evictions', int), ('maxsize', Optional[int]), ('currsize', int)]
+)
 
-    def _factory(subst):
-        if cache_key in _linear_diop_solution_cache:
-            solutions = _linear_diop_solution_cache[cache_key]
-        else:
-            solutions = list(solve_linear_diop(total, *var_counts))
-            _linear_diop_solution_cache[cache_key] = solutions
-        for solution in solutions:
-            new_subst = copy.copy(subst)
-            for var, count in zip(variables, solution):
-                new_subst[var.name][value] = count
-            yield new_subst
 
-    return _factory
+class LinearDiopSolutionCache:
+    """A thread-safe LRU cache for the solutions of linear Diophantine equations (see :func:`solve_linear_diop`).
+
+    The solutions are computed on the first request and then cached. Once the cache holds *maxsize* solution tables,
+    the least recently used one is evicted:
+
+    >>> cache = LinearDiopSolutionCache(maxsize=2)
+    >>> list(cache.solutions(3, 1, 2))
+    [(3, 0), (1, 1)]
+    >>> list(cache.solutions(3, 1, 2))
+    [(3, 0), (1, 1)]
+    >>> solutions = list(cache.solutions(4, 2, 1)), list(cache.solutions(5, 1, 1))
+    >>> cache.cache_info()
+    DiopCacheInfo(hits=1, misses=3, evictions=1, maxsize=2, currsize=2)
+
+    The solution tables are stored compactly as flat :class:`array.array` of integers. :meth:`table` returns the stored
+    table itself, so it can be walked without unpacking the solutions:
+
+    >>> count, values = cache.table(3, 1, 2)
+    >>> count, values
+    (2, array('q', [3, 0, 1, 1]))
+
+    The cached tables can be saved with :meth:`save` and loaded into another cache with :meth:`load` to warm it up.
+
+    The cache used by the partitioning functions of this module is :data:`linear_diop_solution_cache`.
+    """
+
+    def __init__(self, maxsize: Optional[int]=1024) -> None:
+        """
+        Args:
+            maxsize:
+                The maximum number of cached solution tables or None for an unbounded cache.
+        """
+        if maxsize is not None and maxsize < 0:
+            raise ValueError('The maximum size must not be negative, got {}.'.format(maxsize))
+        self._maxsize = maxsize
+        self._tables = collections.OrderedDict()  # type: Dict[Tuple[int, ...], Tuple[int, array.array]]
+        self._lock = threading.RLock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @property
+    def maxsize(self) -> Optional[int]:
+        """The maximum number of cached solution tables or None if the cache is unbounded.
+
+        Decreasing the maximum size evicts the least recently used solution tables.
+        """
+        return self._maxsize
+
+    @maxsize.setter
+    def maxsize(self, maxsize: Optional[int]) -> None:
+        if maxsize is not None and maxsize < 0:
+            raise ValueError('The maximum size must not be negative, got {}.'.format(maxsize))
+        with self._lock:
+            self._maxsize = maxsize
+            self._evict()
+
+    def solutions(self, total: int, *coeffs: int) -> Iterator[Tuple[int, ...]]:
+        """Yield the solutions of the linear Diophantine equation in the same order as :func:`solve_linear_diop`."""
+        count, values = self.table(total, *coeffs)
+        width = len(coeffs)
+        for start in range(0, count * width, width) if width else range(count):
+            yield tuple(values[start:start + width])
+
+    def table(self, total: int, *coeffs: int) -> Tuple[int, array.array]:
+        """Return the cached solution table of the linear Diophantine equation.
+
+        The table is not copied, so it must not be modified.
+
+        Returns:
+            The number of solutions and a flat array with the values of all the solutions one after another, i.e. the
+            solution ``i`` is at ``values[i * len(coeffs):(i + 1) * len(coeffs)]``.
+        """
+        key = (total, *coeffs)
+        with self._lock:
+            table = self._tables.get(key, None)
+            if table is not None:
+                self._tables.move_to_end(key)
+                self._hits += 1
+            else:
+                self._misses += 1
+        if table is None:
+            values = array.array('q')
+            count = 0
+            for solution in solve_linear_diop(total, *coeffs):
+                values.extend(solution)
+                count += 1
+            table = (count, values)
+            self._insert(key, table)
+        return table
+
+    def cache_info(self) -> DiopCacheInfo:
+        """Return the statistics of the cache like :func:`functools.lru_cache`."""
+        with self._lock:
+            return DiopCacheInfo(self._hits, self._misses, self._evictions, self._maxsize, len(self._tables))
+
+    def cache_clear(self) -> None:
+        """Remove all the solution tables from the cache and reset its statistics."""
+        with self._lock:
+            self._tables.clear()
+            self._hits = self._misses = self._evictions = 0
+
+    def save(self, file: TextIO) -> None:
+        """Save the cached solution tables as JSON to the given text file.
+
+        The tables are saved from the least to the most recently used one, so loading them retains the order.
+        """
+        with self._lock:
+            tables = [[list(key), count, list(values)] for key, (count, values) in self._tables.items()]
+        json.dump({'version': 1, 'tables': tables}, file)
+
+    def load(self, file: TextIO) -> None:
+        """Warm up the cache with the solution tables saved with :meth:`save`.
+
+        The loaded tables count as the most recently used ones. If there are more than *maxsize*, only the last ones
+        are kept. Loading does not change the statistics except for evictions.
+
+        Raises:
+            ValueError:
+                If the file does not contain solution tables saved with :meth:`save`.
+        """
+        data = json.load(file)
+        if not isinstance(data, dict) or data.get('version', None) != 1:
+            raise ValueError('The file does not contain a saved solution table.')
+        for key, count, values in data['tables']:
+            self._insert(tuple(key), (count, array.array('q', values)))
+
+    def _insert(self, key: Tuple[int, ...], table: Tuple[int, array.array]) -> None:
+        with self._lock:
+            self._tables[key] = table
+            self._tables.move_to_end(key)
+            self._evict()
+
+    def _evict(self) -> None:
+        if self._maxsize is not None:
+            while len(self._tables) > self._maxsize:
+                self._tables.popitem(last=False)
+                self._evictions += 1
+
+
+linear_diop_solution_cache = LinearDiopSolutionCache()
 
 
 def _commutative_single_variable_partiton_iter(values: 'Multiset[T]',
@@ -179,6 +396,9 @@ def commutative_sequence_variable_partition_iter(values: 'Multiset[T]', variable
         The results are not yielded in any particular order because the algorithm uses dictionaries. Dictionaries until
         Python 3.6 do not keep track of the insertion order.
 
+        The multisets in the yielded substitutions are reused for the next substitution, so they have to be copied in
+        order to keep them.
+
     Example:
 
         For a subject like ``fc(a, a, a, b, b, c)`` and a pattern like ``f(x__, y___, y___)`` one can define the
@@ -213,23 +433,136 @@ def commutative_sequence_variable_partition_iter(values: 'Multiset[T]', variable
         yield from _commutative_single_variable_partiton_iter(values, variables[0])
         return
 
-    generators = []
-    for value, count in values.items():
-        generators.append(_make_variable_generator_factory(value, count, variables))
-
-    initial = dict((var.name, Multiset()) for var in variables)  # type: Dict[str, 'Multiset[T]']
-    for subst in generator_chain(initial, *generators):
-        valid = True
-        for var in variables:
-            if var.default is not None and len(subst[var.name]) == 0:
-                subst[var.name] = var.default
-            elif len(subst[var.name]) < var.minimum:
-                valid = False
-                break
-        if valid:
-            if None in subst:
-                del subst[None]
-            yield subst
+    # The partition is built by choosing a solution from the solution table of every distinct value in turn, only
+    # keeping the offset of the chosen solution in the flat table and the number of values every variable has received
+    # for every value. Only the counts of the chosen value are updated in the multisets of the variables, so that they
+    # are never copied. A branch is abandoned as soon as a variable cannot receive its minimum number of values anymore.
+    items = list(values.items())
+    var_counts = [v.count for v in variables]
+    width = len(variables)
+    columns = range(width)
+    tables = [linear_diop_solution_cache.table(total, *var_counts)[1] for _, total in items]
+    if not all(tables):
+        return
+    # For every position, the variables that might not receive their minimum number of values anymore, together with
+    # the number of values they must have received before that position. The last entry checks the final partition.
+    remaining = [0] * width
+    checks = [[(j, v.minimum, v.default is not None) for j, v in enumerate(variables) if v.minimum > 0]]
+    for table in reversed(tables):
+        remaining = [r + max(itertools.islice(table, j, None, width)) for j, r in enumerate(remaining)]
+        checks.append([(j, v.minimum - r, v.default is not None)
+                       for j, (v, r) in enumerate(zip(variables, remaining)) if r < v.minimum])
+    checks.reverse()
+    # In addition, the values still needed by all the variables together must not exceed the remaining values. This
+    # can only fail at the positions where the remaining values are fewer than all the minimums together.
+    bounded = [(j, v.count, v.minimum, v.default is not None) for j, v in enumerate(variables) if v.minimum > 0]
+    needed_total = sum(count * minimum for _, count, minimum, _ in bounded)
+    remaining_totals = list(itertools.accumulate(total for _, total in reversed(items)))[::-1] + [0]
+    joint_checks = [remaining_total < needed_total for remaining_total in remaining_totals]
+
+    multisets = [Multiset() for _ in variables]
+    named = [(v.name, m) for v, m in zip(variables, multisets) if v.name is not None]
+    named_columns = [(j, m) for j, (v, m) in enumerate(zip(variables, multisets)) if v.name is not None]
+    defaults = [(j, v.name, v.default) for j, v in enumerate(variables) if v.default is not None and v.name is not None]
+    if not items:
+        # Without any values, only variables with a default can have a minimum
+        if all(empty for _, _, empty in checks[0]):
+            partition = dict(named)
+            partition.update((name, default) for _, name, default in defaults)
+            yield partition
+        return
+    # The solutions for the last value are tried in a plain loop, since most of the work happens there
+    last = len(items) - 1
+    last_value = items[last][0]
+    final_checks = checks[-1]
+    last_table = tables[last]
+    lengths = [0] * width
+    pointers = [0] * len(items)
+    position = 0
+    while position >= 0:
+        if position == last:
+            for start in range(0, len(last_table), width):
+                if final_checks and not all(lengths[j] + last_table[start + j] >= needed or
+                                            (empty and lengths[j] + last_table[start + j] == 0)
+                                            for j, needed, empty in final_checks):
+                    continue
+                for j, multiset in named_columns:
+                    multiset[last_value] = last_table[start + j]
+                partition = dict(named)
+                for j, name, default in defaults:
+                    if lengths[j] + last_table[start + j] == 0:
+                        partition[name] = default
+                yield partition
+            position -= 1
+        elif pointers[position] < len(tables[position]):
+            table = tables[position]
+            start = pointers[position]
+            for j in columns:
+                lengths[j] += table[start + j]
+            position_checks = checks[position + 1]
+            if (not position_checks or all(lengths[j] >= needed or (empty and lengths[j] == 0)
+                                           for j, needed, empty in position_checks)) and \
+                    (not joint_checks[position + 1] or remaining_totals[position + 1] >= sum(
+                        count * (minimum - lengths[j]) for j, count, minimum, empty in bounded
+                        if lengths[j] < minimum and not (empty and lengths[j] == 0))):
+                value = items[position][0]
+                for j, multiset in named_columns:
+                    multiset[value] = table[start + j]
+                position += 1
+                continue
+        else:
+            pointers[position] = 0
+            position -= 1
+        if position >= 0:
+            table = tables[position]
+            start = pointers[position]
+            for j in columns:
+                lengths[j] -= table[start + j]
+            pointers[position] = start + width
+
+
+def commutative_sequence_variable_partition_count(values: 'Multiset[T]', variables: List[VariableWithCount]) -> int:
+    """Count the substitutions yielded by :func:`commutative_sequence_variable_partition_iter`.
+
+    Instead of enumerating the partitions, the number of solutions for every distinct value is combined using dynamic
+    programming over the number of values every variable has received so far (capped at the variable's minimum).
+
+    Example:
+
+        For the same example as for :func:`commutative_sequence_variable_partition_iter`:
+
+        >>> x = VariableWithCount(name='x', count=1, minimum=1, default=None)
+        >>> y = VariableWithCount(name='y', count=2, minimum=0, default=None)
+        >>> commutative_sequence_variable_partition_count(Multiset('aaabbc'), [x, y])
+        4
+
+    Args:
+        values:
+            The multiset of values which are partitioned and distributed among the variables.
+        variables:
+            A list of the variables to distribute the values among.
+
+    Returns:
+        The number of possible substitutions that are valid partitionings of the values among the variables.
+    """
+    var_counts = [v.count for v in variables]
+    caps = [v.minimum for v in variables]
+    width = len(variables)
+    states = {(0, ) * width: 1}  # type: Dict[Tuple[int, ...], int]
+    for _, total in values.items():
+        solution_count, solutions = linear_diop_solution_cache.table(total, *var_counts)
+        new_states = {}  # type: Dict[Tuple[int, ...], int]
+        for lengths, count in states.items():
+            for start in range(0, solution_count * width, width) if width else range(solution_count):
+                new_lengths = tuple(min(l + solutions[start + j], cap) for j, (l, cap) in enumerate(zip(lengths, caps)))
+                new_states[new_lengths] = new_states.get(new_lengths, 0) + count
+        if not new_states:
+            return 0
+        states = new_states
+    return sum(
+        count for lengths, count in states.items()
+        if all((v.default is not None and l == 0) or l >= v.minimum for v, l in zip(variables, lengths))
+    )
 
 class LambdaNodeVisitor(ast.NodeVisitor):
     def __init__(self, lines):
@@ -1,12 +1,15 @@
 # -*- coding: utf-8 -*-
+import collections
 import itertools
 import math
 
 import hypothesis.strategies as st
-from hypothesis import given
+from hypothesis import assume, given
 import pytest
 
-from matchpy.matching.bipartite import BipartiteGraph, _DirectedMatchGraph, enum_maximum_matchings_iter
+from matchpy.matching.bipartite import (
+    BipartiteGraph, _DirectedMatchGraph, enum_block_matchings_iter, enum_maximum_matchings_iter
+)
 
 
 @st.composite
@@ -39,6 +42,127 @@ def test_enum_maximum_matchings_iter_correctness(graph):
         matchings.add(frozen_matching)
 
 
+def _maximum_matching_size(graph):
+    edges = list(graph.edges())
+    for size in range(len(edges), 0, -1):
+        for subset in itertools.combinations(edges, size):
+            lefts, rights = zip(*subset)
+            if len(set(lefts)) == size and len(set(rights)) == size:
+                return size
+    return 0
+
+
+def _assert_is_maximum_matching(graph, matching):
+    for edge in matching.items():
+        assert edge in graph, "Matching contains an edge that was not in the graph"
+    assert len(set(matching.values())) == len(matching), "Matching contains a node twice"
+    assert len(matching) == _maximum_matching_size(graph), "Matching is not maximum"
+
+
+@given(bipartite_graph())
+def test_find_matching(graph):
+    _assert_is_maximum_matching(graph, graph.find_matching())
+
+
+@given(bipartite_graph(), st.lists(st.tuples(st.integers(0, 5), st.integers(0, 4))))
+def test_find_matching_warm_start(graph, initial_edges):
+    initial = dict(initial_edges)
+    _assert_is_maximum_matching(graph, graph.find_matching(initial))
+
+
+def _maximum_matchings(graph):
+    size = _maximum_matching_size(graph)
+    matchings = set()
+    for subset in itertools.combinations(graph.edges(), size):
+        lefts, rights = zip(*subset) if subset else ((), ())
+        if len(set(lefts)) == size and len(set(rights)) == size:
+            matchings.add(frozenset(subset))
+    return matchings
+
+
+@given(bipartite_graph())
+def test_enum_maximum_matchings_iter_completeness(graph):
+    matchings = [frozenset(matching.items()) for matching in enum_maximum_matchings_iter(graph)]
+    expected = _maximum_matchings(graph) if len(graph) > 0 else set()
+    assert len(matchings) == len(set(matchings))
+    assert set(matchings) == expected
+
+
+def test_enum_maximum_matchings_iter_long_cycle():
+    # A single alternating cycle through all the nodes, which is too long for a recursive search
+    n = 3000
+    graph = BipartiteGraph()
+    for i in range(n):
+        graph[i, i] = True
+        graph[i, (i + 1) % n] = True
+    matchings = list(enum_maximum_matchings_iter(graph))
+    assert len(matchings) == 2
+    assert {frozenset(matching.items()) for matching in matchings} == {
+        frozenset((i, i) for i in range(n)),
+        frozenset((i, (i + 1) % n) for i in range(n)),
+    }
+
+
+def _block_matchings(graph, left_counts, right_counts, interchangeable):
+    """Enumerate the block matchings by trying every assignment of the right copies to the left copies."""
+    left_copies = [left for left, count in left_counts.items() for _ in range(count)]
+    right_copies = [right for right, count in right_counts.items() for _ in range(count)]
+    matchings = set()
+    for lefts in itertools.permutations(range(len(left_copies)), len(right_copies)):
+        edges = [(left_copies[i], right) for i, right in zip(lefts, right_copies)]
+        if all(edge in graph for edge in edges):
+            counts = collections.Counter(edge for edge in edges if edge[1] not in interchangeable)
+            group_counts = collections.Counter(left for left, right in edges if right in interchangeable)
+            matchings.add((frozenset(counts.items()), frozenset(group_counts.items())))
+    return matchings
+
+
+@given(
+    bipartite_graph(),
+    st.lists(st.integers(0, 2), min_size=5, max_size=5),
+    st.lists(st.integers(0, 2), min_size=4, max_size=4),
+    st.sets(st.integers(0, 3)),
+)
+def test_enum_block_matchings_iter(graph, left_counts, right_counts, interchangeable):
+    left_counts = dict(enumerate(left_counts))
+    right_counts = dict(enumerate(right_counts))
+    assume(sum(left_counts.values()) <= 6)
+    matchings = [
+        (frozenset(counts.items()), frozenset(group_counts.items()))
+        for counts, group_counts in enum_block_matchings_iter(graph, left_counts, right_counts, interchangeable)
+    ]
+    assert len(matchings) == len(set(matchings)), "Matching was duplicate"
+    assert set(matchings) == _block_matchings(graph, left_counts, right_counts, interchangeable)
+
+
+def test_enum_block_matchings_iter_identical_copies():
+    graph = BipartiteGraph({(0, 0): True, (0, 1): True})
+    matchings = list(enum_block_matchings_iter(graph, {0: 100}, {0: 40, 1: 60}))
+    assert matchings == [({(0, 0): 40, (0, 1): 60}, {})]
+    matchings = list(enum_block_matchings_iter(graph, {0: 100}, {0: 40, 1: 60}, {0, 1}))
+    assert matchings == [({}, {0: 100})]
+
+
+def test_enum_block_matchings_iter_steps():
+    step = object()
+    graph = BipartiteGraph({(0, 0): True, (0, 1): True, (1, 1): True, (1, 2): True, (2, 2): True})
+    counts = {0: 2, 1: 2, 2: 1}, {0: 1, 1: 2, 2: 2}
+    results = list(enum_block_matchings_iter(graph, *counts, step=step))
+    assert [r for r in results if r is not step] == list(enum_block_matchings_iter(graph, *counts))
+    assert results.count(step) > 0
+
+
+def test_find_matching_after_change():
+    graph = BipartiteGraph({(0, 0): True, (1, 0): True})
+    assert len(graph.find_matching()) == 1
+    graph[1, 1] = True
+    assert graph.find_matching() == {0: 0, 1: 1}
+    del graph[0, 0]
+    assert len(graph.find_matching()) == 1
+    graph.clear()
+    assert graph.find_matching() == {}
+
+
 @pytest.mark.parametrize('n, m', filter(lambda x: x[0] >= x[1], itertools.product(range(1, 6), range(0, 4))))
 def test_completeness(n, m):
     graph = BipartiteGraph(map(lambda x: (x, True), itertools.product(range(n), range(m))))
@@ -137,6 +261,61 @@ class TestBipartiteGraphTest:
         assert graph.limited_to({1}, {0, 1}) == {(1, 0): True, (1, 1): True}
         assert graph.limited_to({0, 1}, {0, 1}) == graph
 
+    def test_without_nodes(self):
+        graph = BipartiteGraph({(0, 0): True, (1, 0): True, (1, 1): True, (0, 1): True})
+
+        assert graph.without_nodes((0, 0)) == {(1, 1): True}
+        assert graph.without_nodes((0, 1)) == {(1, 0): True}
+        assert graph.without_nodes((0, 0)).without_nodes((1, 1)) == {}
+        assert graph.without_nodes((2, 2)) == graph
+
+    def test_without_edge(self):
+        graph = BipartiteGraph({(0, 0): True, (1, 0): True, (1, 1): True, (0, 1): True})
+
+        assert graph.without_edge((0, 0)) == {(1, 0): True, (1, 1): True, (0, 1): True}
+        assert graph.without_edge((0, 0)).without_edge((1, 1)) == {(1, 0): True, (0, 1): True}
+        assert graph.without_edge((0, 0)).limited_to({0}, {0, 1}) == {(0, 1): True}
+        assert graph.without_edge((2, 2)) == graph
+
+    def test_view(self):
+        graph = BipartiteGraph({(0, 0): 1, (1, 0): 2, (1, 1): 3})
+        view = graph.limited_to({1}, {0, 1})
+
+        assert len(view) == 2
+        assert view[1, 1] == 3
+        with pytest.raises(KeyError):
+            _ = view[0, 0]
+        assert view.find_matching() in ({1: 0}, {1: 1})
+
+        graph[1, 2] = 4
+        del graph[1, 1]
+        graph[0, 1] = 5
+
+        assert view == {(1, 0): 2}
+        assert len(graph) == 4
+
+    def test_delitem_and_readd(self):
+        graph = BipartiteGraph({(0, 0): True, (0, 1): True})
+
+        del graph[0, 0]
+        del graph[0, 1]
+        assert len(graph) == 0
+        assert graph == {}
+        assert graph.find_matching() == {}
+
+        graph[0, 1] = True
+        assert graph == {(0, 1): True}
+        assert graph.find_matching() == {0: 1}
+
+    def test_copy(self):
+        graph = BipartiteGraph({(0, 0): True})
+        graph_copy = graph.__copy__()
+        graph_copy[0, 1] = True
+        del graph_copy[0, 0]
+
+        assert graph == {(0, 0): True}
+        assert graph_copy == {(0, 1): True}
+
     def test_eq(self):
         assert BipartiteGraph() == {}
         assert {} == BipartiteGraph()
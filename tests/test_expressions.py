@@ -6,6 +6,7 @@ import pytest
 from multiset import Multiset
 
 from matchpy.expressions.expressions import (Arity, Operation, Symbol, SymbolWildcard, Wildcard, Expression)
+from matchpy.expressions.functions import op_iter, op_len, register_operation_iterator, signature_may_match
 from .common import *
 
 SIMPLE_EXPRESSIONS = [
@@ -132,6 +133,27 @@ class TestExpression:
     def test_symbols(self, expression, symbols):
         assert expression.symbols == Multiset(symbols)
 
+    @pytest.mark.parametrize(
+        '   expression,             symbols,            size,   depth',
+        [
+            (a,                     ['a'],              1,      1),
+            (x_,                    [],                 1,      1),
+            (___,                   [],                 0,      0),
+            (x__,                   [],                 1,      1),
+            (f(a, b),               ['a', 'b', 'f'],    3,      2),
+            (f(x_, f(y___)),        ['f'],              3,      2),
+            (f(f(a), f(b, c)),      ['a', 'b', 'c', 'f'], 6,    3),
+            (f_i(a, b),             ['a', 'b', 'f_i'],  3,      2),
+            (f_i(a, x___),          ['a'],              1,      1),
+            (f(Wildcard.optional('x', a)), ['f'],       1,      1),
+        ]
+    )  # yapf: disable
+    def test_signature(self, expression, symbols, size, depth):
+        mask = 0
+        for symbol in symbols:
+            mask |= Symbol(symbol).signature[0]
+        assert expression.signature == (mask, size, depth)
+
     @pytest.mark.parametrize(
         '   expression,                 variables',
         [
@@ -349,3 +371,25 @@ class TestOperation:
     def test_infix_error(self):
         with pytest.raises(TypeError):
             Operation.new('Invalid', Arity.unary, infix=True)
+
+
+def test_register_operation_iterator_after_dispatch():
+    class CustomOperation(Operation):
+        name = 'custom'
+        arity = Arity.variadic
+
+    expression = CustomOperation(a, b, c)
+    assert list(op_iter(expression)) == [a, b, c]
+    assert op_len(expression) == 3
+
+    register_operation_iterator(CustomOperation, lambda o: reversed(o.operands), lambda o: 42)
+
+    assert list(op_iter(expression)) == [c, b, a]
+    assert op_len(expression) == 42
+
+
+def test_signature_may_match_is_consistent_with_match():
+    from .test_matching import PARAM_MATCHES
+    for (subject, pattern), matches in PARAM_MATCHES.items():
+        if matches:
+            assert signature_may_match(subject, pattern)
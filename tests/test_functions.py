@@ -9,6 +9,7 @@ from matchpy.matching.one_to_one import match_anywhere
 from matchpy.matching.one_to_one import match as match_one_to_one
 from matchpy.matching.many_to_one import ManyToOneReplacer
 from .common import *
+from .test_matching import PARAM_MATCHES
 
 
 @pytest.mark.parametrize(
@@ -23,6 +24,11 @@ def test_is_match(expr, pattern, do_match):
     assert is_match(expr, Pattern(pattern)) == do_match
 
 
+@pytest.mark.parametrize('subject, pattern', PARAM_MATCHES.keys())
+def test_is_match_consistent_with_match(subject, pattern):
+    assert is_match(subject, Pattern(pattern)) == bool(PARAM_MATCHES[subject, pattern])
+
+
 class TestSubstitute:
     @pytest.mark.parametrize(
         '   expression,                         substitution,           expected_result,    replaced',
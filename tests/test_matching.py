@@ -536,6 +536,10 @@ class TestMatch:
             (f_c(a, b, a, b),        f_c(_, a, y_, y_),               [{'y': b}]),
             (f_c(a, b, a, b),        f_c(_, b, y_, y_),               [{'y': a}]),
             (f_c(a, b, b, b),        f_c(_, b, y_, y_),               [{'y': b}]),
+            (f_c(f(a), f(b)),        f_c(_, f(a)),                    [{}]),
+            (f_c(f(a), f(b), f(b)),  f_c(_, f(a), x_),                [{'x': f(b)}]),
+            (f_c(a, a, a, b),        f_c(_, _, _, x_),                [{'x': a},
+                                                                       {'x': b}]),
           # (f_c(a, b, a, a),        f_c(x2_, _, _),                  [{'x': Multiset([a, b])},
           #                                                            {'x': Multiset([a, a])}]),
           # (f_c(a, b, b, a),        f_c(x2_, _, _),                  [{'x': Multiset([a, b])},
@@ -1,9 +1,26 @@
 # -*- coding: utf-8 -*-
+import asyncio
+import concurrent.futures
+import io
+import itertools
+import json
+import os
+import subprocess
+import sys
+
 import pytest
+from multiset import Multiset
 
 from matchpy.expressions.constraints import CustomConstraint
 from matchpy.expressions.expressions import Symbol, Pattern, Operation, Arity, Wildcard
-from matchpy.matching.many_to_one import ManyToOneMatcher
+from matchpy.expressions.substitution import Substitution
+from matchpy.functions import ReplacementRule
+from matchpy.expressions.functions import preorder_iter_with_position
+from matchpy.matching.one_to_one import match
+from matchpy.matching import many_to_one
+from matchpy.matching.many_to_one import (
+    CommutativeMatcher, ManyToOneMatcher, ManyToOneReplacer, MatchBudgetExceeded, _Budget, _MatchIter
+)
 from .common import *
 from .utils import MockConstraint
 
@@ -199,6 +216,17 @@ def test_different_pattern_different_label():
     assert result == [(23, [('x', a)]), (42, [])]
 
 
+def test_many_patterns_with_shared_prefix():
+    symbols = [Symbol('s{}'.format(i)) for i in range(200)]
+    patterns = [Pattern(f(a, x_, s), CustomConstraint(lambda x: x != b)) for s in symbols]
+    matcher = ManyToOneMatcher(*patterns)
+
+    result = list(matcher.match(f(a, c, symbols[150])))
+    assert result == [(patterns[150], {'x': c})]
+
+    assert list(matcher.match(f(a, b, symbols[150]))) == []
+
+
 def test_one_identity_optional_commutativity():
     Int = Operation.new('Int', Arity.binary)
     Add = Operation.new('+', Arity.variadic, 'Add', infix=True, associative=True, commutative=True, one_identity=True)
@@ -259,4 +287,767 @@ def test_many_to_one(subject, patterns):
 
     assert matches == [], "Subject {!s} and pattern {!s} yielded unexpected matches".format(
         subject, pattern
-    )
\ No newline at end of file
+    )
+
+
+@pytest.mark.parametrize('subject, patterns', PARAM_PATTERNS.items())
+def test_minimize(subject, patterns):
+    patterns = [Pattern(p) for p in patterns]
+    matcher = ManyToOneMatcher(*patterns)
+    expected = sorted(str(m) for m in matcher.match(subject))
+
+    (states_before, transitions_before), (states_after, transitions_after) = matcher.minimize()
+
+    assert states_after <= states_before
+    assert transitions_after <= transitions_before
+    assert len(matcher.states) <= states_after
+    assert sorted(str(m) for m in matcher.match(subject)) == expected
+
+
+def test_minimize_merges_common_suffixes():
+    c1 = CustomConstraint(lambda x: x != a)
+    c2 = CustomConstraint(lambda x: x != b)
+    pattern1 = Pattern(f(a, x_, b), c1)
+    pattern2 = Pattern(f(b, x_, b), c2)
+    matcher = ManyToOneMatcher(pattern1, pattern2)
+
+    (states_before, _), (states_after, _) = matcher.minimize()
+
+    assert states_after < states_before
+    assert list(matcher.match(f(a, c, b))) == [(pattern1, {'x': c})]
+    assert list(matcher.match(f(a, a, b))) == []
+    assert list(matcher.match(f(b, a, b))) == [(pattern2, {'x': a})]
+    assert list(matcher.match(f(b, b, b))) == []
+
+    pattern3 = Pattern(f(c, x_, b))
+    matcher.add(pattern3)
+    assert list(matcher.match(f(c, b, b))) == [(pattern3, {'x': b})]
+    assert list(matcher.match(f(a, b, b))) == [(pattern1, {'x': b})]
+
+
+SAVE_NAMES = {o.name: o for o in (f, f2, f_u, f_i, f_c, f_ci, f2_c, f_a, f_ac)}
+
+
+@pytest.mark.parametrize('subject, patterns', PARAM_PATTERNS.items())
+def test_save_load(subject, patterns):
+    patterns = [Pattern(p) for p in patterns]
+    matcher = ManyToOneMatcher(*patterns)
+    file = io.BytesIO()
+    matcher.save(file, names=SAVE_NAMES)
+    file.seek(0)
+
+    loaded = ManyToOneMatcher.load(
+        file, names=SAVE_NAMES, fingerprint=ManyToOneMatcher.patterns_fingerprint(*patterns, names=SAVE_NAMES)
+    )
+
+    assert sorted(str(m) for m in loaded.match(subject)) == sorted(str(m) for m in matcher.match(subject))
+
+
+def test_save_load_rebinds_named_objects():
+    def not_a(x):
+        return x != a
+    constraint = CustomConstraint(not_a)
+    pattern = Pattern(f(x_, b), constraint)
+    label = lambda x: x
+    matcher = ManyToOneMatcher()
+    matcher.add(pattern, label)
+    names = dict(SAVE_NAMES, not_a=not_a, label=label)
+    file = io.BytesIO()
+    matcher.save(file, names=names)
+
+    file.seek(0)
+    with pytest.raises(ValueError):
+        ManyToOneMatcher.load(file, names=SAVE_NAMES)
+
+    file.seek(0)
+    with pytest.raises(ValueError):
+        ManyToOneMatcher.load(file, names=names, fingerprint=ManyToOneMatcher.patterns_fingerprint(Pattern(f(b))))
+
+    file.seek(0)
+    loaded = ManyToOneMatcher.load(file, names=names, fingerprint=matcher.fingerprint(names))
+    assert [l for l, _ in loaded.match(f(c, b))] == [label]
+    assert list(loaded.match(f(a, b))) == []
+
+    loaded.add(Pattern(f(a, x_)))
+    assert len(list(loaded.match(f(a, b)))) == 1
+
+
+def test_load_invalid_file():
+    with pytest.raises(ValueError):
+        ManyToOneMatcher.load(io.BytesIO(b'not a matcher'))
+
+
+# The pickled layout of the matchers for the current save format version. If the layout changes, the format version
+# has to be increased, so that files saved with the old layout are not loaded anymore, and this has to be updated.
+SAVED_LAYOUT = (7, {
+    'ManyToOneMatcher': (
+        'patterns', 'states', 'root', 'pattern_vars', 'constraints', 'constraint_vars', 'finals', 'rename',
+        'priorities', 'pattern_ranks', 'needed_variables', 'profile', 'signatures', 'pattern_lookup', 'free_indices',
+        'serials', 'next_serial'
+    ),
+    'CommutativeMatcher': (
+        'patterns', 'subjects', 'subjects_by_id', 'automaton', 'bipartite', 'associative', 'max_optional_count',
+        'anonymous_patterns', 'subpattern_index', 'pattern_keys', 'free_ids', 'subpattern_uses'
+    ),
+    'BipartiteGraph': (
+        '_left_ids', '_right_ids', '_left_nodes', '_right_nodes', '_adjacency', '_degrees', '_size', '_arrays'
+    ),
+    '_State': ('number', 'transitions', 'matcher'),
+    '_Transition': ('label', 'target', 'variable_name', 'patterns', 'check_constraints', 'subst'),
+})  # yapf: disable
+
+
+def test_save_format_version_covers_layout():
+    layout = {
+        'ManyToOneMatcher': ManyToOneMatcher.__slots__,
+        'CommutativeMatcher': CommutativeMatcher.__slots__,
+        'BipartiteGraph': many_to_one.BipartiteGraph.__slots__,
+        '_State': many_to_one._State._fields,
+        '_Transition': many_to_one._Transition._fields,
+    }
+    assert (many_to_one._FORMAT_VERSION, layout) == SAVED_LAYOUT, \
+        'The pickled layout changed, increase _FORMAT_VERSION and update SAVED_LAYOUT'
+
+
+def test_load_older_format_version(monkeypatch):
+    file = io.BytesIO()
+    with monkeypatch.context() as m:
+        m.setattr(many_to_one, '_FORMAT_VERSION', many_to_one._FORMAT_VERSION - 1)
+        ManyToOneMatcher(Pattern(f(a, x_))).save(file, names=SAVE_NAMES)
+    file.seek(0)
+
+    with pytest.raises(ValueError):
+        ManyToOneMatcher.load(file, names=SAVE_NAMES)
+
+
+def test_replacer_save_load():
+    a_to_b = lambda: b
+    b_to_c = lambda: c
+    replacer = ManyToOneReplacer(ReplacementRule(Pattern(f(a)), a_to_b), ReplacementRule(Pattern(f(b)), b_to_c))
+    names = dict(SAVE_NAMES, a_to_b=a_to_b, b_to_c=b_to_c)
+    file = io.BytesIO()
+    replacer.save(file, names=names)
+    file.seek(0)
+
+    loaded = ManyToOneReplacer.load(file, names=names)
+
+    assert loaded.replace(f(f(a))) == replacer.replace(f(f(a))) == c
+
+
+SAVE_SCRIPT = """
+import sys
+from matchpy import Arity, CustomConstraint, ManyToOneReplacer, Operation, Pattern, ReplacementRule, Symbol, Wildcard
+
+f = Operation.new('f', Arity.variadic)
+a, b = Symbol('a'), Symbol('b')
+
+def not_a(x):
+    return x != a
+
+def replacement(x):
+    return f(x)
+
+rule = ReplacementRule(Pattern(f(Wildcard.dot('x'), b), CustomConstraint(not_a)), replacement)
+with open(sys.argv[1], 'wb') as file:
+    ManyToOneReplacer(rule).save(file, names={'f': f, 'not_a': not_a, 'replacement': replacement})
+"""
+
+
+def test_save_load_fingerprint_between_processes(tmpdir):
+    path = str(tmpdir.join('replacer.bin'))
+    environment = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    subprocess.check_call([sys.executable, '-c', SAVE_SCRIPT, path], env=environment)
+
+    def not_a(x):
+        return x != a
+
+    def replacement(x):
+        return f(x)
+
+    rule = ReplacementRule(Pattern(f(x_, b), CustomConstraint(not_a)), replacement)
+    names = dict(SAVE_NAMES, not_a=not_a, replacement=replacement)
+    with open(path, 'rb') as file:
+        loaded = ManyToOneReplacer.load(file, names, ManyToOneMatcher.patterns_fingerprint(rule, names=names))
+
+    assert loaded.replace(f(c, b)) == f(c)
+
+
+def test_fingerprint_requires_stable_representation():
+    class Label:
+        pass
+
+    label = Label()
+    matcher = ManyToOneMatcher()
+    matcher.add(Pattern(f(x_)), label)
+
+    with pytest.raises(ValueError):
+        matcher.fingerprint()
+    with pytest.raises(ValueError):
+        matcher.save(io.BytesIO())
+    with pytest.raises(ValueError):
+        ManyToOneMatcher.patterns_fingerprint((Pattern(f(x_)), (a, label)))
+    assert matcher.fingerprint({'label': label}) == \
+        ManyToOneMatcher.patterns_fingerprint((Pattern(f(x_)), label), names={'label': label})
+
+
+@pytest.mark.parametrize('subject, patterns', PARAM_PATTERNS.items())
+def test_remove(subject, patterns):
+    patterns = [Pattern(p) for p in patterns]
+    for removed in patterns:
+        remaining = [p for p in patterns if p != removed]
+        matcher = ManyToOneMatcher(*patterns)
+        expected_matcher = ManyToOneMatcher(*remaining)
+
+        assert matcher.remove(removed) == 1
+
+        assert sorted(str(m) for m in matcher.match(subject)) == \
+            sorted(str(m) for m in expected_matcher.match(subject))
+
+
+def test_commutative_matcher_remove_unknown_pattern():
+    matcher = CommutativeMatcher(None)
+    with pytest.raises(KeyError):
+        matcher.remove_pattern(0)
+
+    pattern_id = matcher.add_pattern([a, x_], [])
+    with pytest.raises(KeyError):
+        matcher.remove_pattern(pattern_id + 1)
+    assert len(matcher.patterns) == 1
+    matcher.remove_pattern(pattern_id)
+    assert len(matcher.patterns) == 0
+
+
+@pytest.mark.parametrize('pattern', [
+    Pattern(f(a, x_)),
+    Pattern(f(a, f_c(x_, a, b))),
+    Pattern(f_c(x_, f(a), ___)),
+    Pattern(f_ac(a, x_, y__)),
+])
+def test_remove_discards_states(pattern):
+    base_patterns = [Pattern(f(a, b)), Pattern(f(x_, y_)), Pattern(f_c(a, b)), Pattern(f_ac(x_, c))]
+    matcher = ManyToOneMatcher(*base_patterns)
+    expected = matcher._count_states_and_transitions()
+
+    matcher.add(pattern)
+    matcher.remove(pattern)
+
+    assert matcher._count_states_and_transitions() == expected
+    for subject in [f(a, b), f(a, c), f_c(a, b), f_ac(a, c, c)]:
+        assert sorted(str(m) for m in matcher.match(subject)) == \
+            sorted(str(m) for m in ManyToOneMatcher(*base_patterns).match(subject))
+
+
+def test_remove_by_label():
+    matcher = ManyToOneMatcher()
+    matcher.add(Pattern(f(a)), 'label')
+    matcher.add(Pattern(f(x_)), 'label')
+    matcher.add(Pattern(f(b)), 'other')
+
+    assert matcher.remove('label') == 2
+    assert list(matcher.match(f(a))) == []
+    assert list(matcher.match(f(b))) == [('other', {})]
+
+    with pytest.raises(ValueError):
+        matcher.remove('label')
+
+    matcher.add(Pattern(f(a)), 'label')
+    assert list(matcher.match(f(a))) == [('label', {})]
+
+
+def test_remove_after_minimize():
+    pattern1 = Pattern(f(a, x_))
+    pattern2 = Pattern(f(b, x_))
+    matcher = ManyToOneMatcher(pattern1, pattern2)
+    matcher.minimize()
+
+    matcher.remove(pattern1)
+
+    assert list(matcher.match(f(a, c))) == []
+    assert list(matcher.match(f(b, c))) == [(pattern2, {'x': c})]
+
+
+def test_remove_reuses_pattern_slots():
+    matcher = ManyToOneMatcher(Pattern(f(x_, b)), Pattern(f_c(b, x_)))
+    for _ in range(10):
+        for symbol in [a, c]:
+            matcher.add(Pattern(f_c(symbol, x_, ___)), symbol)
+            matcher.remove(symbol)
+    matcher.add(Pattern(f(a, x_)), 'new')
+
+    assert len(matcher.patterns) == 3
+    commutative_matcher, = (s.matcher for s in matcher.states.values() if s.matcher is not None)
+    assert len(commutative_matcher.pattern_keys) == 1
+    # The operand patterns b and x_ and one slot that was reused for the operand patterns a and c
+    assert len(commutative_matcher.automaton.patterns) == 3
+    assert sorted((str(l), s) for l, s in matcher.match(f(a, b))) == [('f(x_, b)', {'x': a}), ('new', {'x': b})]
+    assert list(matcher.match(f_c(a, b))) == [(Pattern(f_c(b, x_)), {'x': a})]
+
+
+def test_match_first_prefers_earlier_pattern_in_reused_slot():
+    matcher = ManyToOneMatcher()
+    matcher.add(Pattern(f(a)), 'removed')
+    matcher.add(Pattern(f(x_)), 'first')
+    matcher.remove('removed')
+    matcher.add(Pattern(f(a)), 'second')
+
+    assert matcher.patterns[0][1] == 'second'
+    assert matcher.match_first(f(a)) == ('first', {'x': a})
+
+
+@pytest.mark.parametrize('subject, patterns', PARAM_PATTERNS.items())
+@pytest.mark.parametrize('reverse', [False, True])
+def test_match_first(subject, patterns, reverse):
+    matcher = ManyToOneMatcher()
+    priorities = []
+    for i, pattern in enumerate(patterns):
+        priorities.append((len(patterns) - i if reverse else i) // 2)
+        matcher.add(Pattern(pattern), i, priorities[-1])
+    matches = list(matcher.match(subject))
+
+    result = matcher.match_first(subject)
+
+    if not matches:
+        assert result is None
+    else:
+        best = min((label for label, _ in matches), key=lambda i: (-priorities[i], i))
+        assert result is not None
+        assert result[0] == best
+        assert result in matches
+
+
+def test_match_first_priority_change():
+    pattern1 = Pattern(f(x_))
+    pattern2 = Pattern(f(a))
+    matcher = ManyToOneMatcher(pattern1, pattern2)
+
+    assert matcher.match_first(f(a)) == (pattern1, {'x': a})
+
+    matcher.add(pattern2, priority=1)
+    assert matcher.match_first(f(a)) == (pattern2, {})
+    assert matcher.match_first(f(b)) == (pattern1, {'x': b})
+    assert matcher.match_first(a) is None
+
+
+def test_replacer_rule_priority():
+    replacer = ManyToOneReplacer(ReplacementRule(Pattern(f(x_)), lambda x: b))
+    replacer.add(ReplacementRule(Pattern(f(a)), lambda: c), priority=1)
+
+    assert replacer.replace(f(a)) == c
+    assert replacer.replace(f(c)) == b
+    assert replacer.replace_post_order(f(f(a))) == b
+
+
+def test_replacer_without_priorities_stops_at_first_match(monkeypatch):
+    def first(self):
+        raise AssertionError('The prioritized search is not needed if all rules have the same priority.')
+
+    monkeypatch.setattr(_MatchIter, 'first', first)
+    replacer = ManyToOneReplacer(
+        ReplacementRule(Pattern(f(x_)), lambda x: x), ReplacementRule(Pattern(f2(a)), lambda: c)
+    )
+
+    assert replacer.replace(f(f(f2(a)))) == c
+    assert replacer.replace_post_order(f(f(f2(a)))) == c
+
+
+@pytest.mark.parametrize('subject, patterns', PARAM_PATTERNS.items())
+def test_match_batch(subject, patterns):
+    matcher = ManyToOneMatcher(*(Pattern(p) for p in patterns))
+    subjects = [subject, f(subject), subject, f_c(subject, subject), f(subject)]
+    expected = sorted(
+        (i, str(label), str(substitution)) for i, s in enumerate(subjects) for label, substitution in matcher.match(s)
+    )
+
+    result = sorted((i, str(label), str(substitution)) for i, label, substitution in matcher.match_batch(subjects))
+
+    assert result == expected
+
+
+def test_match_batch_caches_commutative_matches_with_multiset_values(monkeypatch):
+    commutative_match = CommutativeMatcher.match
+    calls = []
+
+    def recording_match(self, *args, **kwargs):
+        calls.append(args[0])
+        return commutative_match(self, *args, **kwargs)
+
+    monkeypatch.setattr(CommutativeMatcher, 'match', recording_match)
+    pattern = Pattern(f(f_c(x___), f_c(x___, y___), z_))
+    matcher = ManyToOneMatcher(pattern)
+    subjects = [f(f_c(a, b), f_c(a, b, c), a), f(f_c(a, b), f_c(a, b, c), b)]
+
+    result = list(matcher.match_batch(subjects))
+
+    assert result == [(i, pattern, s) for i, subject in enumerate(subjects) for s in match(subject, pattern)]
+    assert calls == [f_c(a, b), f_c(a, b, c)]
+
+
+def test_commutative_cache_keeps_steps():
+    matcher = ManyToOneMatcher(Pattern(f(f_c(x___), f_c(x___, y___), z_)))
+    subject = f(f_c(a, b), f_c(a, b, c), a)
+    budget = _Budget()
+    list(matcher._create_match_iter(subject, budget=budget))
+    commutative_cache = {}
+    for _ in range(2):
+        cached_budget = _Budget()
+        match_iter = matcher._create_match_iter(subject, budget=cached_budget)
+        match_iter.commutative_cache = commutative_cache
+        list(match_iter)
+        assert cached_budget.steps == budget.steps
+    with pytest.raises(MatchBudgetExceeded):
+        match_iter = matcher._create_match_iter(subject, budget=_Budget(budget.steps - 1))
+        match_iter.commutative_cache = commutative_cache
+        list(match_iter)
+
+
+def test_match_stream_bounded_caches():
+    pattern = Pattern(f(f_c(a, x_), y_))
+    matcher = ManyToOneMatcher(pattern)
+    subjects = (f(f_c(a, Symbol('s{}'.format(i))), Symbol('t{}'.format(i % 3))) for i in itertools.count())
+    commutative_matchers = list(matcher._get_commutative_matchers())
+    assert commutative_matchers
+
+    results = []
+    for index, label, substitution in matcher.match_stream(subjects, max_cached_subjects=5):
+        assert all(len(m.subjects) <= 5 + 3 for m in commutative_matchers)
+        results.append((index, label, substitution))
+        if len(results) == 20:
+            break
+
+    assert results == [
+        (i, pattern, {'x': Symbol('s{}'.format(i)), 'y': Symbol('t{}'.format(i % 3))}) for i in range(20)
+    ]
+
+
+def _collect_async_matches(matcher, subject, **kwargs):
+    async def collect():
+        return [match async for match in matcher.amatch(subject, **kwargs)]
+    return asyncio.get_event_loop().run_until_complete(collect())
+
+
+@pytest.mark.parametrize('subject, patterns', PARAM_PATTERNS.items())
+@pytest.mark.parametrize('step_interval', [1, 3])
+def test_amatch(subject, patterns, step_interval):
+    matcher = ManyToOneMatcher(*(Pattern(p) for p in patterns))
+    expected = sorted(str(m) for m in matcher.match(subject))
+
+    result = _collect_async_matches(matcher, subject, step_interval=step_interval)
+
+    assert sorted(str(m) for m in result) == expected
+
+
+def test_amatch_yields_to_event_loop():
+    matcher = ManyToOneMatcher(Pattern(f_c(x_, y_, z___)))
+    subject = f_c(a, b, c, d)
+    ticks = []
+
+    async def ticker():
+        while True:
+            ticks.append(None)
+            await asyncio.sleep(0)
+
+    async def collect():
+        task = asyncio.ensure_future(ticker())
+        matches = [match async for match in matcher.amatch(subject, step_interval=1)]
+        task.cancel()
+        return matches
+
+    matches = asyncio.get_event_loop().run_until_complete(collect())
+
+    assert len(matches) == len(list(matcher.match(subject)))
+    assert len(ticks) > 1
+
+
+def test_amatch_executor():
+    matcher = ManyToOneMatcher(Pattern(f(a, x_)), Pattern(f(y_, b)))
+    with concurrent.futures.ThreadPoolExecutor(1) as executor:
+        result = _collect_async_matches(matcher, f(a, b), executor=executor)
+
+    assert sorted(str(m) for m in result) == sorted(str(m) for m in matcher.match(f(a, b)))
+
+
+@pytest.mark.parametrize('subject, patterns', PARAM_PATTERNS.items())
+def test_match_with_budget(subject, patterns):
+    matcher = ManyToOneMatcher(*(Pattern(p) for p in patterns))
+    expected = sorted(str(m) for m in matcher.match(subject))
+
+    matches = matcher.match(subject, max_steps=10**6, timeout=60, partial=True)
+
+    assert sorted(str(m) for m in matches) == expected
+    assert not matches.budget_exceeded
+
+
+def test_match_budget_exceeded():
+    matcher = ManyToOneMatcher(Pattern(f_c(x___, y___, z___)))
+    subject = f_c(*(Symbol('s{}'.format(i)) for i in range(6)))
+
+    with pytest.raises(MatchBudgetExceeded):
+        list(matcher.match(subject, max_steps=50))
+    with pytest.raises(MatchBudgetExceeded):
+        list(matcher.match(subject, timeout=-1))
+    with pytest.raises(MatchBudgetExceeded):
+        matcher.is_match(f_c(a, b), max_steps=1)
+    with pytest.raises(MatchBudgetExceeded):
+        matcher.match_first(subject, max_steps=1)
+
+    matches = matcher.match(subject, max_steps=50, partial=True)
+    partial_matches = list(matches)
+    assert matches.budget_exceeded
+    assert 0 < len(partial_matches) < len(list(matcher.match(subject)))
+    assert matcher.is_match(subject, max_steps=50)
+
+
+def test_replacer_budget_exceeded():
+    replacer = ManyToOneReplacer(
+        ReplacementRule(Pattern(f(a)), lambda: b),
+        ReplacementRule(Pattern(f_c(x___, y___, z___), CustomConstraint(lambda x, y, z: False)), lambda x, y, z: c),
+    )
+    subject = f2(f(a), f_c(*(Symbol('s{}'.format(i)) for i in range(6))))
+
+    with pytest.raises(MatchBudgetExceeded) as exc_info:
+        replacer.replace(subject, max_steps=100)
+    assert exc_info.value.result == f2(b, f_c(*(Symbol('s{}'.format(i)) for i in range(6))))
+
+    with pytest.raises(MatchBudgetExceeded):
+        replacer.replace_post_order(subject, max_steps=100)
+
+    assert replacer.replace(subject, max_steps=10**6) == replacer.replace(subject)
+    assert replacer.replace_post_order(subject, timeout=60) == replacer.replace_post_order(subject)
+
+
+@pytest.mark.parametrize('subject, patterns', PARAM_PATTERNS.items())
+def test_is_match(subject, patterns):
+    for pattern in patterns:
+        matcher = ManyToOneMatcher(Pattern(pattern))
+        assert matcher.is_match(subject) == bool(PARAM_MATCHES[subject, pattern])
+    matcher = ManyToOneMatcher(*(Pattern(p) for p in patterns))
+    assert matcher.is_match(subject) == any(PARAM_MATCHES[subject, p] for p in patterns)
+
+
+def test_is_match_with_constraints():
+    matcher = ManyToOneMatcher(
+        Pattern(f(x_, y_), CustomConstraint(lambda x: x != a)),
+        Pattern(f(x_, x_, y_)),
+        Pattern(f2(x_, y_), MockConstraint(False)),
+    )
+
+    assert not matcher.is_match(f(a, b))
+    assert matcher.is_match(f(b, b))
+    assert matcher.is_match(f(a, a, b))
+    assert not matcher.is_match(f(a, b, b))
+    assert not matcher.is_match(f2(a, b))
+
+
+def test_is_match_skips_partitions_of_unneeded_variables(monkeypatch):
+    partition_iter = many_to_one.commutative_sequence_variable_partition_iter
+    partitions = []
+
+    def recording_partition_iter(values, variables):
+        for partition in partition_iter(values, variables):
+            partitions.append(partition)
+            yield partition
+
+    monkeypatch.setattr(many_to_one, 'commutative_sequence_variable_partition_iter', recording_partition_iter)
+    matcher = ManyToOneMatcher(Pattern(f(f_c(x___, y___, z___), x___)))
+    symbols = [Symbol('s{}'.format(i)) for i in range(8)]
+
+    assert not matcher.is_match(f(f_c(*symbols), a))
+    assert len(partitions) == 2**8
+    assert matcher.is_match(f(f_c(*symbols), symbols[3]))
+
+
+@pytest.mark.parametrize('subject, patterns', PARAM_PATTERNS.items())
+def test_count_matches(subject, patterns):
+    matcher = ManyToOneMatcher(*(Pattern(p) for p in patterns))
+    assert matcher.count_matches(subject) == len(list(matcher.match(subject)))
+
+
+@pytest.mark.parametrize(
+    '   subject',
+    [
+        f_c(a, a, b, c),
+        f_c(a, b, f_c(a, b), f_c(b, c, c)),
+        f(a, f_c(a, b, b, c)),
+        f_ac(a, b, c, c),
+    ]
+)  # yapf: disable
+def test_count_matches_with_constraints(subject):
+    matcher = ManyToOneMatcher(
+        Pattern(f_c(x___, y__)),
+        Pattern(f_c(x___, y__), CustomConstraint(lambda x: len(x) != 1)),
+        Pattern(f_c(x___, x___, y___)),
+        Pattern(f_c(a, x___, f_c(b, y___), z___)),
+        Pattern(f_c(x___, y___), CustomConstraint(lambda x, y: len(x) > len(y))),
+        Pattern(f(x_, f_c(x_, y___, z__))),
+        Pattern(f_ac(x_, y___, z___)),
+    )
+    assert matcher.count_matches(subject) == len(list(matcher.match(subject)))
+
+
+def test_count_matches_large():
+    matcher = ManyToOneMatcher(Pattern(f_c(x__, y___, z___)))
+    subject = f_c(*(Symbol('s{}'.format(i)) for i in range(40)))
+    assert matcher.count_matches(subject) == 3**40 - 2**40
+
+
+@pytest.mark.parametrize('subject, patterns', PARAM_PATTERNS.items())
+def test_match_anywhere(subject, patterns):
+    matcher = ManyToOneMatcher(*(Pattern(p) for p in patterns))
+    subject = f2(subject, f(a, subject), b)
+    expected_matches = [
+        (position, pattern, substitution)
+        for subexpression, position in preorder_iter_with_position(subject)
+        for pattern, substitution in matcher.match(subexpression)
+    ]
+    assert list(matcher.match_anywhere(subject)) == expected_matches
+
+
+def test_match_anywhere_skips_subexpressions(monkeypatch):
+    matcher = ManyToOneMatcher(Pattern(f(x_)))
+    matched = []
+    original_init = _MatchIter.__init__
+
+    def recording_init(self, matcher, subject, *args, **kwargs):
+        matched.append(subject)
+        original_init(self, matcher, subject, *args, **kwargs)
+
+    monkeypatch.setattr(_MatchIter, '__init__', recording_init)
+    matches = list(matcher.match_anywhere(f2(f(a), f2(b, f(a)))))
+    assert [(position, substitution) for position, _, substitution in matches] == \
+        [((0, ), {'x': a}), ((1, 1), {'x': a})]
+    assert matched == [f(a)]
+
+
+@pytest.mark.parametrize('subject, patterns', PARAM_PATTERNS.items())
+def test_profiling_does_not_change_matches(subject, patterns):
+    matcher = ManyToOneMatcher(*(Pattern(p) for p in patterns))
+    expected_matches = list(matcher.match(subject))
+    with matcher.profiling() as profile:
+        assert list(matcher.match(subject)) == expected_matches
+        assert matcher.count_matches(subject) == len(expected_matches)
+    assert sum(profile.matches.values()) == len(expected_matches)
+    assert profile.subjects == 2
+    assert matcher.profile is None
+
+
+def test_profiling_report():
+    matcher = ManyToOneMatcher(
+        Pattern(f_c(x_, y_, z___), CustomConstraint(lambda x, y: x != y)),
+        Pattern(f(a, b)),
+    )
+    with matcher.profiling() as profile:
+        list(matcher.match(f_c(a, b, c)))
+        list(matcher.match(f(b, a)))
+    data = profile.as_dict(sort_by='enumerations')
+    assert data['subjects'] == 2
+    assert [row['label'] for row in data['patterns']] == [str(matcher.patterns[0][0]), str(matcher.patterns[1][0])]
+    commutative_pattern, other_pattern = data['patterns']
+    assert commutative_pattern['matches'] == 6
+    assert commutative_pattern['constraint_calls'] > 0
+    assert commutative_pattern['enumerations'] > 0
+    assert other_pattern['matches'] == 0
+    assert other_pattern['backtracks'] == 1
+    [commutative_matcher] = data['commutative_matchers']
+    assert commutative_matcher['calls'] == 1
+    assert commutative_matcher['patterns'] == [0]
+
+    assert json.loads(profile.to_json(sort_by='enumerations')) == data
+    report = profile.report()
+    assert 'Matched subjects: 2' in report
+    assert str(matcher.patterns[0][0]) in report
+    assert 'Commutative state' in report
+
+    with pytest.raises(ValueError):
+        profile.as_dict(sort_by='unknown')
+
+
+def test_profiling_save_load():
+    matcher = ManyToOneMatcher(Pattern(f(a, x_)))
+    with matcher.profiling():
+        file = io.BytesIO()
+        matcher.save(file, SAVE_NAMES)
+    file.seek(0)
+    loaded = ManyToOneMatcher.load(file, SAVE_NAMES)
+    assert loaded.profile is None
+    assert list(loaded.match(f(a, b))) == [(matcher.patterns[0][0], {'x': b})]
+
+
+def test_signature_prefilter():
+    matcher = ManyToOneMatcher(Pattern(f(a, x_)), Pattern(f(b, x_)), Pattern(f(x_, f(y_))), Pattern(f_i(a, x___)))
+    assert matcher._get_candidate_patterns(f(a, c)) == 0b1001
+    assert matcher._get_candidate_patterns(a) == 0b1000
+    assert matcher._get_candidate_patterns(f(c, f(b))) == 0b0110
+    matcher.remove(Pattern(f(b, x_)))
+    assert matcher._get_candidate_patterns(f(c, f(b))) == 0b0100
+    assert [p for p, _ in matcher.match(f(c, f(b)))] == [Pattern(f(x_, f(y_)))]
+
+
+def test_signature_prefilter_subclass_operation():
+    class SubOperation(f):
+        name = 'sub'
+
+    pattern = Pattern(f(a, x_))
+    subject = SubOperation(a, b)
+    assert list(match(subject, pattern)) == [{'x': b}]
+    assert list(ManyToOneMatcher(pattern).match(subject)) == [(pattern, {'x': b})]
+    assert list(ManyToOneMatcher(pattern).match(f2(subject))) == []
+
+
+@pytest.mark.parametrize(
+    '   substitution,       substitution_lists',
+    [
+        ({},                [[]]),
+        ({},                []),
+        ({'x': a},          []),
+        ({'x': a},          [[{'x': a}, {'x': b}], [{'y': a}, {'y': b}]]),
+        ({},                [[{'x': a}, {'x': b}, {'x': c}], [{'x': b, 'y': a}, {'x': a}], [{'y': a}, {'z': b}]]),
+        ({'x': (a, b)},     [[{'x': Multiset([a, b])}, {'x': Multiset([a])}], [{'x': (a, b), 'y': c}]]),
+    ]
+)  # yapf: disable
+def test_join_substitutions(substitution, substitution_lists):
+    substitution = Substitution(substitution)
+    substitution_lists = [[Substitution(s) for s in substs] for substs in substitution_lists]
+    expected = []
+    for substs in itertools.product(*substitution_lists):
+        try:
+            expected.append(substitution.union(*substs))
+        except ValueError:
+            pass
+    result = list(CommutativeMatcher._join_substitutions(substitution, substitution_lists))
+    assert sorted(map(str, result)) == sorted(map(str, expected))
+
+
+def test_join_substitutions_counts_steps():
+    substitution_lists = [[Substitution({'x': a}), Substitution({'x': b})], [Substitution({'x': c})] * 3]
+    result = list(CommutativeMatcher._join_substitutions(Substitution(), substitution_lists, steps=True))
+    # No union is found, but every tried union is a step: {x: a} and {x: b}, and the three {x: c} with both of them
+    assert result == [many_to_one._STEP] * 8
+
+
+def test_commutative_match_joins_substitutions():
+    f3 = Operation.new('f3', Arity.variadic)
+    pattern = Pattern(f_c(f(x___, y___), f2(y___, z___), f3(z___, x___)))
+    subject = f_c(f(a, b), f2(b, c), f3(c, a))
+    matcher = ManyToOneMatcher(pattern)
+    expected = [substitution for substitution in match(subject, pattern)]
+    result = [substitution for _, substitution in matcher.match(subject)]
+    assert len(expected) > 0
+    assert sorted(map(str, result)) == sorted(map(str, expected))
+
+
+def test_commutative_match_filters_candidate_patterns():
+    patterns = [
+        Pattern(f_c(a, x_)), Pattern(f_c(f(x_), f(x_), y___)), Pattern(f_c(f(a), f2(x_), x___)), Pattern(f_c(b, c)),
+        Pattern(f_c(f2(x_), f2(y_), f(x_))), Pattern(f_c(x___))
+    ]
+    subjects = [f_c(a, b), f_c(b, c), f_c(f(a), f(a), c), f_c(f(a), f2(b), f2(a)), f_c(f2(a), f2(b), f(a)), f_c()]
+    matcher = ManyToOneMatcher()
+    for count, pattern in enumerate(patterns, 1):
+        matcher.add(pattern)
+        for subject in subjects:
+            expected = [(p, s) for p in patterns[:count] for s in match(subject, p)]
+            assert sorted(map(str, matcher.match(subject))) == sorted(map(str, expected))
+    matcher.remove(patterns[1])
+    for subject in subjects:
+        expected = [(p, s) for p in patterns if p != patterns[1] for s in match(subject, p)]
+        assert sorted(map(str, matcher.match(subject))) == sorted(map(str, expected))
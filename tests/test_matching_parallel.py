@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+import itertools
+
+import pytest
+
+from matchpy.expressions.constraints import CustomConstraint
+from matchpy.expressions.expressions import Pattern
+from matchpy.functions import ReplacementRule
+from matchpy.matching.many_to_one import ManyToOneMatcher, ManyToOneReplacer
+from matchpy.matching.parallel import ParallelMatcher
+from .common import *
+
+NAMES = {o.name: o for o in (f, f2, f_u, f_i, f_c, f_ci, f2_c, f_a, f_ac)}
+
+SUBJECTS = [f(a, b), f(a, c), f_c(a, b, c), f(b, b), a, f(a, a), f_c(b, a), f(c, b), f_a(a, b, c)]
+
+PATTERNS = [Pattern(f(a, x_)), Pattern(f(x_, b)), Pattern(f_c(a, x_, ___)), Pattern(f_a(x_, y__))]
+
+
+def _sorted_matches(matches):
+    return sorted((i, str(label), str(substitution)) for i, label, substitution in matches)
+
+
+@pytest.mark.parametrize('ordered', [True, False])
+@pytest.mark.parametrize('chunk_size', [1, 4, 100])
+def test_match(ordered, chunk_size):
+    matcher = ManyToOneMatcher(*PATTERNS)
+    expected = [(i, l, s) for i, subject in enumerate(SUBJECTS) for l, s in matcher.match(subject)]
+
+    with ParallelMatcher(matcher, processes=2, chunk_size=chunk_size, names=NAMES) as parallel_matcher:
+        result = list(parallel_matcher.match(SUBJECTS, ordered=ordered))
+
+    assert _sorted_matches(result) == _sorted_matches(expected)
+    assert all(any(label is pattern for pattern in PATTERNS) for _, label, _ in result)
+    if ordered:
+        assert [i for i, _, _ in result] == sorted(i for i, _, _ in result)
+
+
+def test_replace():
+    a_to_b = lambda: b
+    double = lambda x: f(x, x)
+    replacer = ManyToOneReplacer(ReplacementRule(Pattern(f(a)), a_to_b), ReplacementRule(Pattern(f_u(x_)), double))
+    names = dict(NAMES, a_to_b=a_to_b, double=double)
+    subjects = [f(a), f(f(a)), f_u(a), c, f_u(f(a))]
+
+    with ParallelMatcher(replacer, processes=2, chunk_size=2, names=names) as parallel_matcher:
+        result = list(parallel_matcher.replace(subjects))
+
+    assert result == [(i, replacer.replace(subject)) for i, subject in enumerate(subjects)]
+
+
+def test_replace_requires_replacer():
+    with ParallelMatcher(ManyToOneMatcher(*PATTERNS), processes=1, names=NAMES) as parallel_matcher:
+        with pytest.raises(TypeError):
+            list(parallel_matcher.replace(SUBJECTS))
+
+
+def test_invalid_chunk_size():
+    with pytest.raises(ValueError):
+        ParallelMatcher(ManyToOneMatcher(), chunk_size=0)
+
+
+def test_invalid_max_pending():
+    with pytest.raises(ValueError):
+        ParallelMatcher(ManyToOneMatcher(), max_pending=0)
+
+
+@pytest.mark.parametrize('ordered', [True, False])
+def test_match_endless_subjects(ordered):
+    consumed = []
+
+    def subjects():
+        for i in itertools.count():
+            consumed.append(i)
+            yield f(a, b)
+
+    matcher = ManyToOneMatcher(Pattern(f(a, x_)))
+    with ParallelMatcher(matcher, processes=2, chunk_size=3, names=NAMES, max_pending=2) as parallel_matcher:
+        result = list(itertools.islice(parallel_matcher.match(subjects(), ordered=ordered), 5))
+
+    assert len(result) == 5
+    # Every chunk has 3 matches, so 2 chunks are needed and at most 2 more chunks are pending
+    assert len(consumed) <= 3 * (2 + 2)
+
+
+def _failing_constraint(x):
+    raise RuntimeError('constraint failed for {}'.format(x))
+
+
+@pytest.mark.parametrize('ordered', [True, False])
+def test_error_propagation(ordered):
+    matcher = ManyToOneMatcher(Pattern(f(x_), CustomConstraint(_failing_constraint)))
+    names = dict(NAMES, failing=_failing_constraint)
+
+    with ParallelMatcher(matcher, processes=2, chunk_size=1, names=names) as parallel_matcher:
+        with pytest.raises(RuntimeError):
+            list(parallel_matcher.match([a, f(a)], ordered=ordered))
@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
+import copy
+import io
 import itertools
 import os
+import threading
 
 from hypothesis import assume, example, given
 import hypothesis.strategies as st
@@ -8,9 +11,9 @@ import pytest
 from multiset import Multiset
 
 from matchpy.utils import (
-    VariableWithCount, base_solution_linear, cached_property, commutative_sequence_variable_partition_iter,
-    extended_euclid, fixed_integer_vector_iter, get_short_lambda_source, weak_composition_iter, slot_cached_property,
-    solve_linear_diop
+    VariableWithCount, base_solution_linear, cached_property, commutative_sequence_variable_partition_count,
+    commutative_sequence_variable_partition_iter, extended_euclid, fixed_integer_vector_iter, get_short_lambda_source,
+    weak_composition_iter, slot_cached_property, solve_linear_diop, LinearDiopSolutionCache, OperandCounts
 )
 
 
@@ -254,8 +257,150 @@ class TestCommutativeSequenceVariablePartitionIter:
             assert result_union == values, "Substitution is not a partition of the values"
             count += 1
         assert count == expected_iter_count, "Invalid number of substitution in the iterable"
+        assert commutative_sequence_variable_partition_count(values, variables) == expected_iter_count
 
 
+    def test_impossible_minimum(self):
+        values = Multiset(range(30))
+        variables = [
+            VariableWithCount('x', 1, 20, None),
+            VariableWithCount('y', 1, 11, None),
+            VariableWithCount('z', 1, 0, None),
+        ]
+        assert list(commutative_sequence_variable_partition_iter(values, variables)) == []
+        variables = [VariableWithCount('x', 1, 29, None), VariableWithCount('y', 1, 1, 'd')]
+        result = [
+            dict((name, copy.copy(value)) for name, value in substitution.items())
+            for substitution in commutative_sequence_variable_partition_iter(values, variables)
+        ]
+        assert len(result) == 31
+        assert {'x': Multiset(range(30)), 'y': 'd'} in result
+        assert {'x': Multiset(range(1, 30)), 'y': Multiset([0])} in result
+
+class TestCommutativeSequenceVariablePartitionCount:
+    @given(sequence_vars(), st.lists(st.integers(1, 4), max_size=8), st.lists(st.booleans(), min_size=4, max_size=4))
+    def test_consistent_with_iter(self, variables, values, defaults):
+        values = Multiset(values)
+        variables = [v._replace(default='d') if d else v for v, d in zip(variables, defaults)]
+        expected_count = sum(1 for _ in commutative_sequence_variable_partition_iter(values, variables))
+        assert commutative_sequence_variable_partition_count(values, variables) == expected_count
+
+    def test_large(self):
+        values = Multiset(range(20))
+        variables = [VariableWithCount('x', 1, 1, None), VariableWithCount('y', 1, 0, None)]
+        assert commutative_sequence_variable_partition_count(values, variables) == 2**20 - 1
+
+
+
+class TestOperandCounts:
+    @given(st.lists(st.integers(0, 4)), st.lists(st.integers(0, 5), max_size=4), st.integers(1, 3))
+    def test_subtract(self, values, removed, count):
+        counts = OperandCounts(values)
+        expected = Multiset(values)
+        needed = Multiset(removed) * count
+        result = counts.subtract(removed, count)
+        if needed <= expected:
+            assert result.to_multiset() == expected - needed
+            assert len(result) == len(expected) - len(needed)
+        else:
+            assert result is None
+        assert counts.to_multiset() == expected
+
+    @given(st.lists(st.integers(0, 4)), st.lists(st.integers(0, 3), max_size=5))
+    def test_subtract_vector(self, values, vector):
+        counts = OperandCounts(values)
+        vector = [min(c, v) for c, v in zip(counts.counts, vector + [0] * len(counts.counts))]
+        removed = Multiset(dict((counts.operands[i], c) for i, c in enumerate(vector)))
+        result = counts.subtract_vector(vector)
+        assert result.to_multiset() == Multiset(values) - removed
+        assert len(result) == len(values) - sum(vector)
+
+    def test_items(self):
+        counts = OperandCounts('abcab').subtract_id(2)
+        assert list(counts.items()) == [(0, 'a', 2), (1, 'b', 2)]
+        assert len(counts) == 4
+
+
+class TestLinearDiopSolutionCache:
+    @given(st.integers(0, 20), st.lists(st.integers(1, 5), max_size=4))
+    def test_solutions(self, total, coeffs):
+        cache = LinearDiopSolutionCache()
+        expected = list(solve_linear_diop(total, *coeffs))
+        assert list(cache.solutions(total, *coeffs)) == expected
+        table = cache.table(total, *coeffs)
+        assert table[0] == len(expected)
+        assert list(table[1]) == [k for solution in expected for k in solution]
+        # A hit returns the cached table without copying it
+        assert cache.table(total, *coeffs) is table
+        assert cache.cache_info() == (2, 1, 0, 1024, 1)
+
+    def test_eviction(self):
+        cache = LinearDiopSolutionCache(maxsize=2)
+        for total in [1, 2, 1, 3, 2, 1]:
+            list(cache.solutions(total, 1, 1))
+        # 2 is evicted by 3 since 1 was used more recently, then 1 by 2 and 3 by 1
+        assert cache.cache_info() == (1, 5, 3, 2, 2)
+
+        cache.maxsize = 1
+        assert cache.cache_info().currsize == 1
+        assert list(cache.solutions(1, 1, 1)) == list(solve_linear_diop(1, 1, 1))
+        assert cache.cache_info().hits == 2
+
+        cache.cache_clear()
+        assert cache.cache_info() == (0, 0, 0, 1, 0)
+
+        with pytest.raises(ValueError):
+            LinearDiopSolutionCache(maxsize=-1)
+
+    def test_unbounded(self):
+        cache = LinearDiopSolutionCache(maxsize=None)
+        for total in range(100):
+            list(cache.solutions(total, 1, 2, 3))
+        assert cache.cache_info() == (0, 100, 0, None, 100)
+
+    def test_save_load(self):
+        cache = LinearDiopSolutionCache()
+        for total in range(5):
+            list(cache.solutions(total, 2, 3))
+        list(cache.solutions(0))
+        list(cache.solutions(1))
+        file = io.StringIO()
+        cache.save(file)
+        file.seek(0)
+
+        new_cache = LinearDiopSolutionCache(maxsize=6)
+        new_cache.load(file)
+        assert new_cache.cache_info() == (0, 0, 1, 6, 6)
+        for total in range(1, 5):
+            assert list(new_cache.solutions(total, 2, 3)) == list(solve_linear_diop(total, 2, 3))
+        assert list(new_cache.solutions(0)) == [()]
+        assert list(new_cache.solutions(1)) == []
+        assert new_cache.cache_info().hits == 6
+
+        with pytest.raises(ValueError):
+            new_cache.load(io.StringIO('[]'))
+
+    def test_threads(self):
+        cache = LinearDiopSolutionCache(maxsize=8)
+        errors = []
+
+        def worker():
+            for total in range(30):
+                expected = list(solve_linear_diop(total % 12, 1, 2, 3))
+                if list(cache.solutions(total % 12, 1, 2, 3)) != expected:
+                    errors.append(total)
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert errors == []
+        info = cache.cache_info()
+        assert info.hits + info.misses == 8 * 30
+        assert info.currsize == 8
+
 # yapf: disable
 # =========================================================================
 # DON'T CHANGE THE FORMATTING OF THESE LINES, IT IS IMPORTANT FOR THE TESTS